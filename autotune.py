@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+"""Find the fastest batch / seq-len / threads / data-workers setting for this host.
+
+Example:
+    python autotune.py --config 3b --max-memory-gb 24 --target-tokens 16384 --out tune_3b.json
+    python train.py --config 3b --tune-profile tune_3b.json
+"""
+
+import argparse
+import json
+from src.autotune import autotune, save_profile, total_memory_bytes
+from src.optim import OPTIMIZERS
+from src.adaptive_head import parse_cutoffs
+
+
+def build_cfg(config, vocab_size, moe_top_k=1):
+    # same presets as train.py
+    if config == 'tiny':
+        return {'vocab_size': vocab_size, 'd_model': 128, 'n_layers': 2, 'n_heads': 4, 'd_ff': 256, 'num_experts': 4, 'moe_top_k': moe_top_k}
+    if config == '3b':
+        return {'vocab_size': 5000, 'd_model': 512, 'n_layers': 16, 'n_heads': 8, 'd_ff': 2048, 'num_experts': 8, 'moe_top_k': moe_top_k}
+    return {'vocab_size': vocab_size, 'd_model': 1024, 'n_layers': 22, 'n_heads': 16, 'd_ff': 4096, 'num_experts': 16, 'moe_top_k': moe_top_k}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Throughput autotuner for train.py')
+    parser.add_argument('--config', choices=['tiny', 'default', '3b'], default='tiny')
+    parser.add_argument('--tokenizer', default='data/tokenizer.json', help='Only used for the vocabulary size')
+    parser.add_argument('--moe-top-k', type=int, default=1, choices=[1, 2])
+    parser.add_argument('--adaptive-softmax', default=None, metavar='CUTOFFS', help="Adaptive softmax head: 'auto' or frequency cutoffs like '1000,3000'")
+    parser.add_argument('--pos-encoding', choices=['learned', 'rope'], default='learned', help="'rope' = rotary positions, no 1024-token limit")
+    parser.add_argument('--attn-window', type=int, default=None, help='Sliding attention window (tokens); memory grows linearly with --seq-len')
+    parser.add_argument('--n-kv-heads', type=int, default=None, help='Key/value heads (< n_heads = grouped-query attention, 1 = multi-query)')
+    parser.add_argument('--optimizer', choices=OPTIMIZERS, default='adamw')
+    parser.add_argument('--seq-lens', type=int, nargs='+', default=[64, 128, 256])
+    parser.add_argument('--max-batch', type=int, default=64)
+    parser.add_argument('--threads', type=int, nargs='+', default=None, help='Thread counts to try (default: powers of two up to the core count)')
+    parser.add_argument('--data-workers', type=int, nargs='+', default=[0, 1, 2])
+    parser.add_argument('--max-memory-gb', type=float, default=None, help='Memory ceiling per trial (default: 80%% of RAM / VRAM)')
+    parser.add_argument('--target-tokens', type=int, default=None, help='Tokens per optimizer step; sets accum_steps in the profile')
+    parser.add_argument('--steps', type=int, default=3, help='Timed steps per trial (after 1 warmup step)')
+    parser.add_argument('--trial-timeout', type=float, default=600)
+    parser.add_argument('--out', default='tune_profile.json')
+    args = parser.parse_args()
+
+    with open(args.tokenizer, 'r', encoding='utf-8') as f:
+        vocab_size = len(json.load(f)['vocab'])
+    cfg = build_cfg(args.config, vocab_size, args.moe_top_k)
+    if args.pos_encoding != 'learned':
+        cfg['pos_encoding'] = args.pos_encoding
+    if args.attn_window:
+        cfg['attn_window'] = args.attn_window
+    if args.n_kv_heads:
+        cfg['n_kv_heads'] = args.n_kv_heads
+    if args.adaptive_softmax:
+        cfg['adaptive_cutoffs'] = parse_cutoffs(args.adaptive_softmax, cfg['vocab_size'])
+    if args.max_memory_gb:
+        max_memory = int(args.max_memory_gb * 2 ** 30)
+    else:
+        total = total_memory_bytes()
+        max_memory = int(total * 0.8) if total else None
+    ceiling = f'{max_memory / 2 ** 30:.1f}GB' if max_memory else 'none'
+    print(f'[*] Tuning config={args.config}, memory ceiling {ceiling}')
+
+    profile = autotune(cfg, seq_lens=args.seq_lens, max_batch=args.max_batch, threads=args.threads,
+                       data_workers=args.data_workers, max_memory=max_memory, target_tokens=args.target_tokens,
+                       steps=args.steps, optimizer=args.optimizer, timeout=args.trial_timeout)
+    profile['config'] = args.config
+    save_profile(profile, args.out)
+    print(f"[✓] Best: batch={profile['batch']} seq_len={profile['seq_len']} threads={profile['threads']} "
+          f"data_workers={profile['data_workers']} accum_steps={profile['accum_steps']} "
+          f"-> {profile['tokens_per_s']:.0f} tok/s")
+    print(f'[✓] Profile -> {args.out} (use: python train.py --config {args.config} --tune-profile {args.out})')
+
+
+if __name__ == '__main__':
+    main()
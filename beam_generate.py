@@ -0,0 +1,62 @@
+#!/usr/bin/env python3
+"""Offline generation with batched beam search: one prompt per input line, one JSON object per output line.
+
+Example:
+    python beam_generate.py --checkpoint checkpoints/model_3b.pt --config 3b \
+        --prompts prompts.txt --out outputs.jsonl --beams 4 --batch 16
+"""
+
+import argparse
+import json
+import time
+from src.tokenizer import SimpleTokenizer
+from src.checkpoint import load_model
+from src.beam_search import beam_search
+from src.prefix_cache import PrefixCache
+from evaluate import CONFIGS
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Batched beam search over a prompt file')
+    parser.add_argument('--checkpoint', required=True)
+    parser.add_argument('--config', choices=list(CONFIGS), default='3b')
+    parser.add_argument('--tokenizer', default='data/tokenizer.json')
+    parser.add_argument('--prompts', required=True, help='Text file with one prompt per line')
+    parser.add_argument('--out', required=True, help='Output JSONL file')
+    parser.add_argument('--beams', type=int, default=4)
+    parser.add_argument('--num-return', type=int, default=1, help='Hypotheses kept per prompt')
+    parser.add_argument('--batch', type=int, default=16, help='Prompts per batch (rows = batch x beams)')
+    parser.add_argument('--max-new-tokens', type=int, default=64)
+    parser.add_argument('--length-penalty', type=float, default=1.0)
+    parser.add_argument('--no-early-stopping', action='store_true')
+    parser.add_argument('--prefix-cache-mb', type=float, default=256, help='0 = off')
+    args = parser.parse_args()
+
+    tok = SimpleTokenizer()
+    tok.load(args.tokenizer)
+    with open(args.prompts, 'r', encoding='utf-8') as f:
+        prompts = [line.strip() for line in f if line.strip()]
+    model = load_model(args.checkpoint, dict(CONFIGS[args.config], vocab_size=len(tok.vocab)))
+    prefix_cache = PrefixCache(int(args.prefix_cache_mb * 2 ** 20)) if args.prefix_cache_mb else None
+    print(f'[*] {len(prompts)} prompts, {args.beams} beams, batches of {args.batch}')
+
+    t0, tokens = time.perf_counter(), 0
+    with open(args.out, 'w', encoding='utf-8') as out:
+        for start in range(0, len(prompts), args.batch):
+            chunk = prompts[start:start + args.batch]
+            results = beam_search(model, [tok.encode(p)[:-1] for p in chunk], num_beams=args.beams,
+                                  max_new_tokens=args.max_new_tokens, length_penalty=args.length_penalty,
+                                  early_stopping=not args.no_early_stopping, eos_id=tok.vocab.get('<eos>'),
+                                  pad_id=tok.vocab.get('<pad>', 0), num_return=args.num_return,
+                                  prefix_cache=prefix_cache)
+            for prompt, hyps in zip(chunk, results):
+                tokens += sum(len(ids) for ids, _ in hyps)
+                out.write(json.dumps({'prompt': prompt, 'outputs': [tok.decode(ids) for ids, _ in hyps],
+                                      'scores': [round(s, 4) for _, s in hyps]}) + '\n')
+            print(f'[*] {start + len(chunk)}/{len(prompts)} prompts')
+    elapsed = time.perf_counter() - t0
+    print(f'[✓] wrote {args.out}: {tokens} tokens in {elapsed:.1f}s ({tokens / elapsed:.1f} tok/s)')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+"""Measure speculative decoding (small draft model) against plain decoding.
+
+Example:
+    python bench_speculative.py --checkpoint checkpoints/model_3b.pt --config 3b \
+        --draft-checkpoint checkpoints/model_tiny.pt --draft-config tiny --k 2 4 6
+"""
+
+import argparse
+import time
+import torch
+from src.tokenizer import SimpleTokenizer
+from src.checkpoint import load_model
+from src.generation import generate_ids
+from src.speculative import SpeculativeDecoder
+from evaluate import CONFIGS
+
+DEFAULT_PROMPTS = ['the history of science', 'tell me about the ocean', 'what is machine learning',
+                   'explain how the heart works']
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark speculative decoding')
+    parser.add_argument('--checkpoint', required=True, help='Target model')
+    parser.add_argument('--config', choices=list(CONFIGS), default='3b')
+    parser.add_argument('--draft-checkpoint', required=True)
+    parser.add_argument('--draft-config', choices=list(CONFIGS), default='tiny')
+    parser.add_argument('--tokenizer', default='data/tokenizer.json')
+    parser.add_argument('--prompts', default=None, help='Text file with one prompt per line')
+    parser.add_argument('--k', type=int, nargs='+', default=[2, 4, 6], help='Draft lengths to try')
+    parser.add_argument('--max-new-tokens', type=int, default=64)
+    parser.add_argument('--temperature', type=float, default=0.8)
+    parser.add_argument('--top-k', type=int, default=10, help='0 = greedy')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    tok = SimpleTokenizer()
+    tok.load(args.tokenizer)
+    prompts = DEFAULT_PROMPTS
+    if args.prompts:
+        with open(args.prompts, 'r', encoding='utf-8') as f:
+            prompts = [line.strip() for line in f if line.strip()]
+    encoded = [tok.encode(p)[:-1] for p in prompts]  # without the trailing <eos>
+    target = load_model(args.checkpoint, dict(CONFIGS[args.config], vocab_size=len(tok.vocab)))
+    draft = load_model(args.draft_checkpoint, dict(CONFIGS[args.draft_config], vocab_size=len(tok.vocab)))
+    sampling = dict(max_new_tokens=args.max_new_tokens, temperature=args.temperature, top_k=args.top_k)
+
+    g = torch.Generator().manual_seed(args.seed)
+    t0 = time.perf_counter()
+    tokens = sum(len(generate_ids(target, [p], generator=g, **sampling)[0]) for p in encoded)
+    base = tokens / (time.perf_counter() - t0)
+    print(f'[✓] plain decoding: {base:.1f} tok/s')
+
+    for k in args.k:
+        spec = SpeculativeDecoder(target, draft, k=k)
+        g = torch.Generator().manual_seed(args.seed)
+        for p in encoded:
+            spec.generate(p, generator=g, **sampling)
+        s = spec.stats
+        rate = s['tokens'] / s['seconds']
+        print(f'[✓] k={k}: acceptance {s["accepted"] / max(1, s["drafted"]):.0%}, '
+              f'{s["tokens"] / s["passes"]:.2f} tokens per target pass, {rate:.1f} tok/s, speedup {rate / base:.2f}x')
+
+
+if __name__ == '__main__':
+    main()
@@ -2,52 +2,31 @@
 """Interactive chat interface with MoE AI model."""
 
 import argparse
+import os
 import sys
 import torch
-import torch.nn.functional as F
-from src.model import MoETransformer
 from src.tokenizer import SimpleTokenizer
+from src.checkpoint import load_model
+from src.export import load_exported
+from src.generation import stream_text
+from src.profiling import StepProfiler
+from src.prefix_cache import PrefixCache
+from src.response_cache import ResponseCache, checkpoint_id, tokenizer_hash
+from src.session import ChatSession
+from src.speculative import SpeculativeDecoder
 
 
-def generate(model, tokenizer, prompt, max_len=50, temperature=0.8, top_k=10, system_prompt=None):
-    """Generate text autoregressively from a prompt."""
-    model.eval()
-    
+def generate(model, tokenizer, prompt, max_len=50, temperature=0.8, top_k=10, system_prompt=None, profiler=None,
+             stop=('user:',), prefix_cache=None):
+    """Generate a reply to `prompt`, yielding text pieces as tokens are sampled."""
     # Prepend system prompt if provided
     if system_prompt:
         full_prompt = system_prompt + "\n\nUser: " + prompt + "\n\nDeepErNova: "
     else:
         full_prompt = prompt
     
-    # Encode prompt
-    ids = tokenizer.encode(full_prompt)
-    ids = torch.tensor([ids], dtype=torch.long)
-    
-    # Generate tokens
-    with torch.no_grad():
-        for _ in range(max_len):
-            # Forward pass
-            logits, _ = model(ids)
-            
-            # Get last token logits
-            logits = logits[0, -1, :] / temperature
-            probs = F.softmax(logits, dim=-1)
-            
-            # Top-k sampling
-            if top_k > 0:
-                top_probs, top_indices = torch.topk(probs, min(top_k, len(probs)))
-                next_idx = top_indices[torch.multinomial(top_probs, 1)]
-            else:
-                next_idx = torch.argmax(logits, dim=-1, keepdim=True)
-            
-            # Append to sequence
-            ids = torch.cat([ids, next_idx.unsqueeze(0)], dim=1)
-            
-            # Stop if end-of-sequence (if tokenizer has it)
-            if tokenizer.vocab.get('<eos>', -1) == next_idx.item():
-                break
-    
-    return tokenizer.decode(ids[0].tolist())
+    yield from stream_text(model, tokenizer, full_prompt, stop=stop, max_new_tokens=max_len,
+                           temperature=temperature, top_k=top_k, profiler=profiler, prefix_cache=prefix_cache)
 
 
 def load_model_and_tokenizer(checkpoint_path, tokenizer_path, config_dict):
@@ -59,8 +38,9 @@ def load_model_and_tokenizer(checkpoint_path, tokenizer_path, config_dict):
     
     print(f"[INFO] Loaded tokenizer: vocab_size={vocab_size}")
     
-    # Create model with tokenizer vocab size
-    model = MoETransformer(
+    # Build the model on the meta device and assign the (memory-mapped)
+    # checkpoint tensors directly: no random init, no second full copy
+    cfg = dict(
         vocab_size=vocab_size,
         d_model=config_dict['d_model'],
         n_layers=config_dict['n_layers'],
@@ -69,23 +49,31 @@ def load_model_and_tokenizer(checkpoint_path, tokenizer_path, config_dict):
         num_experts=config_dict['num_experts'],
         moe_top_k=config_dict['moe_top_k']
     )
-    
-    print(f"[INFO] Created model: {sum(p.numel() for p in model.parameters()) / 1e6:.1f}M params")
-    
-    # Load checkpoint
-    checkpoint = torch.load(checkpoint_path, map_location='cpu')
-    model.load_state_dict(checkpoint, strict=False)
+    model = load_model(checkpoint_path, cfg)
     model.eval()
     
+    print(f"[INFO] Created model: {sum(p.numel() for p in model.parameters()) / 1e6:.1f}M params")
     print(f"[INFO] Loaded checkpoint: {checkpoint_path}")
     
     return model, tokenizer
 
 
+def load_artifact_and_tokenizer(artifact_path, tokenizer_path):
+    """Load an exported inference artifact (see export_model.py) and the tokenizer."""
+    tokenizer = SimpleTokenizer()
+    tokenizer.load(tokenizer_path)
+    print(f"[INFO] Loaded tokenizer: vocab_size={len(tokenizer.vocab)}")
+    model = load_exported(artifact_path)
+    print(f"[INFO] Loaded {model.format} artifact: {artifact_path}")
+    return model, tokenizer
+
+
 def main():
     parser = argparse.ArgumentParser(description='Chat with MoE AI')
     parser.add_argument('--checkpoint', default='checkpoints/model_epoch2.pt',
                         help='Path to model checkpoint')
+    parser.add_argument('--artifact', default=None,
+                        help='Exported model (export_model.py) to run instead of --checkpoint')
     parser.add_argument('--tokenizer', default='data/tokenizer.json',
                         help='Path to tokenizer')
     parser.add_argument('--max-len', type=int, default=50,
@@ -94,10 +82,38 @@ def main():
                         help='Sampling temperature')
     parser.add_argument('--top-k', type=int, default=10,
                         help='Top-k for sampling (0=argmax)')
+    parser.add_argument('--top-p', type=float, default=1.0,
+                        help='Nucleus sampling: smallest set of tokens with this much probability')
+    parser.add_argument('--repetition-penalty', type=float, default=1.0,
+                        help='>1 discourages tokens already in the conversation')
     parser.add_argument('--config', default='3b',
                         help='Model config (tiny/default/3b)')
+    parser.add_argument('--stop', nargs='*', default=['user:'],
+                        help='Stop the reply at any of these strings (matched on lowercased output)')
+    parser.add_argument('--max-context', type=int, default=None,
+                        help='Conversation tokens kept; older turns are dropped (default: 1024 for learned positions)')
+    parser.add_argument('--session', default=None,
+                        help='Resume the conversation from this file if it exists and save it there on exit')
+    parser.add_argument('--draft-checkpoint', default=None,
+                        help='Small model (same tokenizer) that drafts tokens for speculative decoding')
+    parser.add_argument('--draft-config', default='tiny', help='Config of the draft model')
+    parser.add_argument('--spec-k', type=int, default=4, help='Tokens drafted per verification pass')
+    parser.add_argument('--prefix-cache-mb', type=float, default=256,
+                        help='Keep the system prompt (and earlier prompts) KV cached across turns; 0 = off')
+    parser.add_argument('--response-cache', type=int, default=0,
+                        help='Replies kept in memory for repeated greedy (--top-k 0) conversations; 0 = off')
+    parser.add_argument('--response-cache-dir', default=None,
+                        help='Also keep cached replies in this directory, across runs')
+    parser.add_argument('--profile-steps', default=None,
+                        help="Profile decode steps 'start:count' (counted across replies) with torch.profiler")
+    parser.add_argument('--profile-dir', default='profiles',
+                        help='Where profiler traces go')
     
     args = parser.parse_args()
+    if args.artifact and args.draft_checkpoint:
+        parser.error('speculative decoding needs the eager target model; drop --artifact or --draft-checkpoint')
+    if args.draft_checkpoint and (args.top_p != 1.0 or args.repetition_penalty != 1.0):
+        parser.error('speculative decoding supports --temperature / --top-k only; drop --top-p / --repetition-penalty')
     
     # Model configs
     configs = {
@@ -138,9 +154,36 @@ You provide clear and concise answers to questions."""
     print("\n" + "="*60)
     print("Loading MoE AI Model...")
     print("="*60)
-    model, tokenizer = load_model_and_tokenizer(
-        args.checkpoint, args.tokenizer, config_dict
-    )
+    if args.artifact:
+        model, tokenizer = load_artifact_and_tokenizer(args.artifact, args.tokenizer)
+    else:
+        model, tokenizer = load_model_and_tokenizer(
+            args.checkpoint, args.tokenizer, config_dict
+        )
+    
+    profiler = StepProfiler(args.profile_steps, out_dir=args.profile_dir, name='generate')
+    prefix_cache = PrefixCache(int(args.prefix_cache_mb * 2 ** 20)) if args.prefix_cache_mb else None
+    response_cache = None
+    if args.response_cache or args.response_cache_dir:
+        response_cache = ResponseCache(checkpoint_id(args.artifact or args.checkpoint), tokenizer_hash(tokenizer),
+                                       max_entries=args.response_cache, directory=args.response_cache_dir)
+    speculative = None
+    if args.draft_checkpoint:
+        draft = load_model(args.draft_checkpoint, dict(configs[args.draft_config], vocab_size=len(tokenizer.vocab)))
+        speculative = SpeculativeDecoder(model, draft, k=args.spec_k)
+        print(f"[INFO] Speculative decoding with draft {args.draft_checkpoint} (k={args.spec_k})")
+    # The conversation (ids + KV cache) lives across turns: each turn only prefills the new message
+    if args.session and os.path.exists(args.session):
+        session = ChatSession.load(args.session, model, tokenizer, prefix_cache=prefix_cache, speculative=speculative,
+                                   response_cache=response_cache)
+        print(f"[INFO] Resumed session {args.session} ({len(session.ids)} tokens)")
+    else:
+        session = ChatSession(model, tokenizer, system_prompt=system_prompt, max_context=args.max_context,
+                              prefix_cache=prefix_cache, speculative=speculative, response_cache=response_cache)
+    
+    # Only pass the extra sampling settings when used (speculative decoding supports temperature / top-k)
+    extra_sampling = {k: v for k, v in (('top_p', args.top_p), ('repetition_penalty', args.repetition_penalty))
+                      if v != 1.0}
     
     # Interactive chat loop
     print("\n" + "="*60)
@@ -158,17 +201,19 @@ You provide clear and concise answers to questions."""
                 print("\nDeepErNova: Goodbye! Thank you for chatting with me. Have a great day!")
                 break
             
-            # Generate response
+            # Stream the response as it is generated
             print("\nDeepErNova: ", end="", flush=True)
-            response = generate(
-                model, tokenizer, user_input,
-                max_len=args.max_len,
+            for piece in session.reply(
+                user_input,
+                max_new_tokens=args.max_len,
                 temperature=args.temperature,
                 top_k=args.top_k,
-                system_prompt=system_prompt
-            )
-            print(response)
-            print()
+                profiler=profiler,
+                stop=args.stop,
+                **extra_sampling
+            ):
+                print(piece, end="", flush=True)
+            print("\n")
             
         except KeyboardInterrupt:
             print("\n\nExiting...")
@@ -176,6 +221,17 @@ You provide clear and concise answers to questions."""
         except Exception as e:
             print(f"\n[ERROR] {e}")
             print()
+    
+    profiler.stop()
+    if args.session:
+        session.save(args.session)
+        print(f"[INFO] Saved session to {args.session}")
+    if prefix_cache is not None:
+        print(f"[INFO] {prefix_cache.summary()}")
+    if speculative is not None:
+        print(f"[INFO] {speculative.summary()}")
+    if response_cache is not None:
+        print(f"[INFO] {response_cache.summary()}")
 
 
 if __name__ == '__main__':
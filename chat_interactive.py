@@ -1,41 +1,22 @@
 #!/usr/bin/env python3
-"""Interactive chat with MoE model - simple and user-friendly."""
+"""Interactive chat with MoE model - simple and user-friendly.
+
+Usage: python chat_interactive.py [artifact.pt2]   (an export_model.py artifact instead of the checkpoint)
+"""
 
 import sys
 sys.path.insert(0, '.')
 
 import torch
-from src.model import MoETransformer
+from src.checkpoint import load_model
+from src.export import load_exported
 from src.tokenizer import SimpleTokenizer
-import torch.nn.functional as F
+from src.generation import stream_text
 
 def generate(model, tokenizer, prompt, max_len=50, temperature=0.8, top_k=15, device='cpu'):
-    """Generate text from prompt."""
-    model.eval()
-    
-    ids = tokenizer.encode(prompt)
-    ids = torch.tensor([ids], dtype=torch.long, device=device)
-    
-    with torch.no_grad():
-        for _ in range(max_len):
-            logits, _ = model(ids)
-            logits = logits[0, -1, :] / temperature
-            probs = F.softmax(logits, dim=-1)
-            
-            if top_k > 0:
-                top_probs, top_indices = torch.topk(probs, min(top_k, len(probs)))
-                next_idx = top_indices[torch.multinomial(top_probs, 1)]
-            else:
-                next_idx = torch.argmax(logits, dim=-1, keepdim=True)
-            
-            ids = torch.cat([ids, next_idx.unsqueeze(0)], dim=1)
-            
-            # Stop if <eos>
-            eos_id = tokenizer.vocab.get('<eos>', -1)
-            if next_idx.item() == eos_id:
-                break
-    
-    return tokenizer.decode(ids[0].tolist())
+    """Generate a reply to prompt, yielding text pieces as they are sampled."""
+    yield from stream_text(model, tokenizer, prompt, unk_text='?', max_new_tokens=max_len,
+                           temperature=temperature, top_k=top_k)
 
 def main():
     # Config - tiny model
@@ -61,26 +42,24 @@ def main():
     tokenizer.load('data/tokenizer.json')
     print(f"[✓] Vocab size: {len(tokenizer.vocab)}")
     
-    # Create model
-    print("[*] Creating model...")
-    model = MoETransformer(
-        vocab_size=len(tokenizer.vocab),
-        **config
-    ).to(device)
+    cfg = dict(vocab_size=len(tokenizer.vocab), **config)
+    if len(sys.argv) > 1:
+        # Exported graph + weights: no model construction in Python
+        print("[*] Loading artifact...")
+        model = load_exported(sys.argv[1])
+        print(f"[✓] Loaded {model.format} artifact: {sys.argv[1]}")
+    else:
+        # Load checkpoint straight into a meta-device model (single allocation)
+        print("[*] Loading checkpoint...")
+        try:
+            model = load_model('checkpoints/model_epoch5.pt', cfg, device=device)
+            print(f"[✓] Loaded: model_epoch5.pt")
+        except FileNotFoundError:
+            print(f"[!] model_epoch5.pt not found, trying model_epoch2.pt...")
+            model = load_model('checkpoints/model_epoch2.pt', cfg, device=device)
+            print(f"[✓] Loaded: model_epoch2.pt")
     print(f"[✓] Model: {sum(p.numel() for p in model.parameters()) / 1e6:.1f}M params")
     
-    # Load checkpoint
-    print("[*] Loading checkpoint...")
-    try:
-        checkpoint = torch.load('checkpoints/model_epoch5.pt', map_location=device)
-        model.load_state_dict(checkpoint, strict=False)
-        print(f"[✓] Loaded: model_epoch5.pt")
-    except FileNotFoundError:
-        print(f"[!] model_epoch5.pt not found, trying model_epoch2.pt...")
-        checkpoint = torch.load('checkpoints/model_epoch2.pt', map_location=device)
-        model.load_state_dict(checkpoint, strict=False)
-        print(f"[✓] Loaded: model_epoch2.pt")
-    
     print(f"\n{'='*60}")
     print("Chat Started! Type 'quit' or 'exit' to stop.")
     print(f"{'='*60}\n")
@@ -97,15 +76,14 @@ def main():
                 print("\nGoodbye! 👋")
                 break
             
-            # Generate response
-            response = generate(
+            # Stream the response (<unk> shown as '?', stops at <eos>)
+            print("AI:  ", end="", flush=True)
+            for piece in generate(
                 model, tokenizer, user_input,
                 max_len=50, temperature=0.7, top_k=15, device=device
-            )
-            
-            # Clean output
-            response = response.replace('<eos>', '').replace('<unk>', '?').strip()
-            print(f"AI:  {response}\n")
+            ):
+                print(piece, end="", flush=True)
+            print("\n")
         
         except KeyboardInterrupt:
             print("\n\nInterrupted. Goodbye! 👋")
@@ -0,0 +1,40 @@
+#!/usr/bin/env python3
+"""Convert a checkpoint to grouped-query / multi-query attention.
+
+Key/value heads are mean-pooled in groups of n_heads / n_kv_heads (legacy
+nn.MultiheadAttention checkpoints are split into q/k/v projections first).
+Fine-tune briefly after converting to recover quality.
+
+Example:
+    python convert_gqa.py --checkpoint checkpoints/model_epoch5.pt --n-heads 8 --n-kv-heads 2 --out checkpoints/model_epoch5_kv2.pt
+    python chat.py --checkpoint checkpoints/model_epoch5_kv2.pt
+"""
+
+import argparse
+import torch
+from src.checkpoint import load_state_dict
+from src.attention import convert_state_dict
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Mean-pool attention KV heads of a checkpoint')
+    parser.add_argument('--checkpoint', required=True)
+    parser.add_argument('--out', required=True)
+    parser.add_argument('--n-heads', type=int, required=True, help='Query heads of the model (8 for the 3b config)')
+    parser.add_argument('--n-kv-heads', type=int, required=True)
+    args = parser.parse_args()
+    if args.n_heads % args.n_kv_heads:
+        parser.error('--n-heads must be a multiple of --n-kv-heads')
+
+    state_dict = load_state_dict(args.checkpoint, mmap=False)
+    converted = convert_state_dict(state_dict, args.n_heads, args.n_kv_heads)
+    before = sum(t.numel() for k, t in state_dict.items() if '.attn.' in k)
+    after = sum(t.numel() for k, t in converted.items() if '.attn.' in k)
+    torch.save(converted, args.out)
+    print(f'[✓] {args.checkpoint} -> {args.out}: {args.n_heads} -> {args.n_kv_heads} KV heads, '
+          f'attention params {before / 1e6:.2f}M -> {after / 1e6:.2f}M, '
+          f'KV cache {args.n_kv_heads / args.n_heads:.0%} of before')
+
+
+if __name__ == '__main__':
+    main()
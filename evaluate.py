@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+"""Held-out perplexity for a trained checkpoint.
+
+Example:
+    python evaluate.py --checkpoint checkpoints/model_epoch2.pt --files data/val.txt --config 3b --workers 4
+"""
+
+import argparse
+import json
+import torch
+from src.tokenizer import SimpleTokenizer
+from src.checkpoint import load_model
+from src.evaluation import load_eval_batches, evaluate, evaluate_parallel, combine_metrics, format_metrics
+
+
+CONFIGS = {
+    'tiny': {'d_model': 128, 'n_layers': 2, 'n_heads': 4, 'd_ff': 256, 'num_experts': 4, 'moe_top_k': 1},
+    'default': {'d_model': 256, 'n_layers': 8, 'n_heads': 8, 'd_ff': 1024, 'num_experts': 8, 'moe_top_k': 1},
+    '3b': {'d_model': 512, 'n_layers': 16, 'n_heads': 8, 'd_ff': 2048, 'num_experts': 8, 'moe_top_k': 1},
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Evaluate perplexity on held-out text')
+    parser.add_argument('--checkpoint', required=True)
+    parser.add_argument('--tokenizer', default='data/tokenizer.json')
+    parser.add_argument('--config', choices=list(CONFIGS), default='tiny', help='Same config the model was trained with')
+    parser.add_argument('--files', nargs='+', required=True, help='One or more held-out text files (one example per line)')
+    parser.add_argument('--seq-len', type=int, default=128)
+    parser.add_argument('--batch', type=int, default=64, help='Eval batch size (no activations are kept, so go big)')
+    parser.add_argument('--max-lines', type=int, default=None, help='Only use the first N lines of each file')
+    parser.add_argument('--workers', type=int, default=1, help='Split evaluation across N CPU processes')
+    parser.add_argument('--json', default=None, help='Also write the metrics to this JSON file')
+    args = parser.parse_args()
+
+    tok = SimpleTokenizer()
+    tok.load(args.tokenizer)
+    cfg = dict(CONFIGS[args.config], vocab_size=len(tok.vocab))
+    print(f'[*] Loading {args.checkpoint}...')
+    model = load_model(args.checkpoint, cfg)
+    device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
+
+    results = {}
+    for path in args.files:
+        batches = load_eval_batches(path, tok, seq_len=args.seq_len, batch_size=args.batch, max_lines=args.max_lines)
+        if args.workers > 1 and device.type == 'cpu':
+            m = evaluate_parallel(model, batches, workers=args.workers)
+        else:
+            m = evaluate(model.to(device), batches, device=device)
+        results[path] = m
+        print(f'[✓] {path}: {format_metrics(m)}')
+
+    if len(results) > 1:
+        total = combine_metrics(list(results.values()))
+        results['total'] = total
+        print(f'[✓] total: {format_metrics(total)}')
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
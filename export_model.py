@@ -0,0 +1,49 @@
+#!/usr/bin/env python3
+"""Export a checkpoint as one self-contained inference artifact (graph + weights).
+
+Example:
+    python export_model.py --checkpoint checkpoints/model_3b.pt --config 3b --out checkpoints/model_3b.pt2
+    python chat.py --artifact checkpoints/model_3b.pt2
+"""
+
+import argparse
+import os
+import time
+from src.tokenizer import SimpleTokenizer
+from src.checkpoint import load_model
+from src.export import FORMATS, export_model, load_exported
+from src.generation import generate_ids
+from src.response_cache import checkpoint_id
+from evaluate import CONFIGS
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Ahead-of-time export of the inference graph')
+    parser.add_argument('--checkpoint', required=True)
+    parser.add_argument('--config', choices=list(CONFIGS), default='3b', help='Same config the model was trained with')
+    parser.add_argument('--tokenizer', default='data/tokenizer.json')
+    parser.add_argument('--out', required=True, help='Artifact path (e.g. checkpoints/model_3b.pt2)')
+    parser.add_argument('--format', choices=FORMATS, default='export',
+                        help='torch.export (falls back to TorchScript if it fails) or TorchScript directly')
+    parser.add_argument('--device', default='cpu', help='Device the artifact will run on')
+    args = parser.parse_args()
+
+    tok = SimpleTokenizer()
+    tok.load(args.tokenizer)
+    model = load_model(args.checkpoint, dict(CONFIGS[args.config], vocab_size=len(tok.vocab)), device=args.device)
+    print(f'[*] Exporting {args.checkpoint} ({sum(p.numel() for p in model.parameters()) / 1e6:.1f}M params)...')
+    t0 = time.perf_counter()
+    fmt = export_model(model, args.out, fmt=args.format, extra_meta={'checkpoint_id': checkpoint_id(args.checkpoint)})
+    print(f'[✓] {fmt} artifact {args.out} ({os.path.getsize(args.out) / 2 ** 20:.1f}MB) in {time.perf_counter() - t0:.1f}s')
+
+    # the artifact must decode exactly like the eager model
+    t0 = time.perf_counter()
+    loaded = load_exported(args.out)
+    print(f'[✓] loaded in {time.perf_counter() - t0:.2f}s')
+    prompts = [tok.encode(p)[:-1] for p in ('hello', 'tell me about the ocean')]
+    same = generate_ids(loaded, prompts, max_new_tokens=16, top_k=0) == generate_ids(model, prompts, max_new_tokens=16, top_k=0)
+    print(f'[{"✓" if same else "!"}] greedy output {"matches" if same else "DIFFERS from"} the eager model')
+
+
+if __name__ == '__main__':
+    main()
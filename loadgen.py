@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+"""Load generator for serve.py: open-loop Poisson arrivals, latency percentiles.
+
+Example:
+    python loadgen.py --url http://127.0.0.1:8000 --requests 200 --rate 20 --max-new-tokens 32 --stream
+"""
+
+import argparse
+import asyncio
+import json
+import random
+import time
+from urllib.parse import urlparse
+
+DEFAULT_PROMPTS = [
+    'the history of science', 'tell me about the ocean', 'what is machine learning',
+    'write a short story about a robot', 'explain how the heart works', 'the economy of ancient rome',
+]
+
+
+async def _post(host, port, body, stream):
+    """POST /generate; returns (time to first token, total latency, generated tokens)."""
+    t0 = time.perf_counter()
+    reader, writer = await asyncio.open_connection(host, port)
+    data = json.dumps(body).encode('utf-8')
+    writer.write(f'POST /generate HTTP/1.1\r\nHost: {host}\r\nContent-Type: application/json\r\n'
+                 f'Content-Length: {len(data)}\r\nConnection: close\r\n\r\n'.encode('latin-1') + data)
+    await writer.drain()
+    status = (await reader.readline()).split()[1]
+    if status != b'200':
+        writer.close()
+        return None
+    while (await reader.readline()).strip():
+        pass
+    ttft, summary = None, None
+    if stream:
+        while True:
+            size = int((await reader.readline()).strip(), 16)
+            if size == 0:
+                break
+            event = json.loads(await reader.readexactly(size))
+            await reader.readline()
+            if ttft is None:
+                ttft = time.perf_counter() - t0
+            if event.get('done'):
+                summary = event
+    else:
+        summary = json.loads(await reader.read())
+        ttft = summary['ttft_s']
+    writer.close()
+    return ttft, time.perf_counter() - t0, summary['tokens']
+
+
+def _pct(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))] if values else float('nan')
+
+
+async def run(args, prompts):
+    url = urlparse(args.url)
+    rng = random.Random(args.seed)
+    tasks = []
+    t0 = time.perf_counter()
+    for i in range(args.requests):
+        body = {'prompt': rng.choice(prompts), 'max_new_tokens': args.max_new_tokens,
+                'temperature': args.temperature, 'top_k': args.top_k, 'stream': args.stream}
+        tasks.append(asyncio.create_task(_post(url.hostname, url.port or 80, body, args.stream)))
+        if args.rate:
+            await asyncio.sleep(rng.expovariate(args.rate))
+    results = await asyncio.gather(*tasks, return_exceptions=True)
+    elapsed = time.perf_counter() - t0
+    ok = [r for r in results if isinstance(r, tuple)]
+    tokens = sum(r[2] for r in ok)
+    print(f'[✓] {len(ok)}/{len(results)} ok in {elapsed:.1f}s: {tokens / elapsed:.1f} tok/s, '
+          f'{len(ok) / elapsed:.2f} req/s')
+    for name, idx in (('ttft', 0), ('latency', 1)):
+        vals = [r[idx] for r in ok]
+        print(f'    {name:<8} p50 {_pct(vals, 0.5) * 1e3:.0f}ms  p95 {_pct(vals, 0.95) * 1e3:.0f}ms  '
+              f'p99 {_pct(vals, 0.99) * 1e3:.0f}ms')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark serve.py')
+    parser.add_argument('--url', default='http://127.0.0.1:8000')
+    parser.add_argument('--requests', type=int, default=100)
+    parser.add_argument('--rate', type=float, default=10.0, help='Mean arrivals per second (0 = all at once)')
+    parser.add_argument('--prompts', default=None, help='Text file with one prompt per line')
+    parser.add_argument('--max-new-tokens', type=int, default=32)
+    parser.add_argument('--temperature', type=float, default=0.8)
+    parser.add_argument('--top-k', type=int, default=10)
+    parser.add_argument('--stream', action='store_true', help='Use streaming responses (measures real TTFT)')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    prompts = DEFAULT_PROMPTS
+    if args.prompts:
+        with open(args.prompts, 'r', encoding='utf-8') as f:
+            prompts = [line.strip() for line in f if line.strip()]
+    asyncio.run(run(args, prompts))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+"""Continuous-batching HTTP inference server.
+
+Example:
+    python serve.py --checkpoint checkpoints/model_epoch5.pt --config 3b --max-batch 32 --max-kv-mb 2048
+    curl -s localhost:8000/generate -d '{"prompt": "hello", "max_new_tokens": 20, "stream": true}'
+    python loadgen.py --requests 200 --rate 20
+"""
+
+import argparse
+import asyncio
+import torch
+from src.tokenizer import SimpleTokenizer
+from src.checkpoint import load_model
+from src.serving import BatchEngine, InferenceServer, kv_bytes_per_token
+from src.prefix_cache import PrefixCache
+from src.response_cache import ResponseCache, checkpoint_id, tokenizer_hash
+from evaluate import CONFIGS
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Serve a checkpoint over HTTP with continuous batching')
+    parser.add_argument('--checkpoint', required=True)
+    parser.add_argument('--tokenizer', default='data/tokenizer.json')
+    parser.add_argument('--config', choices=list(CONFIGS), default='3b', help='Same config the model was trained with')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--max-batch', type=int, default=16, help='Most requests decoded together')
+    parser.add_argument('--max-kv-mb', type=float, default=None,
+                        help='KV cache budget; requests wait in the queue until they fit')
+    parser.add_argument('--prefix-cache-mb', type=float, default=256,
+                        help='Memory for KV blocks of shared prompt prefixes (0 = off)')
+    parser.add_argument('--response-cache', type=int, default=0,
+                        help='Responses kept in memory for repeated greedy/seeded requests (0 = off)')
+    parser.add_argument('--response-cache-dir', default=None,
+                        help='Also keep cached responses in this directory, across restarts')
+    parser.add_argument('--max-queue', type=int, default=256, help='Requests beyond this are rejected with 503')
+    parser.add_argument('--threads', type=int, default=None, help='torch intra-op threads')
+    args = parser.parse_args()
+
+    if args.threads:
+        torch.set_num_threads(args.threads)
+    tok = SimpleTokenizer()
+    tok.load(args.tokenizer)
+    cfg = dict(CONFIGS[args.config], vocab_size=len(tok.vocab))
+    print(f'[*] Loading {args.checkpoint}...')
+    device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
+    model = load_model(args.checkpoint, cfg, device=device)
+    max_kv = int(args.max_kv_mb * 2 ** 20) if args.max_kv_mb else None
+    prefix_cache = PrefixCache(int(args.prefix_cache_mb * 2 ** 20)) if args.prefix_cache_mb else None
+    engine = BatchEngine(model, max_batch=args.max_batch, max_kv_bytes=max_kv, prefix_cache=prefix_cache)
+    response_cache = None
+    if args.response_cache or args.response_cache_dir:
+        response_cache = ResponseCache(checkpoint_id(args.checkpoint), tokenizer_hash(tok),
+                                       max_entries=args.response_cache, directory=args.response_cache_dir)
+    print(f'[✓] {sum(p.numel() for p in model.parameters()) / 1e6:.1f}M params, '
+          f'{kv_bytes_per_token(model) / 1024:.1f}KB KV cache per token')
+    print(f'[*] Listening on http://{args.host}:{args.port} (POST /generate, GET /stats)')
+    server = InferenceServer(engine, tok, max_queue=args.max_queue, response_cache=response_cache)
+    try:
+        asyncio.run(server.serve(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
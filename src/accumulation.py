@@ -0,0 +1,69 @@
+import contextlib
+import torch
+import torch.distributed as dist
+
+
+def count_target_tokens(batch, pad_id=0):
+    """Number of real (non-pad) next-token targets in a (batch, seq) id tensor."""
+    return int((batch[:, 1:] != pad_id).sum())
+
+
+def macro_batches(loader, accum_steps=1, target_tokens=0, pad_id=0):
+    """Group micro-batches from `loader` into macro-batches (lists of batches).
+
+    - by default a macro-batch is `accum_steps` micro-batches.
+    - with `target_tokens > 0` micro-batches are added until the macro-batch
+      holds at least that many non-pad target tokens.
+    - a trailing partial macro-batch at the end of the loader is yielded too.
+    """
+    group, tokens = [], 0
+    for batch in loader:
+        group.append(batch)
+        tokens += count_target_tokens(batch, pad_id)
+        full = tokens >= target_tokens if target_tokens > 0 else len(group) >= accum_steps
+        if full:
+            yield group
+            group, tokens = [], 0
+    if group:
+        yield group
+
+
+def accumulate_gradients(model, micro_batches, aux_weight=1e-2, pad_id=0, no_sync=None, telemetry=None):
+    """Forward/backward every micro-batch of one macro-batch.
+
+    Each micro-batch contributes its *summed* token cross-entropy divided by
+    the macro-batch's total non-pad target tokens, so the accumulated gradient
+    is the gradient of the mean loss over all real tokens, independent of how
+    they were split into micro-batches or padded. Under torch.distributed the
+    token count is all-reduced so DDP's gradient averaging yields the global
+    token mean. The MoE auxiliary loss is averaged over micro-batches.
+
+    `no_sync` (e.g. `ddp_model.no_sync`) suppresses gradient all-reduce on all
+    but the last micro-batch. Clipping and the optimizer step are left to the
+    caller, once per macro-batch. With a `Telemetry`, forward and backward
+    time are recorded as phases.
+
+    Returns (mean token loss, number of target tokens) for this rank.
+    """
+    n_tokens = sum(count_target_tokens(b, pad_id) for b in micro_batches)
+    total = torch.tensor(float(n_tokens))
+    scale = 1.0
+    if dist.is_available() and dist.is_initialized():
+        dist.all_reduce(total)
+        scale = dist.get_world_size()
+    denom = max(float(total), 1.0) / scale
+
+    phase = telemetry.phase if telemetry is not None else (lambda name: contextlib.nullcontext())
+    loss_sum = 0.0
+    for i, batch in enumerate(micro_batches):
+        last = i == len(micro_batches) - 1
+        ctx = no_sync() if no_sync is not None and not last else contextlib.nullcontext()
+        with ctx:
+            with phase('forward'):
+                inputs, targets = batch[:, :-1], batch[:, 1:]
+                ce_sum, aux = model(inputs, targets=targets, pad_id=pad_id)
+                loss = ce_sum / denom + aux_weight * aux / len(micro_batches)
+            with phase('backward'):
+                loss.backward()
+        loss_sum += float(ce_sum.detach())
+    return loss_sum / max(n_tokens, 1), n_tokens
@@ -0,0 +1,44 @@
+import torch.nn as nn
+
+
+def parse_cutoffs(spec, vocab_size):
+    """Cluster boundaries for `AdaptiveHead` from '--adaptive-softmax'.
+
+    `spec` is 'auto' (vocab/8 and vocab/2) or comma-separated ids such as
+    '2000,10000'. Because `SimpleTokenizer` numbers words by frequency, the
+    first cutoff is the size of the frequent-token shortlist.
+    """
+    if spec is None:
+        return None
+    if spec == 'auto':
+        cutoffs = [vocab_size // 8, vocab_size // 2]
+    else:
+        cutoffs = [int(c) for c in str(spec).split(',') if c.strip()]
+    cutoffs = sorted({c for c in cutoffs if 0 < c < vocab_size})
+    if not cutoffs:
+        raise ValueError(f'no usable adaptive softmax cutoffs in {spec!r} for vocab_size={vocab_size}')
+    return cutoffs
+
+
+class AdaptiveHead(nn.AdaptiveLogSoftmaxWithLoss):
+    """Frequency-partitioned output layer (adaptive softmax, Grave et al.).
+
+    - ids below `cutoffs[0]` are scored by the head together with one logit
+      per tail cluster; each tail cluster projects to d_model / div_value**i
+      first, so rare words cost far fewer FLOPs than a dense vocab matmul.
+    - `loss_sum` is the training path: summed NLL of the targets, touching a
+      tail cluster only for the tokens that fall in it.
+    - `log_prob` gives full-vocabulary log-probabilities; generation only
+      needs them for the last position (the model's `last_only`).
+    """
+
+    def __init__(self, d_model, vocab_size, cutoffs, div_value=4.0):
+        super().__init__(d_model, vocab_size, cutoffs, div_value=div_value, head_bias=False)
+
+    def loss_sum(self, h, targets, pad_id=0):
+        """Summed NLL over non-pad `targets`; `h` is (..., d_model)."""
+        h, targets = h.reshape(-1, h.size(-1)), targets.reshape(-1)
+        keep = targets != pad_id
+        if not keep.any():
+            return h.sum() * 0.0
+        return -super().forward(h[keep], targets[keep]).output.sum()
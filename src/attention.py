@@ -0,0 +1,365 @@
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+
+
+def pool_kv_heads(weight, n_heads, n_kv_heads):
+    """Mean-pool the per-head rows of a key/value projection into `n_kv_heads` groups.
+
+    `weight` is (n_heads * head_dim, ...) (a weight matrix or a bias); query
+    heads h*g .. h*g+g-1 share KV head h, matching `GroupedQueryAttention`.
+    """
+    if n_heads == n_kv_heads:
+        return weight
+    head_dim = weight.shape[0] // n_heads
+    grouped = weight.reshape(n_kv_heads, n_heads // n_kv_heads, head_dim, *weight.shape[1:])
+    return grouped.mean(dim=1).reshape(n_kv_heads * head_dim, *weight.shape[1:])
+
+
+def rotate(x, positions, base=10000.0):
+    """Rotary position embedding of `x` (batch, heads, seq, head_dim) at `positions`.
+
+    `positions` is (seq,) or (batch, seq). Dot products between rotated
+    queries and keys depend only on the position difference, so there is no
+    maximum length.
+    """
+    head_dim = x.size(-1)
+    inv_freq = base ** -(torch.arange(0, head_dim, 2, device=x.device).float() / head_dim)
+    angles = positions.unsqueeze(-1).float() * inv_freq  # (..., seq, head_dim / 2)
+    if angles.dim() == 3:
+        angles = angles.unsqueeze(1)
+    cos, sin = angles.cos().to(x.dtype), angles.sin().to(x.dtype)
+    x1, x2 = x[..., 0::2], x[..., 1::2]
+    return torch.stack((x1 * cos - x2 * sin, x1 * sin + x2 * cos), dim=-1).flatten(-2)
+
+
+class GroupedQueryAttention(nn.Module):
+    """Causal self-attention with `n_kv_heads` key/value heads (GQA; MQA at 1).
+
+    - `n_kv_heads == n_heads` is ordinary multi-head attention. With fewer KV
+      heads each group of n_heads / n_kv_heads query heads shares one KV head,
+      so K/V projections, the KV cache and decode-time memory traffic shrink
+      by that factor.
+    - queries are folded into their group instead of repeating K/V, so the
+      cached keys and values are never copied per query head.
+    - `window`: each position attends only to the previous `window`
+      positions (itself included). Long sequences without a cache are
+      processed in query blocks of `window`, so memory grows linearly with
+      length.
+    - `rotary`: rotary position embedding on queries and keys.
+    - input/output are (seq, batch, d_model) like `nn.MultiheadAttention`,
+      whose checkpoints (`in_proj_*`, `out_proj.*`) load directly; KV heads
+      are mean-pooled when the checkpoint has more of them than this module.
+    """
+
+    def __init__(self, d_model, n_heads, n_kv_heads=None, window=None, rotary=False, rope_base=10000.0):
+        super().__init__()
+        n_kv_heads = n_kv_heads or n_heads
+        if d_model % n_heads or n_heads % n_kv_heads:
+            raise ValueError(f'need d_model % n_heads == 0 and n_heads % n_kv_heads == 0, '
+                             f'got d_model={d_model}, n_heads={n_heads}, n_kv_heads={n_kv_heads}')
+        self.n_heads = n_heads
+        self.n_kv_heads = n_kv_heads
+        self.head_dim = d_model // n_heads
+        self.window = window
+        self.rotary = rotary
+        self.rope_base = rope_base
+        self.q_proj = nn.Linear(d_model, d_model)
+        self.k_proj = nn.Linear(d_model, n_kv_heads * self.head_dim)
+        self.v_proj = nn.Linear(d_model, n_kv_heads * self.head_dim)
+        self.out_proj = nn.Linear(d_model, d_model)
+        if window:
+            # saved with the weights so loading scripts can restore the window (see checkpoint.infer_config)
+            self.register_buffer('window_size', torch.tensor(window))
+        self._register_load_state_dict_pre_hook(self._convert_checkpoint)
+
+    def forward(self, x, positions=None, cache=None, layer_idx=0, valid=None):
+        """`positions`: absolute positions of the tokens in `x`, (seq,) or (batch, seq).
+
+        `valid` (batch, seq) marks real tokens (False = padding; padded keys
+        are never attended to). Positions default to 0..seq-1, or to each
+        row's next positions in the cache. With a `KVCache`, this call's
+        keys/values are stored in layer `layer_idx` and attention runs over
+        the cached ones as well.
+        """
+        seq, batch, _ = x.shape
+        if positions is None:
+            positions = torch.arange(seq, device=x.device)
+            if cache is not None and cache.seen is not None:
+                positions = cache.seen[:, None] + positions
+        q = self.q_proj(x).view(seq, batch, self.n_heads, self.head_dim).permute(1, 2, 0, 3)
+        k = self.k_proj(x).view(seq, batch, self.n_kv_heads, self.head_dim).permute(1, 2, 0, 3)
+        v = self.v_proj(x).view(seq, batch, self.n_kv_heads, self.head_dim).permute(1, 2, 0, 3)
+        if self.rotary:
+            q, k = rotate(q, positions, self.rope_base), rotate(k, positions, self.rope_base)
+        if cache is not None:
+            k, v, k_pos, k_valid = cache.update(layer_idx, k, v, positions, valid)
+        else:
+            k_pos, k_valid = positions, valid
+        if cache is None and self.window and seq > 2 * self.window:
+            w = self.window
+            out = torch.cat([self._attend(q[:, :, s:s + w], k[:, :, max(0, s - w):s + w], v[:, :, max(0, s - w):s + w],
+                                          positions[..., s:s + w], k_pos[..., max(0, s - w):s + w],
+                                          None if k_valid is None else k_valid[:, max(0, s - w):s + w])
+                             for s in range(0, seq, w)], dim=2)
+        else:
+            out = self._attend(q, k, v, positions, k_pos, k_valid)
+        return self.out_proj(out.permute(2, 0, 1, 3).reshape(seq, batch, -1))
+
+    def _attend(self, q, k, v, q_pos, k_pos, k_valid=None):
+        batch, _, seq, _ = q.shape
+        groups = self.n_heads // self.n_kv_heads
+        mask = None
+        # one new token against fully valid keys within its window needs no mask
+        if seq > 1 or (self.window and k.size(2) > self.window) or (k_valid is not None and not k_valid.all()):
+            mask = k_pos[..., None, :] <= q_pos[..., :, None]
+            if self.window:
+                mask = mask & (k_pos[..., None, :] > q_pos[..., :, None] - self.window)
+            if k_valid is not None:
+                mask = mask & k_valid[:, None, :]
+                # padding queries may have nothing to attend to; give them everything
+                # (their outputs are never used) rather than a NaN softmax
+                mask = mask | ~mask.any(dim=-1, keepdim=True)
+            if mask.dim() == 2:
+                mask = mask.unsqueeze(0)
+            # rows ordered like the folded queries below
+            mask = mask.repeat(1, groups, 1).unsqueeze(1)
+        # (batch, kv_heads, groups * seq, head_dim): every query head of a group attends to the same K/V
+        q = q.reshape(batch, self.n_kv_heads, groups * seq, self.head_dim)
+        out = F.scaled_dot_product_attention(q, k, v, attn_mask=mask)
+        return out.reshape(batch, self.n_heads, seq, self.head_dim)
+
+    def _convert_checkpoint(self, state_dict, prefix, *args):
+        if self.window:
+            state_dict[prefix + 'window_size'] = torch.tensor(self.window)
+        else:
+            state_dict.pop(prefix + 'window_size', None)
+        fused = state_dict.pop(prefix + 'in_proj_weight', None)
+        if fused is not None:
+            for name, w in zip(('q_proj', 'k_proj', 'v_proj'), fused.chunk(3, dim=0)):
+                state_dict[f'{prefix}{name}.weight'] = w
+            bias = state_dict.pop(prefix + 'in_proj_bias', None)
+            if bias is not None:
+                for name, b in zip(('q_proj', 'k_proj', 'v_proj'), bias.chunk(3, dim=0)):
+                    state_dict[f'{prefix}{name}.bias'] = b
+        for name in ('k_proj.weight', 'k_proj.bias', 'v_proj.weight', 'v_proj.bias'):
+            t = state_dict.get(prefix + name)
+            if t is not None and t.shape[0] != self.n_kv_heads * self.head_dim:
+                state_dict[prefix + name] = pool_kv_heads(t, t.shape[0] // self.head_dim, self.n_kv_heads)
+
+
+def convert_state_dict(state_dict, n_heads, n_kv_heads):
+    """Checkpoint conversion to `n_kv_heads` KV heads, offline (see `GroupedQueryAttention`).
+
+    Legacy `nn.MultiheadAttention` weights are split into q/k/v projections
+    and K/V heads are mean-pooled. Non-attention tensors are passed through.
+    """
+    out = {}
+    for key, t in state_dict.items():
+        if key.endswith('.attn.in_proj_weight') or key.endswith('.attn.in_proj_bias'):
+            prefix, kind = key.rsplit('.in_proj_', 1)
+            for name, part in zip(('q_proj', 'k_proj', 'v_proj'), t.chunk(3, dim=0)):
+                out[f'{prefix}.{name}.{kind}'] = part
+        else:
+            out[key] = t
+    for key in list(out):
+        if '.attn.k_proj.' in key or '.attn.v_proj.' in key:
+            head_dim = out[key.replace('.k_proj.', '.q_proj.').replace('.v_proj.', '.q_proj.')].shape[0] // n_heads
+            out[key] = pool_kv_heads(out[key], out[key].shape[0] // head_dim, n_kv_heads).contiguous()
+    return out
+
+
+class KVCache:
+    """Per-layer key/value buffers for incremental decoding.
+
+    - `update` stores a step's (batch, kv_heads, new, head_dim) keys/values
+      with their per-row positions and validity (padding) and returns what
+      to attend over. Unbounded buffers grow by doubling, so appending one
+      token is amortized O(1) copies.
+    - with `window`, each layer is a ring buffer of `window` slots: column
+      c lives in slot c % window, overwriting the one that fell out of the
+      attention window, so memory stays constant however long generation
+      runs. A multi-token chunk attends to the cached window plus itself
+      before its last `window` columns are written.
+    - `length` is the number of cached columns; `seen` (batch,) counts each
+      row's real tokens, i.e. its next position (kept by the model).
+    - `select(rows)` keeps only the given batch rows (drop finished
+      sequences, reorder beams); leading columns no kept row can attend
+      to any more are released. `extend(other)` appends another cache's
+      rows (continuous batching: a freshly prefilled request joins the
+      running batch), padding the shorter one's columns on the left.
+      `crop(n)` rolls a cache back to its first `n` columns.
+    - `nbytes` is the memory held by the cached keys/values; `state` /
+      `from_state` save and restore a cache.
+    """
+
+    def __init__(self, n_layers, window=None):
+        self.window = window
+        self.keys = [None] * n_layers
+        self.values = [None] * n_layers
+        self.positions = [None] * n_layers
+        self.valid = [None] * n_layers
+        self.lengths = [0] * n_layers
+        self.seen = None
+
+    @classmethod
+    def for_model(cls, model):
+        """Cache matching `model`'s depth and attention window."""
+        return cls(len(model.layers), window=model.attn_window)
+
+    @classmethod
+    def from_prefix(cls, keys, values):
+        """Single-row cache holding per-layer (1, kv_heads, n, head_dim) keys/values of positions 0..n-1."""
+        cache = cls(len(keys))
+        n = keys[0].size(2)
+        cache.keys, cache.values = list(keys), list(values)
+        cache.positions = [torch.arange(n, device=keys[0].device)[None] for _ in keys]
+        cache.valid = [torch.ones(1, n, dtype=torch.bool, device=keys[0].device) for _ in keys]
+        cache.lengths = [n] * len(keys)
+        cache.seen = torch.tensor([n], device=keys[0].device)
+        return cache
+
+    def state(self):
+        """Tensors to rebuild this cache with `from_state` (e.g. to checkpoint an idle session)."""
+        def used(t, dim, n):
+            return t if t is None or self.window else t.narrow(dim, 0, n)
+        return {'window': self.window, 'lengths': list(self.lengths), 'seen': self.seen,
+                'keys': [used(t, 2, n) for t, n in zip(self.keys, self.lengths)],
+                'values': [used(t, 2, n) for t, n in zip(self.values, self.lengths)],
+                'positions': [used(t, 1, n) for t, n in zip(self.positions, self.lengths)],
+                'valid': [used(t, 1, n) for t, n in zip(self.valid, self.lengths)]}
+
+    @classmethod
+    def from_state(cls, state):
+        cache = cls(len(state['keys']), window=state['window'])
+        for name in ('keys', 'values', 'positions', 'valid'):
+            setattr(cache, name, list(state[name]))
+        cache.lengths, cache.seen = list(state['lengths']), state['seen']
+        return cache
+
+    @property
+    def length(self):
+        return self.lengths[-1]
+
+    def select(self, rows):
+        for store in (self.keys, self.values, self.positions, self.valid):
+            for i, t in enumerate(store):
+                if t is not None:
+                    store[i] = t.index_select(0, rows)
+        if self.seen is not None:
+            self.seen = self.seen.index_select(0, rows)
+        n = self.length
+        if not self.window and n and self.valid[-1] is not None:
+            live = self.valid[-1][:, :n].any(dim=0)
+            first = int(live.int().argmax()) if live.any() else n
+            if first:
+                for i in range(len(self.keys)):
+                    self.keys[i] = self.keys[i][:, :, first:n]
+                    self.values[i] = self.values[i][:, :, first:n]
+                    self.positions[i] = self.positions[i][:, first:n]
+                    self.valid[i] = self.valid[i][:, first:n]
+                    self.lengths[i] -= first
+
+    def crop(self, n):
+        """Forget every column after the first `n` (e.g. rejected speculative tokens, a stop string).
+
+        Unbounded caches only; the dropped columns must be real (unpadded) tokens.
+        """
+        if self.window:
+            raise ValueError('a ring-buffer cache cannot be cropped: overwritten slots are gone')
+        drop = self.length - n
+        if drop > 0:
+            self.lengths = [n] * len(self.lengths)
+            self.seen = self.seen - drop
+
+    def extend(self, other):
+        """Append the rows of `other` (a cache of the same model) to this one."""
+        if other.seen is None:
+            return
+        if self.seen is None:
+            self.keys, self.values, self.positions, self.valid = other.keys, other.values, other.positions, other.valid
+            self.lengths, self.seen = list(other.lengths), other.seen
+            return
+        for i in range(len(self.keys)):
+            n = max(self.lengths[i], other.lengths[i])
+            parts = []
+            for cache in (self, other):
+                m = cache.lengths[i]
+                bufs = []
+                for t, dim in zip((cache.keys[i], cache.values[i], cache.positions[i], cache.valid[i]), (2, 2, 1, 1)):
+                    if self.window:
+                        # column c lives in slot c % window: rotate so columns line up with the longer cache
+                        t = t.roll((n - m) % self.window, dims=dim)
+                    else:
+                        t = t.narrow(dim, 0, m)
+                        if n > m:
+                            shape = list(t.shape)
+                            shape[dim] = n - m
+                            t = torch.cat([t.new_zeros(shape), t], dim=dim)
+                    bufs.append(t)
+                parts.append(bufs)
+            self.keys[i], self.values[i], self.positions[i], self.valid[i] = (torch.cat(ts, dim=0) for ts in zip(*parts))
+            self.lengths[i] = n
+        self.seen = torch.cat([self.seen, other.seen])
+
+    def update(self, layer_idx, k, v, positions, valid=None):
+        batch, new = k.size(0), k.size(2)
+        positions = positions.expand(batch, new)
+        if valid is None:
+            valid = torch.ones(batch, new, dtype=torch.bool, device=k.device)
+        if self.window:
+            return self._update_ring(layer_idx, k, v, positions, valid)
+        n = self.lengths[layer_idx]
+        buf_k = self.keys[layer_idx]
+        if buf_k is None or n + new > buf_k.size(2):
+            cap = max(2 * (n + new), 16)
+            grown = (k.new_empty(batch, k.size(1), cap, k.size(3)), v.new_empty(batch, v.size(1), cap, v.size(3)),
+                     positions.new_zeros(batch, cap), valid.new_zeros(batch, cap))
+            if n:
+                grown[0][:, :, :n] = buf_k[:, :, :n]
+                grown[1][:, :, :n] = self.values[layer_idx][:, :, :n]
+                grown[2][:, :n] = self.positions[layer_idx][:, :n]
+                grown[3][:, :n] = self.valid[layer_idx][:, :n]
+            self.keys[layer_idx], self.values[layer_idx], self.positions[layer_idx], self.valid[layer_idx] = grown
+        buf_k, buf_v, buf_p, buf_m = self.keys[layer_idx], self.values[layer_idx], self.positions[layer_idx], self.valid[layer_idx]
+        buf_k[:, :, n:n + new] = k
+        buf_v[:, :, n:n + new] = v
+        buf_p[:, n:n + new] = positions
+        buf_m[:, n:n + new] = valid
+        self.lengths[layer_idx] = n + new
+        return buf_k[:, :, :n + new], buf_v[:, :, :n + new], buf_p[:, :n + new], buf_m[:, :n + new]
+
+    def _update_ring(self, layer_idx, k, v, positions, valid):
+        w, n, new = self.window, self.lengths[layer_idx], k.size(2)
+        if self.keys[layer_idx] is None:
+            self.keys[layer_idx] = k.new_zeros(k.size(0), k.size(1), w, k.size(3))
+            self.values[layer_idx] = v.new_zeros(v.size(0), v.size(1), w, v.size(3))
+            self.positions[layer_idx] = positions.new_zeros(k.size(0), w)
+            self.valid[layer_idx] = valid.new_zeros(k.size(0), w)
+        buf_k, buf_v, buf_p, buf_m = self.keys[layer_idx], self.values[layer_idx], self.positions[layer_idx], self.valid[layer_idx]
+        if new == 1:
+            slot = n % w
+            buf_k[:, :, slot] = k[:, :, 0]
+            buf_v[:, :, slot] = v[:, :, 0]
+            buf_p[:, slot] = positions[:, 0]
+            buf_m[:, slot] = valid[:, 0]
+            self.lengths[layer_idx] = n + 1
+            used = min(n + 1, w)
+            return buf_k[:, :, :used], buf_v[:, :, :used], buf_p[:, :used], buf_m[:, :used]
+        # chunk: cached window (oldest first) + the new columns; then keep the newest `w`
+        order = torch.arange(max(0, n - w), n, device=k.device) % w
+        out = (torch.cat([buf_k.index_select(2, order), k], dim=2), torch.cat([buf_v.index_select(2, order), v], dim=2),
+               torch.cat([buf_p.index_select(1, order), positions], dim=1), torch.cat([buf_m.index_select(1, order), valid], dim=1))
+        keep = min(new, w)
+        slots = torch.arange(n + new - keep, n + new, device=k.device) % w
+        buf_k.index_copy_(2, slots, k[:, :, -keep:])
+        buf_v.index_copy_(2, slots, v[:, :, -keep:])
+        buf_p.index_copy_(1, slots, positions[:, -keep:])
+        buf_m.index_copy_(1, slots, valid[:, -keep:])
+        self.lengths[layer_idx] = n + new
+        return out
+
+    def nbytes(self):
+        limit = self.window or float('inf')
+        return sum(2 * k[:, :, :int(min(n, limit))].numel() * k.element_size()
+                   for k, n in zip(self.keys, self.lengths) if k is not None)
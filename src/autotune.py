@@ -0,0 +1,217 @@
+import json
+import math
+import os
+import platform
+import queue as queue_lib
+import time
+import torch
+import torch.multiprocessing as mp
+from torch.utils.data import DataLoader, Dataset
+from src.model import MoETransformer
+from src.optim import build_optimizer
+from src.telemetry import peak_rss_bytes
+
+PROFILE_KEYS = ('batch', 'seq_len', 'accum_steps', 'threads', 'data_workers')
+
+
+def total_memory_bytes():
+    """Physical memory of the host (or of GPU 0 when CUDA is available), or None."""
+    if torch.cuda.is_available():
+        return torch.cuda.get_device_properties(0).total_memory
+    try:
+        return os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES')
+    except (AttributeError, ValueError, OSError):
+        pass
+    try:
+        import psutil
+        return psutil.virtual_memory().total
+    except ImportError:
+        return None
+
+
+def _rss_bytes(pid):
+    try:
+        with open(f'/proc/{pid}/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
+
+class _RandomTokens(Dataset):
+    def __init__(self, vocab_size, seq_len, n):
+        g = torch.Generator().manual_seed(0)
+        self.data = torch.randint(4, vocab_size, (n, seq_len), generator=g)
+
+    def __len__(self):
+        return len(self.data)
+
+    def __getitem__(self, idx):
+        return self.data[idx]
+
+
+def _trial_worker(cfg, trial, steps, warmup, optimizer, result_queue):
+    torch.set_num_threads(trial['threads'])
+    torch.manual_seed(0)
+    device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
+    model = MoETransformer(**cfg).to(device)
+    opt = build_optimizer(optimizer, model.parameters())
+    ds = _RandomTokens(cfg['vocab_size'], trial['seq_len'], trial['batch'] * (steps + warmup))
+    dl = DataLoader(ds, batch_size=trial['batch'], num_workers=trial['data_workers'])
+    t0 = None
+    for i, batch in enumerate(dl):
+        if i == warmup:
+            if device.type == 'cuda':
+                torch.cuda.synchronize()
+            t0 = time.perf_counter()
+        batch = batch.to(device)
+        nll, aux = model(batch[:, :-1], targets=batch[:, 1:])
+        loss = nll / batch[:, 1:].numel() + 1e-2 * aux
+        loss.backward()
+        opt.step()
+        opt.zero_grad(set_to_none=True)
+    if device.type == 'cuda':
+        torch.cuda.synchronize()
+        peak = torch.cuda.max_memory_allocated()
+    else:
+        peak = peak_rss_bytes()
+    elapsed = time.perf_counter() - t0
+    tokens = steps * trial['batch'] * (trial['seq_len'] - 1)
+    result_queue.put({'tokens_per_s': tokens / elapsed, 'peak_mem_bytes': peak})
+
+
+def run_trial(cfg, trial, steps=3, warmup=1, optimizer='adamw', max_memory=None, timeout=600):
+    """Measure one setting in a fresh process: training tokens/s and peak memory.
+
+    `trial` holds batch, seq_len, threads and data_workers. The process is
+    killed (status 'oom') as soon as its RSS passes `max_memory` bytes, and a
+    process that dies on its own (e.g. the OOM killer) is reported the same
+    way, so an oversized trial cannot take the tuner down with it.
+    Returns `trial` extended with 'status' and, if 'ok', the measurements.
+    """
+    ctx = mp.get_context('spawn')
+    result_queue = ctx.Queue()
+    proc = ctx.Process(target=_trial_worker, args=(cfg, trial, steps, warmup, optimizer, result_queue))
+    proc.start()
+    deadline = time.monotonic() + timeout
+    out = dict(trial, status='ok')
+    try:
+        while True:
+            try:
+                out.update(result_queue.get(timeout=0.05))
+                break
+            except queue_lib.Empty:
+                pass
+            rss = _rss_bytes(proc.pid)
+            if max_memory and not torch.cuda.is_available() and rss and rss > max_memory:
+                out['status'] = 'oom'
+                break
+            if proc.exitcode is not None:
+                out['status'] = 'oom' if proc.exitcode < 0 else 'error'
+                break
+            if time.monotonic() > deadline:
+                out['status'] = 'timeout'
+                break
+    finally:
+        if proc.is_alive() and out['status'] != 'ok':
+            proc.kill()
+        proc.join()
+    if out['status'] == 'ok' and max_memory and out['peak_mem_bytes'] and out['peak_mem_bytes'] > max_memory:
+        out['status'] = 'oom'
+    return out
+
+
+def thread_candidates(max_threads=None):
+    """Powers of two up to the usable core count, plus the core count itself."""
+    if max_threads is None:
+        max_threads = len(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else (os.cpu_count() or 1)
+    cands = [2 ** i for i in range(int(math.log2(max_threads)) + 1)]
+    return sorted(set(cands + [max_threads]))
+
+
+def autotune(cfg, seq_lens=(64, 128, 256), max_batch=64, threads=None, data_workers=(0, 1, 2),
+             max_memory=None, target_tokens=None, trial_fn=None, log=print, **trial_kwargs):
+    """Coordinate search for the fastest (tokens/s) setting under `max_memory` bytes.
+
+    1. thread count, with batch 4 at the shortest sequence length;
+    2. for each sequence length, batch sizes 1, 2, 4, ... up to `max_batch`,
+       stopping at the first one over the memory ceiling;
+    3. DataLoader workers for the best setting.
+    With `target_tokens` (tokens per optimizer step), `accum_steps` is chosen
+    to reach it. Returns the profile dict (see `save_profile`).
+    """
+    trial_fn = trial_fn or (lambda t: run_trial(cfg, t, max_memory=max_memory, **trial_kwargs))
+    trials = []
+
+    def measure(**setting):
+        r = trial_fn(setting)
+        trials.append(r)
+        mem = f"{r['peak_mem_bytes'] / 2 ** 20:.0f}MB" if r.get('peak_mem_bytes') else '-'
+        rate = f"{r['tokens_per_s']:.0f} tok/s" if r['status'] == 'ok' else r['status']
+        log(f"  batch={setting['batch']:<4} seq={setting['seq_len']:<5} threads={setting['threads']:<3} "
+            f"workers={setting['data_workers']}  {rate}  peak {mem}")
+        return r
+
+    def best(rs):
+        ok = [r for r in rs if r['status'] == 'ok']
+        return max(ok, key=lambda r: r['tokens_per_s']) if ok else None
+
+    seq_lens = sorted(seq_lens)
+    base = {'batch': min(4, max_batch), 'seq_len': seq_lens[0], 'data_workers': 0}
+    log('[*] threads')
+    top = best([measure(threads=t, **base) for t in (threads or thread_candidates())])
+    if top is None:
+        raise RuntimeError('every thread-count trial failed; lower the batch size or raise the memory ceiling')
+    n_threads = top['threads']
+
+    log('[*] batch size x sequence length')
+    for seq_len in seq_lens:
+        batch = 1
+        while batch <= max_batch:
+            r = top if (batch, seq_len) == (base['batch'], base['seq_len']) else \
+                measure(batch=batch, seq_len=seq_len, threads=n_threads, data_workers=0)
+            if r['status'] != 'ok':
+                break
+            batch *= 2
+    top = best(trials)
+
+    log('[*] data workers')
+    for w in data_workers:
+        if w != top['data_workers']:
+            measure(**dict({k: top[k] for k in ('batch', 'seq_len', 'threads')}, data_workers=w))
+    top = best(trials)
+
+    step_tokens = top['batch'] * (top['seq_len'] - 1)
+    return {
+        'batch': top['batch'], 'seq_len': top['seq_len'], 'threads': top['threads'],
+        'data_workers': top['data_workers'],
+        'accum_steps': max(1, math.ceil(target_tokens / step_tokens)) if target_tokens else 1,
+        'tokens_per_s': top['tokens_per_s'], 'peak_mem_bytes': top.get('peak_mem_bytes'),
+        'max_memory_bytes': max_memory, 'cfg': cfg,
+        'host': {'node': platform.node(), 'cpus': os.cpu_count(),
+                 'cuda': torch.cuda.get_device_name(0) if torch.cuda.is_available() else None},
+        'trials': trials,
+    }
+
+
+def save_profile(profile, path):
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(profile, f, indent=2)
+
+
+def load_profile(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def apply_profile(parser, path):
+    """Use a tuning profile's settings as `parser` defaults (explicit flags still win).
+
+    Only options the parser defines are set (see `PROFILE_KEYS`). Returns the profile.
+    """
+    profile = load_profile(path)
+    known = {a.dest for a in parser._actions}
+    parser.set_defaults(**{k: profile[k] for k in PROFILE_KEYS if k in known and profile.get(k) is not None})
+    return profile
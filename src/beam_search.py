@@ -0,0 +1,77 @@
+import torch
+from src.generation import prefill
+
+
+@torch.inference_mode()
+def beam_search(model, prompts, num_beams=4, max_new_tokens=50, length_penalty=1.0, early_stopping=True,
+                eos_id=None, pad_id=0, num_return=1, prefix_cache=None):
+    """Beam search over many prompts at once: all prompts x beams are one batch, one forward per step.
+
+    - the prompts are prefilled once (optionally through a `PrefixCache`)
+      and each prompt's KV rows are replicated to its beams a single time;
+      afterwards a step reorders the cache rows by beam parent with one
+      index_select (skipped when no beam changed parent), so beams share
+      their common history instead of recomputing it.
+    - hypotheses are scored by summed log-prob / generated_length **
+      `length_penalty` (> 1 favours longer outputs). A hypothesis ends at
+      `eos_id`; with `early_stopping` a prompt is done once it has
+      `num_beams` finished hypotheses, otherwise once no running beam can
+      still beat the worst of them. Done prompts leave the batch.
+    Returns, per prompt, the `num_return` best (ids, score) pairs, best first.
+    """
+    if max_new_tokens <= 0:
+        return [[([], 0.0)] for _ in prompts]
+    device = next(model.parameters()).device
+    n, B = len(prompts), num_beams
+    cache, logits = prefill(model, prompts, pad_id, prefix_cache)
+    rows = torch.arange(n, device=device).repeat_interleave(B)  # row = prompt * B + beam
+    cache.select(rows)
+    logits = logits.index_select(0, rows)
+    scores = torch.zeros(n, B, device=device)
+    scores[:, 1:] = float('-inf')  # all beams start identical: expand beam 0 only at the first step
+    scores = scores.view(-1)
+    history = torch.empty(n * B, 0, dtype=torch.long, device=device)
+    live = list(range(n))
+    finished = [[] for _ in range(n)]
+
+    def add(p, score, length, ids):
+        finished[p].append((ids, score / length ** length_penalty))
+        finished[p].sort(key=lambda h: -h[1])
+        del finished[p][B:]
+
+    for step in range(max_new_tokens):
+        m = len(live)
+        logprobs = torch.log_softmax(logits.float(), dim=-1)
+        vocab = logprobs.size(-1)
+        top_scores, top_idx = (scores[:, None] + logprobs).view(m, B * vocab).topk(2 * B, dim=1)
+        parents, tokens = top_idx // vocab, top_idx % vocab
+        is_eos = tokens == eos_id if eos_id is not None else torch.zeros_like(tokens, dtype=torch.bool)
+        for j, c in is_eos[:, :B].nonzero().tolist():
+            add(live[j], top_scores[j, c].item(), step + 1, history[j * B + parents[j, c]].tolist())
+        # next beams: the best B non-eos candidates (at most B of the 2B end in eos)
+        order = (is_eos.long() * 2 * B + torch.arange(2 * B, device=device)).argsort(dim=1)[:, :B]
+        scores = top_scores.gather(1, order).view(-1)
+        tokens = tokens.gather(1, order).view(-1)
+        src = (parents.gather(1, order) + torch.arange(m, device=device)[:, None] * B).view(-1)
+        history = torch.cat([history.index_select(0, src), tokens[:, None]], dim=1)
+
+        best = (scores.view(m, B).max(dim=1).values / (step + 1) ** length_penalty).tolist()
+        keep = [j for j, p in enumerate(live)
+                if len(finished[p]) < B or not (early_stopping or best[j] <= finished[p][-1][1])]
+        if step == max_new_tokens - 1 or not keep:
+            break
+        if len(keep) < m:
+            blocks = torch.tensor(keep, device=device)
+            src = src.view(m, B).index_select(0, blocks).view(-1)
+            idx = (blocks[:, None] * B + torch.arange(B, device=device)).view(-1)
+            scores, tokens, history = scores[idx], tokens[idx], history[idx]
+            live = [live[j] for j in keep]
+        if not torch.equal(src, torch.arange(src.numel(), device=device)):
+            cache.select(src)
+        logits = model(tokens[:, None], cache=cache, last_only=True)[0][:, -1]
+
+    for j, p in enumerate(live):
+        if len(finished[p]) < B or not early_stopping:
+            for b in range(B):
+                add(p, scores[j * B + b].item(), history.size(1), history[j * B + b].tolist())
+    return [finished[p][:num_return] for p in range(n)]
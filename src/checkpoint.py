@@ -0,0 +1,262 @@
+import glob
+import itertools
+import os
+import random
+import re
+import threading
+import time
+import torch
+from src.model import MoETransformer
+
+
+def load_state_dict(path, map_location='cpu', mmap=True):
+    """Read a model state dict from `path`.
+
+    - memory-maps the file when torch supports it (>=2.1, zipfile format), so
+      tensors are paged in lazily instead of being read into a fresh buffer.
+    - accepts both bare state dicts and dicts holding one under a 'model' key.
+    """
+    try:
+        sd = torch.load(path, map_location=map_location, mmap=mmap, weights_only=True)
+    except TypeError:
+        # older torch: no mmap / weights_only keywords
+        sd = torch.load(path, map_location=map_location)
+    except RuntimeError:
+        # legacy (non-zipfile) checkpoints cannot be memory-mapped
+        sd = torch.load(path, map_location=map_location)
+    if isinstance(sd, dict) and isinstance(sd.get('model'), dict):
+        sd = sd['model']
+    return sd
+
+
+def build_meta_model(cfg):
+    """Construct `MoETransformer(**cfg)` on the meta device (no storage, no init)."""
+    with torch.device('meta'):
+        return MoETransformer(**cfg)
+
+
+def assign_state_dict(model, state_dict):
+    """Assign checkpoint tensors into a (meta) model without copying them.
+
+    Raises if any parameter or buffer is left on the meta device, since that
+    would otherwise only surface later as an opaque error in forward.
+    """
+    try:
+        result = model.load_state_dict(state_dict, strict=False, assign=True)
+    except TypeError:
+        # torch < 2.1 has no `assign`: materialize empty storage and copy in
+        model = model.to_empty(device='cpu')
+        result = model.load_state_dict(state_dict, strict=False)
+    missing = [n for n, t in itertools.chain(model.named_parameters(), model.named_buffers()) if t.is_meta]
+    if missing:
+        raise RuntimeError(f'checkpoint is missing tensors for: {", ".join(missing[:8])}'
+                           + (' ...' if len(missing) > 8 else ''))
+    return model, result
+
+
+def infer_config(cfg, state_dict):
+    """`cfg` plus the options that can be read off the checkpoint's tensor shapes.
+
+    Fills in the adaptive softmax cutoffs / div_value, the number of KV
+    heads, rotary positions and the attention window, so chat/eval scripts
+    load such checkpoints with their usual presets. Options already set in
+    `cfg` are kept.
+    """
+    cfg = dict(cfg)
+    if 'tok_emb.weight' in state_dict and 'pos_emb' not in state_dict:
+        cfg.setdefault('pos_encoding', 'rope')
+    window = state_dict.get('layers.0.attn.window_size')
+    if window is not None and not cfg.get('attn_window'):
+        cfg['attn_window'] = int(window)
+    k_proj = state_dict.get('layers.0.attn.k_proj.weight')
+    if k_proj is not None and not cfg.get('n_kv_heads'):
+        head_dim = cfg['d_model'] // cfg['n_heads']
+        if k_proj.shape[0] != cfg['d_model']:
+            cfg['n_kv_heads'] = k_proj.shape[0] // head_dim
+    if 'head.head.weight' not in state_dict or cfg.get('adaptive_cutoffs'):
+        return cfg
+    n_clusters = sum(1 for k in state_dict if k.startswith('head.tail.') and k.endswith('.0.weight'))
+    cutoffs = [state_dict['head.head.weight'].shape[0] - n_clusters]
+    for i in range(n_clusters - 1):
+        cutoffs.append(cutoffs[-1] + state_dict[f'head.tail.{i}.1.weight'].shape[0])
+    d_model = state_dict['head.head.weight'].shape[1]
+    return dict(cfg, adaptive_cutoffs=cutoffs, adaptive_div=round(d_model / state_dict['head.tail.0.0.weight'].shape[0], 1))
+
+
+def load_model(path, cfg, device='cpu', mmap=True):
+    """Load a checkpoint into a new `MoETransformer` with a single allocation.
+
+    The model is built on the meta device and the (memory-mapped) checkpoint
+    tensors are assigned directly, so peak memory is ~1x the model instead of
+    random-init weights plus a second loaded copy.
+    """
+    state_dict = load_state_dict(path, mmap=mmap)
+    model = build_meta_model(infer_config(cfg, state_dict))
+    model, _ = assign_state_dict(model, state_dict)
+    return model.to(device)
+
+
+class AsyncCheckpointWriter:
+    """Writes checkpoints from a background thread.
+
+    - `save` snapshots every tensor into reusable CPU staging buffers (pinned
+      when CUDA is available) and returns; serialization and disk I/O run on a
+      writer thread, so the training loop only stalls for the memcpy.
+    - files are written to `<name>.tmp`, fsynced and atomically renamed.
+    - with `keep_last > 0` only the newest K checkpoints of each `group`
+      written by this writer are kept on disk.
+    - staging buffers are pooled by (shape, dtype), so model-only and
+      full-state saves share the same memory.
+    - `stats` tracks saves, stall seconds, write seconds and bytes written.
+    """
+
+    def __init__(self, save_dir, keep_last=0, pin_memory=None):
+        self.save_dir = save_dir
+        self.keep_last = keep_last
+        self.pin_memory = torch.cuda.is_available() if pin_memory is None else pin_memory
+        self.stats = {'saves': 0, 'stall_s': 0.0, 'write_s': 0.0, 'bytes': 0}
+        self._pool = {}
+        self._in_use = []
+        self._written = {}
+        self._thread = None
+        self._error = None
+
+    def save(self, state, name, group='default'):
+        """Queue `state` (nested dicts/lists of tensors and plain values) to `save_dir/name`.
+
+        Returns the seconds the caller was blocked (waiting for the previous
+        write to release the staging buffers, plus the snapshot copy).
+        """
+        t0 = time.perf_counter()
+        self.wait()
+        for buf in self._in_use:
+            self._pool.setdefault((buf.shape, buf.dtype), []).append(buf)
+        self._in_use = []
+        snapshot = self._snapshot(state)
+        if any(t.is_cuda for t in _iter_tensors(state)):
+            torch.cuda.synchronize()
+        path = os.path.join(self.save_dir, name)
+        self._thread = threading.Thread(target=self._write, args=(snapshot, path, group), daemon=True)
+        self._thread.start()
+        stall = time.perf_counter() - t0
+        self.stats['stall_s'] += stall
+        return stall
+
+    def wait(self):
+        """Block until the in-flight write (if any) has finished; re-raise its error."""
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        if self._error is not None:
+            err, self._error = self._error, None
+            raise err
+
+    def close(self):
+        self.wait()
+
+    def _snapshot(self, obj):
+        if isinstance(obj, torch.Tensor):
+            free = self._pool.get((obj.shape, obj.dtype))
+            if free:
+                buf = free.pop()
+            else:
+                buf = torch.empty(obj.shape, dtype=obj.dtype, pin_memory=self.pin_memory)
+            self._in_use.append(buf)
+            return buf.copy_(obj.detach(), non_blocking=obj.is_cuda)
+        if isinstance(obj, dict):
+            return {k: self._snapshot(v) for k, v in obj.items()}
+        if isinstance(obj, (list, tuple)):
+            return type(obj)(self._snapshot(v) for v in obj)
+        return obj
+
+    def _write(self, snapshot, path, group):
+        try:
+            t0 = time.perf_counter()
+            os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+            tmp = path + '.tmp'
+            with open(tmp, 'wb') as f:
+                torch.save(snapshot, f)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp, path)
+            self.stats['write_s'] += time.perf_counter() - t0
+            self.stats['bytes'] += os.path.getsize(path)
+            self.stats['saves'] += 1
+            self._rotate(path, group)
+        except Exception as e:  # surfaced on the training thread by wait()
+            self._error = e
+
+    def _rotate(self, path, group):
+        written = self._written.setdefault(group, [])
+        if path in written:
+            written.remove(path)
+        written.append(path)
+        if self.keep_last > 0:
+            while len(written) > self.keep_last:
+                old = written.pop(0)
+                if os.path.exists(old):
+                    os.remove(old)
+
+
+def _iter_tensors(obj):
+    if isinstance(obj, torch.Tensor):
+        yield obj
+    elif isinstance(obj, dict):
+        for v in obj.values():
+            yield from _iter_tensors(v)
+    elif isinstance(obj, (list, tuple)):
+        for v in obj:
+            yield from _iter_tensors(v)
+
+
+def capture_rng_state():
+    state = {'python': random.getstate(), 'torch': torch.get_rng_state()}
+    if torch.cuda.is_available():
+        state['cuda'] = torch.cuda.get_rng_state_all()
+    return state
+
+
+def restore_rng_state(state):
+    random.setstate(state['python'])
+    torch.set_rng_state(state['torch'])
+    if 'cuda' in state and torch.cuda.is_available():
+        torch.cuda.set_rng_state_all(state['cuda'])
+
+
+def training_state(model, optimizer, progress, scheduler=None):
+    """Everything needed to continue a run exactly where it stopped.
+
+    `progress` holds the loop position (epoch, batches consumed in the epoch,
+    micro/optimizer step counters, accumulation phase, ...).
+    """
+    return {
+        'model': model.state_dict(),
+        'optimizer': optimizer.state_dict(),
+        'scheduler': scheduler.state_dict() if scheduler is not None else None,
+        'rng': capture_rng_state(),
+        'progress': dict(progress),
+    }
+
+
+def load_training_state(path, map_location='cpu'):
+    """Load a file written from `training_state` (memory-mapped when possible)."""
+    try:
+        return torch.load(path, map_location=map_location, mmap=True, weights_only=False)
+    except TypeError:
+        return torch.load(path, map_location=map_location)
+
+
+def resume_model(state, cfg, device='cpu'):
+    """Rebuild the model from a training state via the meta device (single allocation)."""
+    model, _ = assign_state_dict(build_meta_model(infer_config(cfg, state['model'])), state['model'])
+    return model.to(device)
+
+
+def latest_checkpoint(save_dir, prefix='state_step'):
+    """Path of the highest-numbered `<prefix><N>.pt` in `save_dir`, or None."""
+    best, best_n = None, -1
+    for path in glob.glob(os.path.join(save_dir, f'{prefix}*.pt')):
+        m = re.search(rf'{re.escape(prefix)}(\d+)\.pt$', path)
+        if m and int(m.group(1)) > best_n:
+            best, best_n = path, int(m.group(1))
+    return best
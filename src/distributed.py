@@ -0,0 +1,58 @@
+import os
+import torch
+import torch.distributed as dist
+
+
+def init_distributed(backend='gloo'):
+    """Initialize the process group from the torchrun environment.
+
+    Returns (rank, world_size, local_rank). Without torchrun (WORLD_SIZE unset
+    or 1) nothing is initialized and (0, 1, 0) is returned.
+    """
+    if int(os.environ.get('WORLD_SIZE', '1')) <= 1:
+        return 0, 1, 0
+    dist.init_process_group(backend=backend)
+    return dist.get_rank(), dist.get_world_size(), int(os.environ.get('LOCAL_RANK', '0'))
+
+
+def pin_cores(local_rank, local_world_size, threads=None):
+    """Restrict this rank to its own contiguous slice of the usable cores.
+
+    Sets the intra-op thread count to the slice size (or `threads`). Returns
+    the pinned core list, or None where affinity is unsupported (Windows/macOS).
+    """
+    if not hasattr(os, 'sched_getaffinity'):
+        if threads:
+            torch.set_num_threads(threads)
+        return None
+    cores = sorted(os.sched_getaffinity(0))
+    per = max(1, len(cores) // max(1, local_world_size))
+    mine = cores[local_rank * per:(local_rank + 1) * per] or cores
+    os.sched_setaffinity(0, mine)
+    torch.set_num_threads(threads or len(mine))
+    return mine
+
+
+def wrap_ddp(model, bucket_cap_mb=25):
+    """Wrap `model` in DistributedDataParallel with gradient bucketing.
+
+    Experts that receive no tokens on a rank produce no gradient, so unused
+    parameters must be detected for the reduction to complete.
+    """
+    from torch.nn.parallel import DistributedDataParallel
+    return DistributedDataParallel(model, bucket_cap_mb=bucket_cap_mb,
+                                   find_unused_parameters=True, gradient_as_bucket_view=True)
+
+
+def unwrap(model):
+    """The underlying module of a DDP/DeepSpeed wrapper (or the model itself)."""
+    return getattr(model, 'module', model)
+
+
+def is_main_process():
+    return not dist.is_initialized() or dist.get_rank() == 0
+
+
+def cleanup():
+    if dist.is_initialized():
+        dist.destroy_process_group()
@@ -0,0 +1,140 @@
+import math
+import queue as queue_lib
+import time
+import torch
+import torch.distributed as dist
+import torch.multiprocessing as mp
+
+
+def load_eval_batches(paths, tokenizer, seq_len=128, batch_size=32, max_lines=None):
+    """Tokenize held-out files once into padded (batch, <= seq_len + 1) id tensors.
+
+    - every line is split into non-overlapping windows (consecutive windows
+      share one boundary token, so every token is predicted exactly once).
+    - windows are sorted by length before batching so little compute is
+      spent on padding.
+    Returns a list of LongTensors; reuse it across evaluations.
+    """
+    if isinstance(paths, str):
+        paths = [paths]
+    windows = []
+    for path in paths:
+        with open(path, 'r', encoding='utf-8', errors='ignore') as f:
+            for n, line in enumerate(f):
+                if max_lines is not None and n >= max_lines:
+                    break
+                if not line.strip():
+                    continue
+                ids = tokenizer.encode(line)
+                for i in range(0, len(ids) - 1, seq_len):
+                    windows.append(ids[i:i + seq_len + 1])
+    windows.sort(key=len)
+    batches = []
+    for i in range(0, len(windows), batch_size):
+        chunk = windows[i:i + batch_size]
+        out = torch.zeros(len(chunk), max(len(w) for w in chunk), dtype=torch.long)
+        for j, w in enumerate(chunk):
+            out[j, :len(w)] = torch.tensor(w, dtype=torch.long)
+        batches.append(out)
+    return batches
+
+
+def _loss_sums(model, batches, pad_id=0, device=None):
+    loss_sum, n_tokens = 0.0, 0
+    for batch in batches:
+        if device is not None:
+            batch = batch.to(device, non_blocking=True)
+        targets = batch[:, 1:]
+        nll, _ = model(batch[:, :-1], targets=targets, pad_id=pad_id)
+        loss_sum += float(nll)
+        n_tokens += int((targets != pad_id).sum())
+    return loss_sum, n_tokens
+
+
+def _metrics(loss_sum, n_tokens, elapsed):
+    loss = loss_sum / max(n_tokens, 1)
+    return {'loss': loss, 'ppl': math.exp(min(loss, 50.0)), 'tokens': n_tokens,
+            'time': elapsed, 'tokens_per_s': n_tokens / elapsed if elapsed > 0 else 0.0}
+
+
+def evaluate(model, batches, pad_id=0, device=None, max_batches=None):
+    """Token-level loss / perplexity over `batches` under `torch.inference_mode`.
+
+    - `max_batches` caps the cost of periodic in-training evaluation.
+    - under torch.distributed each rank evaluates every world_size-th batch
+      and the sums are all-reduced, so every rank returns the global result.
+    - the model's train/eval mode is restored afterwards.
+    Returns {'loss', 'ppl', 'tokens', 'time', 'tokens_per_s'}.
+    """
+    if max_batches is not None:
+        batches = batches[:max_batches]
+    distributed = dist.is_available() and dist.is_initialized()
+    if distributed:
+        batches = batches[dist.get_rank()::dist.get_world_size()]
+    was_training = model.training
+    model.eval()
+    t0 = time.perf_counter()
+    try:
+        with torch.inference_mode():
+            loss_sum, n_tokens = _loss_sums(model, batches, pad_id, device)
+    finally:
+        model.train(was_training)
+    if distributed:
+        totals = torch.tensor([loss_sum, float(n_tokens)], dtype=torch.float64)
+        dist.all_reduce(totals)
+        loss_sum, n_tokens = float(totals[0]), int(totals[1])
+    return _metrics(loss_sum, n_tokens, time.perf_counter() - t0)
+
+
+def _worker(model, batches, pad_id, threads, queue):
+    torch.set_num_threads(threads)
+    with torch.inference_mode():
+        queue.put(_loss_sums(model, batches, pad_id))
+
+
+def evaluate_parallel(model, batches, workers=2, pad_id=0, threads_per_worker=None):
+    """CPU evaluation split across `workers` processes sharing the model weights.
+
+    Batches are dealt round-robin; each worker uses `threads_per_worker`
+    intra-op threads (default: current threads / workers). Same result as
+    `evaluate`; with `workers <= 1` it simply calls it.
+    """
+    if workers <= 1:
+        return evaluate(model, batches, pad_id=pad_id)
+    threads = threads_per_worker or max(1, torch.get_num_threads() // workers)
+    was_training = model.training
+    model.eval()
+    model.share_memory()
+    ctx = mp.get_context('spawn')
+    queue = ctx.Queue()
+    t0 = time.perf_counter()
+    procs = [ctx.Process(target=_worker, args=(model, batches[w::workers], pad_id, threads, queue))
+             for w in range(workers)]
+    for p in procs:
+        p.start()
+    results = []
+    try:
+        while len(results) < workers:
+            try:
+                results.append(queue.get(timeout=1.0))
+            except queue_lib.Empty:
+                failed = [p.exitcode for p in procs if p.exitcode not in (None, 0)]
+                if failed:
+                    raise RuntimeError(f'evaluation worker exited with code {failed[0]}')
+    finally:
+        for p in procs:
+            if len(results) < workers:
+                p.terminate()
+            p.join()
+        model.train(was_training)
+    return _metrics(sum(r[0] for r in results), sum(r[1] for r in results), time.perf_counter() - t0)
+
+
+def combine_metrics(results):
+    """Token-weighted total of several `evaluate` results (e.g. one per file)."""
+    loss_sum = sum(m['loss'] * m['tokens'] for m in results)
+    return _metrics(loss_sum, sum(m['tokens'] for m in results), sum(m['time'] for m in results))
+
+
+def format_metrics(m):
+    return f"loss {m['loss']:.4f}, ppl {m['ppl']:.2f}, {m['tokens']:,} tokens, {m['tokens_per_s']:.0f} tok/s"
@@ -0,0 +1,243 @@
+import json
+import types
+import zipfile
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+from src.attention import KVCache, rotate
+
+FORMATS = ('export', 'torchscript')
+
+
+class InferenceGraph(nn.Module):
+    """`MoETransformer` inference as a pure function of tensors, for ahead-of-time export.
+
+    forward(ids, mask, seen, past_keys, past_values, past_pos, past_valid)
+    feeds `ids` (batch, seq) after the cached columns (`past_*`: per-layer
+    (batch, kv_heads, n, head_dim) keys/values and their (batch, n)
+    positions / validity) and returns the last position's logits
+    (batch, vocab) plus each layer's new keys/values; the cache itself is
+    kept outside the graph (see `ExportedModel`), so one graph serves
+    prefill (no valid past columns) and decode.
+    - same math as the eager forward: per-row positions from `mask`,
+      causal / windowed / padding masks, GQA, rotary or learned positions.
+    - attention takes the past and the new keys as two blocks under one
+      softmax, so the cached keys/values are never copied into the graph.
+    - MoE dispatch has no Python branch on the routing: each expert runs on
+      the rows `nonzero` picks for it (possibly none), which traces and
+      exports with data-dependent sizes and costs the same as eager.
+    """
+
+    def __init__(self, model):
+        super().__init__()
+        self.model = model
+
+    def forward(self, ids, mask, seen, past_keys, past_values, past_pos, past_valid):
+        m = self.model
+        positions = (seen[:, None] + mask.cumsum(dim=1) - 1).clamp_min(0)
+        valid = mask.bool()
+        x = m.tok_emb(ids.t())
+        if m.pos_encoding == 'learned':
+            x = x + m.pos_emb[0, positions].transpose(0, 1)
+        keys, values = [], []
+        for i, layer in enumerate(m.layers):
+            a, k, v = self._attention(layer.attn, x, positions, valid, past_keys[i], past_values[i], past_pos, past_valid)
+            keys.append(k)
+            values.append(v)
+            x = layer.ln1(x + a)
+            x = layer.ln2(x + (self._moe(layer.moe, x) if layer.use_moe else layer.ff(x)))
+        x = m.ln(x[-1])
+        logits = m.head.log_prob(x) if m.adaptive else m.head(x)
+        return logits, tuple(keys), tuple(values)
+
+    @staticmethod
+    def _attention(attn, x, positions, valid, past_k, past_v, past_pos, past_valid):
+        seq, batch, _ = x.shape
+        groups = attn.n_heads // attn.n_kv_heads
+        q = attn.q_proj(x).view(seq, batch, attn.n_heads, attn.head_dim).permute(1, 2, 0, 3)
+        k = attn.k_proj(x).view(seq, batch, attn.n_kv_heads, attn.head_dim).permute(1, 2, 0, 3)
+        v = attn.v_proj(x).view(seq, batch, attn.n_kv_heads, attn.head_dim).permute(1, 2, 0, 3)
+        if attn.rotary:
+            q, k = rotate(q, positions, attn.rope_base), rotate(k, positions, attn.rope_base)
+        # queries folded into their KV group, rows ordered group-major like GroupedQueryAttention._attend
+        q = q.reshape(batch, attn.n_kv_heads, groups * seq, attn.head_dim) * attn.head_dim ** -0.5
+        q_pos = positions.repeat(1, groups)
+        k_pos = torch.cat([past_pos, positions], dim=1)
+        mask = (k_pos[:, None, :] <= q_pos[:, :, None]) & torch.cat([past_valid, valid], dim=1)[:, None, :]
+        if attn.window:
+            mask = mask & (k_pos[:, None, :] > q_pos[:, :, None] - attn.window)
+        mask = mask | ~mask.any(dim=-1, keepdim=True)  # padding queries: anything but a NaN softmax
+        scores = torch.cat([q @ past_k.transpose(-1, -2), q @ k.transpose(-1, -2)], dim=-1)
+        probs = scores.masked_fill(~mask[:, None], float('-inf')).softmax(dim=-1)
+        n = past_k.size(2)
+        out = probs[..., :n] @ past_v + probs[..., n:] @ v
+        out = out.reshape(batch, attn.n_heads, seq, attn.head_dim).permute(2, 0, 1, 3).reshape(seq, batch, -1)
+        return attn.out_proj(out), k, v
+
+    @staticmethod
+    def _moe(moe, x):
+        flat = x.reshape(-1, x.size(-1))
+        vals, idx = F.softmax(moe.gate(flat), dim=-1).topk(moe.top_k, dim=-1)
+        out = torch.zeros_like(flat)
+        for e, expert in enumerate(moe.experts):
+            hit = idx == e
+            rows = hit.any(dim=-1).nonzero().squeeze(-1)
+            weight = (vals * hit).sum(dim=-1).index_select(0, rows)
+            out = out.index_add(0, rows, expert(flat.index_select(0, rows)) * weight[:, None])
+        return out.view_as(x)
+
+
+def graph_meta(model):
+    """What `ExportedModel` needs to know about the exported model (stored next to the graph)."""
+    attn = model.layers[0].attn
+    p = next(model.parameters())
+    return {'n_layers': len(model.layers), 'n_kv_heads': attn.n_kv_heads, 'head_dim': attn.head_dim,
+            'attn_window': model.attn_window, 'pos_encoding': model.pos_encoding,
+            'max_positions': model.pos_emb.size(1) if model.pos_encoding == 'learned' else None,
+            'vocab_size': model.tok_emb.num_embeddings, 'dtype': str(p.dtype).replace('torch.', ''),
+            'device': str(p.device)}
+
+
+def _example_inputs(meta, batch=2, seq=3, past=4):
+    # distinct sizes >= 2, so export neither specializes them (0/1) nor assumes they are equal
+    device = torch.device(meta['device'])
+    dtype = getattr(torch, meta['dtype'])
+    def kv():
+        return tuple(torch.zeros(batch, meta['n_kv_heads'], past, meta['head_dim'], dtype=dtype, device=device)
+                     for _ in range(meta['n_layers']))
+    return (torch.ones(batch, seq, dtype=torch.long, device=device), torch.ones(batch, seq, dtype=torch.long, device=device),
+            torch.full((batch,), past, dtype=torch.long, device=device), kv(), kv(),
+            torch.arange(past, device=device).expand(batch, past).contiguous(),
+            torch.ones(batch, past, dtype=torch.bool, device=device))
+
+
+def export_model(model, path, fmt='export', extra_meta=None):
+    """Write `model`'s inference graph, weights included, to one file at `path`; returns the format used.
+
+    `fmt='export'` uses torch.export with dynamic batch / new tokens / cached
+    columns and falls back to a TorchScript trace when torch.export is
+    missing or fails on this model. The artifact runs on the device the
+    model is on.
+    """
+    if fmt not in FORMATS:
+        raise ValueError(f'format must be one of {FORMATS}, got {fmt!r}')
+    model.eval()
+    graph = InferenceGraph(model).eval()
+    meta = dict(graph_meta(model), **(extra_meta or {}))
+    example = _example_inputs(meta)
+    with torch.no_grad():
+        if fmt == 'export':
+            try:
+                program = _export(graph, example, meta['n_layers'])
+                torch.export.save(program, path, extra_files={'meta.json': json.dumps(dict(meta, format='export'))})
+                return 'export'
+            except Exception as e:  # old torch, or an op torch.export cannot handle yet
+                print(f'[!] torch.export failed ({type(e).__name__}: {e}); falling back to TorchScript')
+        traced = torch.jit.trace(graph, example, check_trace=False)
+        torch.jit.save(traced, path, _extra_files={'meta.json': json.dumps(dict(meta, format='torchscript'))})
+    return 'torchscript'
+
+
+def _export(graph, example, n_layers):
+    from torch.export import Dim, export
+    batch, seq, past = Dim('batch'), Dim('seq'), Dim('past')
+    kv = tuple({0: batch, 2: past} for _ in range(n_layers))
+    shapes = {'ids': {0: batch, 1: seq}, 'mask': {0: batch, 1: seq}, 'seen': {0: batch}, 'past_keys': kv,
+              'past_values': kv, 'past_pos': {0: batch, 1: past}, 'past_valid': {0: batch, 1: past}}
+    return export(graph, example, dynamic_shapes=shapes)
+
+
+def artifact_format(path):
+    """The format `export_model` recorded in the artifact at `path` ('export' or 'torchscript').
+
+    Both formats are zip archives that carry the `meta.json` record next to
+    the graph, so it is read straight from the archive without loading
+    anything.
+    """
+    with zipfile.ZipFile(path) as archive:
+        name = next((n for n in archive.namelist() if n == 'meta.json' or n.endswith('/meta.json')), None)
+        if name is None:
+            raise ValueError(f'{path} is not an artifact written by export_model (no meta.json record)')
+        return json.loads(archive.read(name))['format']
+
+
+def load_exported(path):
+    """An `ExportedModel` from a file written by `export_model` (either format)."""
+    extra = {'meta.json': ''}
+    if artifact_format(path) == 'export':
+        graph = torch.export.load(path, extra_files=extra).module()
+    else:
+        graph = torch.jit.load(path, _extra_files=extra)
+    return ExportedModel(graph, json.loads(extra['meta.json']))
+
+
+class ExportedModel(nn.Module):
+    """Runs an exported `InferenceGraph` behind the model's generation interface.
+
+    Usable wherever generation takes a model (`decode_steps`, `stream_text`,
+    `ChatSession`, `BatchEngine`): `model(ids, cache=KVCache, attention_mask=...,
+    last_only=True)` runs the graph once and appends its keys/values to the
+    cache. Only last-position logits are available, so there is no
+    training, scoring or speculative verification with it.
+    - exported graphs specialize sizes 0 and 1, so a single row or token is
+      padded to two (a duplicated row, a masked column) and the padding is
+      dropped from the outputs; the cache never sees it.
+    - `layers` / `attn_window` / `pos_emb` carry shapes only, for
+      `KVCache.for_model`, `kv_bytes_per_token` and `ChatSession`.
+    """
+
+    def __init__(self, graph, meta):
+        super().__init__()
+        self.graph = graph
+        self.meta = meta
+        self.format = meta.get('format')
+        self.attn_window = meta['attn_window']
+        self.pos_encoding = meta['pos_encoding']
+        attn = types.SimpleNamespace(n_kv_heads=meta['n_kv_heads'], head_dim=meta['head_dim'])
+        self.layers = [types.SimpleNamespace(attn=attn)] * meta['n_layers']
+        if meta['max_positions']:
+            self.pos_emb = torch.empty(1, meta['max_positions'], 0)
+
+    def train(self, mode=True):
+        return self  # the graph was exported in eval mode; exported modules refuse train()/eval()
+
+    def forward(self, ids, targets=None, pad_id=0, last_only=False, cache=None, attention_mask=None):
+        if targets is not None or not last_only:
+            raise ValueError('an exported model only computes last-position logits (last_only=True, no targets)')
+        if cache is None:
+            cache = KVCache.for_model(self)
+        batch, seq = ids.shape
+        mask = torch.ones_like(ids) if attention_mask is None else attention_mask.long()
+        seen = cache.seen if cache.seen is not None else mask.new_zeros(batch)
+        n = min(cache.length, self.attn_window or cache.length)
+        if n:
+            past_k = [k[:, :, :n] for k in cache.keys]
+            past_v = [v[:, :, :n] for v in cache.values]
+            past_pos, past_valid = cache.positions[0][:, :n], cache.valid[0][:, :n]
+        else:
+            past_k = [ids.new_zeros(batch, self.meta['n_kv_heads'], 0, self.meta['head_dim'],
+                                    dtype=getattr(torch, self.meta['dtype']))] * len(self.layers)
+            past_v = past_k
+            past_pos, past_valid = mask.new_zeros(batch, 0), mask.new_zeros(batch, 0, dtype=torch.bool)
+        g_ids, g_mask = ids, mask
+        if n < 2:  # invalid zero columns: attended by nothing
+            pad = 2 - n
+            past_k = [torch.cat([k.new_zeros(batch, k.size(1), pad, k.size(3)), k], dim=2) for k in past_k]
+            past_v = [torch.cat([v.new_zeros(batch, v.size(1), pad, v.size(3)), v], dim=2) for v in past_v]
+            past_pos = torch.cat([past_pos.new_zeros(batch, pad), past_pos], dim=1)
+            past_valid = torch.cat([past_valid.new_zeros(batch, pad), past_valid], dim=1)
+        if seq < 2:  # a masked column before the token
+            g_ids = torch.cat([ids.new_full((batch, 1), pad_id), ids], dim=1)
+            g_mask = torch.cat([mask.new_zeros(batch, 1), mask], dim=1)
+        inputs = [g_ids, g_mask, seen, tuple(past_k), tuple(past_v), past_pos, past_valid]
+        if batch < 2:  # a duplicate of the row (views, no copies)
+            inputs = [tuple(t.expand(2, *t.shape[1:]) for t in x) if isinstance(x, tuple) else x.expand(2, *x.shape[1:])
+                      for x in inputs]
+        logits, keys, values = self.graph(*inputs)
+        logits = logits[:batch]
+        positions = (seen[:, None] + mask.cumsum(dim=1) - 1).clamp_min(0)
+        valid = None if attention_mask is None else attention_mask.bool()
+        for i, (k, v) in enumerate(zip(keys, values)):
+            cache.update(i, k[:batch, :, -seq:], v[:batch, :, -seq:], positions, valid)
+        cache.seen = seen + mask.sum(dim=1)
+        return logits[:, None], logits.new_tensor(0.0)
@@ -0,0 +1,164 @@
+import torch
+from src.attention import KVCache
+from src.sampling import Sampler
+from src.tokenizer import IncrementalDecoder
+
+
+def left_pad(sequences, pad_id=0, device=None):
+    """Left-pad id lists into (ids, attention_mask), both (batch, max_len).
+
+    Left padding puts every prompt's last token in the final column, so one
+    batched decode step continues all of them.
+    """
+    width = max(len(s) for s in sequences)
+    ids = torch.full((len(sequences), width), pad_id, dtype=torch.long, device=device)
+    mask = torch.zeros((len(sequences), width), dtype=torch.long, device=device)
+    for i, s in enumerate(sequences):
+        if s:
+            ids[i, width - len(s):] = torch.as_tensor(s, dtype=torch.long)
+            mask[i, width - len(s):] = 1
+    return ids, mask
+
+
+@torch.inference_mode()
+def prefill(model, prompts, pad_id=0, prefix_cache=None):
+    """Run `prompts` (lists of ids) through `model`; returns (KVCache, last-position logits (batch, vocab)).
+
+    Without a `PrefixCache` the prompts are left-padded into one forward
+    pass. With one, each prompt resumes from its longest cached prefix, only
+    the remaining tokens are computed, and the prompt is stored for later
+    requests; the rows are then joined into one cache. Models with an
+    attention window always take the first path.
+    """
+    device = next(model.parameters()).device
+    if prefix_cache is None or model.attn_window:
+        ids, mask = left_pad(prompts, pad_id, device)
+        cache = KVCache.for_model(model)
+        logits, _ = model(ids, attention_mask=mask, cache=cache, last_only=True)
+        return cache, logits[:, -1]
+    cache, last = KVCache.for_model(model), []
+    for p in prompts:
+        row, n = prefix_cache.lookup(p)
+        row = row or KVCache.for_model(model)
+        logits, _ = model(torch.tensor([p[n:]], device=device), cache=row, last_only=True)
+        prefix_cache.insert(p, row)
+        cache.extend(row)
+        last.append(logits[:, -1])
+    return cache, torch.cat(last)
+
+
+@torch.inference_mode()
+def decode_steps(model, prompts, max_new_tokens=50, temperature=0.8, top_k=10, eos_id=None, pad_id=0,
+                 generator=None, profiler=None, prefix_cache=None, cache=None, **sampling):
+    """Batched autoregressive decoding of several prompts (lists of ids), one step at a time.
+
+    - prompts are prefilled together (see `prefill`; `prefix_cache` reuses
+      cached prompt prefixes), then every step decodes one token for all
+      unfinished sequences against a shared `KVCache`.
+    - tokens are drawn by a `Sampler` (top_k 0 = greedy); `sampling` takes
+      its other settings (top_p, min_p, repetition / frequency / presence
+      penalties, seeds), each a scalar or one value per prompt.
+    - a sequence stops at `eos_id` (not yielded) or after its
+      `max_new_tokens` (an int, or one per prompt); finished rows are
+      compacted out of the batch and the cache, so later steps only pay for
+      live sequences.
+    - `profiler.step()` (see `StepProfiler`) is called once per decode step.
+    - pass a `cache` to continue it: `prompts` are then the tokens following
+      each row's cached ones (e.g. the next chat turn). An empty cache is
+      filled by the prefill.
+    Yields [(prompt index, token id)] per step, as soon as it is sampled;
+    closing the generator stops decoding.
+    """
+    model.eval()
+    device = next(model.parameters()).device
+    limits = [max_new_tokens] * len(prompts) if isinstance(max_new_tokens, int) else list(max_new_tokens)
+    counts = [0] * len(prompts)
+    rows = [i for i, n in enumerate(limits) if n > 0]
+    if not rows:
+        return
+    if cache is not None and cache.seen is not None:
+        if len(rows) < len(prompts):
+            cache.select(torch.tensor(rows, device=device))
+        ids, mask = left_pad([prompts[i] for i in rows], pad_id, device)
+        logits = model(ids, attention_mask=mask, cache=cache, last_only=True)[0][:, -1]
+    else:
+        fresh, logits = prefill(model, [prompts[i] for i in rows], pad_id, prefix_cache)
+        if cache is None:
+            cache = fresh
+        else:
+            cache.extend(fresh)
+    sampler = Sampler(len(prompts), logits.size(-1), temperature=temperature, top_k=top_k, prompts=prompts,
+                      device=device, generator=generator, **sampling)
+    active = torch.tensor(rows, device=device)
+    if len(rows) < len(prompts):
+        sampler.select(active)
+    while True:
+        next_ids = sampler.sample(logits)
+        keep, produced = [], []
+        for j, (row, tok) in enumerate(zip(active.tolist(), next_ids.tolist())):
+            if tok == eos_id:
+                continue
+            produced.append((row, tok))
+            counts[row] += 1
+            if counts[row] < limits[row]:
+                keep.append(j)
+        if profiler is not None:
+            profiler.step()
+        yield produced
+        if not keep:
+            return
+        if len(keep) < len(active):
+            keep = torch.tensor(keep, device=device)
+            active, next_ids = active[keep], next_ids[keep]
+            cache.select(keep)
+            sampler.select(keep)
+        logits = model(next_ids[:, None], cache=cache, last_only=True)[0][:, -1]
+
+
+def generate_ids(model, prompts, **kwargs):
+    """Run `decode_steps` to completion; returns the generated ids per prompt, in input order."""
+    outputs = [[] for _ in prompts]
+    for produced in decode_steps(model, prompts, **kwargs):
+        for row, tok in produced:
+            outputs[row].append(tok)
+    return outputs
+
+
+def generate_text(model, tokenizer, prompts, include_prompt=False, **kwargs):
+    """Decode `prompts` (strings) as one batch with `generate_ids`; returns strings.
+
+    Uses the tokenizer's <eos> / <pad> ids. With `include_prompt` each result
+    is the decoded prompt + continuation, otherwise the continuation only.
+    """
+    encoded = [tokenizer.encode(p) for p in prompts]
+    kwargs.setdefault('eos_id', tokenizer.vocab.get('<eos>'))
+    kwargs.setdefault('pad_id', tokenizer.vocab.get('<pad>', 0))
+    generated = generate_ids(model, encoded, **kwargs)
+    return [tokenizer.decode((p if include_prompt else []) + g) for p, g in zip(encoded, generated)]
+
+
+def stream_text(model, tokenizer, prompt, stop=(), unk_text='<unk>', **kwargs):
+    """Yield text deltas for one prompt while it is generated.
+
+    Tokens go through an `IncrementalDecoder`, so each step costs one token
+    of detokenization; generation ends at <eos>, the token limit, or the
+    first of the `stop` strings (which is not yielded). <unk> is shown as
+    `unk_text`.
+    """
+    kwargs.setdefault('eos_id', tokenizer.vocab.get('<eos>'))
+    kwargs.setdefault('pad_id', tokenizer.vocab.get('<pad>', 0))
+    decoder = IncrementalDecoder(tokenizer, stop=stop, unk_text=unk_text)
+    steps = decode_steps(model, [tokenizer.encode(prompt)], **kwargs)
+    try:
+        for produced in steps:
+            for _, tok in produced:
+                delta = decoder.push(tok)
+                if delta:
+                    yield delta
+            if decoder.stopped:
+                return
+        tail = decoder.flush()
+        if tail:
+            yield tail
+    finally:
+        steps.close()
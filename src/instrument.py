@@ -0,0 +1,170 @@
+import math
+import time
+import torch
+from src.model import TransformerBlock
+
+
+class Histogram:
+    """Running count / sum / min / max plus power-of-two buckets.
+
+    Bucket `i` counts values in [2**i, 2**(i+1)) after multiplying by `scale`
+    (e.g. 1e6 to bucket seconds as microseconds).
+    """
+
+    def __init__(self, scale=1.0):
+        self.scale = scale
+        self.count = 0
+        self.total = 0.0
+        self.min = math.inf
+        self.max = 0.0
+        self.buckets = {}
+
+    def add(self, value):
+        self.count += 1
+        self.total += value
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+        b = int(math.log2(max(value * self.scale, 1.0)))
+        self.buckets[b] = self.buckets.get(b, 0) + 1
+
+    @property
+    def mean(self):
+        return self.total / self.count if self.count else 0.0
+
+    def as_dict(self):
+        return {'count': self.count, 'total': self.total, 'mean': self.mean,
+                'min': self.min if self.count else 0.0, 'max': self.max,
+                'buckets': dict(sorted(self.buckets.items()))}
+
+
+def _tensor_bytes(obj):
+    if isinstance(obj, torch.Tensor):
+        return obj.numel() * obj.element_size()
+    if isinstance(obj, (tuple, list)):
+        return sum(_tensor_bytes(o) for o in obj)
+    return 0
+
+
+class LayerInstrumenter:
+    """Forward/backward timing and activation-size hooks for a `MoETransformer`.
+
+    - hooks every `TransformerBlock` and its attention and MoE / FFN
+      sublayers (names as in `model.named_modules()`, e.g. 'layers.3.moe').
+    - per module it aggregates forward time, backward time and output
+      activation bytes into `Histogram`s; `stats()` returns them as dicts and
+      `table()` formats them sorted by total time.
+    - hooks exist only between `attach()` and `detach()` (or inside a `with`
+      block), so a detached model runs with zero overhead.
+    - on CUDA, pass `sync_cuda=True` to synchronize around each measurement.
+    """
+
+    def __init__(self, model, sync_cuda=False):
+        self.model = model
+        self.sync_cuda = sync_cuda and torch.cuda.is_available()
+        self.forward = {}
+        self.backward = {}
+        self.activation_bytes = {}
+        self._handles = []
+        self._fwd_start = {}
+        self._bwd_start = {}
+
+    def targets(self):
+        for name, module in self.model.named_modules():
+            if isinstance(module, TransformerBlock):
+                yield name, module
+                yield f'{name}.attn', module.attn
+                if module.use_moe:
+                    yield f'{name}.moe', module.moe
+                else:
+                    yield f'{name}.ff', module.ff
+
+    def attach(self):
+        if self._handles:
+            return self
+        for name, module in self.targets():
+            self.forward.setdefault(name, Histogram(scale=1e6))
+            self.backward.setdefault(name, Histogram(scale=1e6))
+            self.activation_bytes.setdefault(name, Histogram())
+            self._handles += [
+                module.register_forward_pre_hook(self._fwd_pre(name)),
+                module.register_forward_hook(self._fwd_post(name)),
+                module.register_full_backward_pre_hook(self._bwd_pre(name)),
+                module.register_full_backward_hook(self._bwd_post(name)),
+            ]
+        return self
+
+    def detach(self):
+        for h in self._handles:
+            h.remove()
+        self._handles = []
+        self._fwd_start.clear()
+        self._bwd_start.clear()
+
+    def reset(self):
+        self.forward.clear()
+        self.backward.clear()
+        self.activation_bytes.clear()
+        if self._handles:
+            self.detach()
+            self.attach()
+
+    def __enter__(self):
+        return self.attach()
+
+    def __exit__(self, *exc):
+        self.detach()
+
+    def _now(self):
+        if self.sync_cuda:
+            torch.cuda.synchronize()
+        return time.perf_counter()
+
+    def _fwd_pre(self, name):
+        def hook(module, inputs):
+            self._fwd_start[name] = self._now()
+        return hook
+
+    def _fwd_post(self, name):
+        def hook(module, inputs, output):
+            self.forward[name].add(self._now() - self._fwd_start.pop(name))
+            self.activation_bytes[name].add(_tensor_bytes(output))
+        return hook
+
+    def _bwd_pre(self, name):
+        def hook(module, grad_output):
+            self._bwd_start[name] = self._now()
+        return hook
+
+    def _bwd_post(self, name):
+        def hook(module, grad_input, grad_output):
+            start = self._bwd_start.pop(name, None)
+            if start is not None:
+                self.backward[name].add(self._now() - start)
+        return hook
+
+    def stats(self):
+        """{module name: {'forward': hist, 'backward': hist, 'activation_bytes': hist}}."""
+        return {name: {'forward': self.forward[name].as_dict(),
+                       'backward': self.backward[name].as_dict(),
+                       'activation_bytes': self.activation_bytes[name].as_dict()}
+                for name in self.forward}
+
+    def table(self, sort_by='total'):
+        """Per-module table; `sort_by` is 'total' (fwd+bwd time), 'forward', 'backward' or 'memory'."""
+        keys = {
+            'total': lambda n: self.forward[n].total + self.backward[n].total,
+            'forward': lambda n: self.forward[n].total,
+            'backward': lambda n: self.backward[n].total,
+            'memory': lambda n: self.activation_bytes[n].mean,
+        }
+        names = sorted(self.forward, key=keys[sort_by], reverse=True)
+        grand = sum(self.forward[n].total + self.backward[n].total for n in names
+                    if n.count('.') == 1) or 1.0  # blocks only, sublayers are nested in them
+        header = f"{'module':<20}{'calls':>7}{'fwd ms':>10}{'bwd ms':>10}{'fwd avg':>10}{'act MB':>9}{'% blk':>7}"
+        rows = [header, '-' * len(header)]
+        for n in names:
+            f, b, a = self.forward[n], self.backward[n], self.activation_bytes[n]
+            share = f'{(f.total + b.total) / grand * 100:.1f}' if n.count('.') == 1 else ''
+            rows.append(f'{n:<20}{f.count:>7}{f.total * 1e3:>10.2f}{b.total * 1e3:>10.2f}'
+                        f'{f.mean * 1e3:>10.3f}{a.mean / 2 ** 20:>9.2f}{share:>7}')
+        return '\n'.join(rows)
@@ -1,11 +1,16 @@
 import torch
 import torch.nn as nn
+from torch.profiler import record_function
+import torch.nn.functional as F
 from src.moe_layer import SimpleMoE
+from src.adaptive_head import AdaptiveHead
+from src.attention import GroupedQueryAttention
 
 class TransformerBlock(nn.Module):
-    def __init__(self, d_model, n_heads, d_ff=None, use_moe=False, num_experts=8, moe_top_k=1):
+    def __init__(self, d_model, n_heads, d_ff=None, use_moe=False, num_experts=8, moe_top_k=1, n_kv_heads=None,
+                 attn_window=None, rotary=False):
         super().__init__()
-        self.attn = nn.MultiheadAttention(d_model, n_heads)
+        self.attn = GroupedQueryAttention(d_model, n_heads, n_kv_heads, window=attn_window, rotary=rotary)
         self.ln1 = nn.LayerNorm(d_model)
         self.ln2 = nn.LayerNorm(d_model)
         self.use_moe = use_moe
@@ -15,46 +20,105 @@ class TransformerBlock(nn.Module):
         else:
             self.ff = nn.Sequential(nn.Linear(d_model, d_ff), nn.ReLU(), nn.Linear(d_ff, d_model))
 
-    def forward(self, x, attn_mask=None):
-        # x: (seq_len, batch, d_model)
+    def forward(self, x, positions=None, cache=None, layer_idx=0, valid=None):
+        # x: (seq_len, batch, d_model); positions / valid: token positions and padding (see GroupedQueryAttention)
         res = x
-        x2, _ = self.attn(x, x, x, attn_mask=attn_mask)
+        with record_function('attention'):
+            x2 = self.attn(x, positions=positions, cache=cache, layer_idx=layer_idx, valid=valid)
         x = self.ln1(res + x2)
         res = x
         if self.use_moe:
             x2, load_loss = self.moe(x)
         else:
-            x2 = self.ff(x)
+            with record_function('ffn'):
+                x2 = self.ff(x)
             load_loss = x2.new_tensor(0.0)
         x = self.ln2(res + x2)
         return x, load_loss
 
 class MoETransformer(nn.Module):
-    def __init__(self, vocab_size, d_model=1024, n_layers=22, n_heads=16, d_ff=4096, num_experts=16, moe_layers=None, moe_top_k=1):
+    def __init__(self, vocab_size, d_model=1024, n_layers=22, n_heads=16, d_ff=4096, num_experts=16, moe_layers=None, moe_top_k=1,
+                 adaptive_cutoffs=None, adaptive_div=4.0, n_kv_heads=None, attn_window=None, pos_encoding='learned'):
         super().__init__()
         self.tok_emb = nn.Embedding(vocab_size, d_model)
-        self.pos_emb = nn.Parameter(torch.zeros(1, 1024, d_model))  # max len 1024
+        # 'learned': absolute embeddings, max len 1024; 'rope': rotary inside attention, no length limit
+        if pos_encoding not in ('learned', 'rope'):
+            raise ValueError(f"pos_encoding must be 'learned' or 'rope', got {pos_encoding!r}")
+        self.pos_encoding = pos_encoding
+        self.attn_window = attn_window
+        if pos_encoding == 'learned':
+            self.pos_emb = nn.Parameter(torch.zeros(1, 1024, d_model))  # max len 1024
         self.layers = nn.ModuleList()
         if moe_layers is None:
             moe_layers = list(range(n_layers))  # use MoE in all layers by default
         for i in range(n_layers):
             use_moe = (i in moe_layers)
-            self.layers.append(TransformerBlock(d_model, n_heads, d_ff=d_ff, use_moe=use_moe, num_experts=num_experts, moe_top_k=moe_top_k))
+            self.layers.append(TransformerBlock(d_model, n_heads, d_ff=d_ff, use_moe=use_moe, num_experts=num_experts, moe_top_k=moe_top_k,
+                                              n_kv_heads=n_kv_heads, attn_window=attn_window,
+                                              rotary=pos_encoding == 'rope'))
         self.ln = nn.LayerNorm(d_model)
-        self.head = nn.Linear(d_model, vocab_size, bias=False)
+        # adaptive_cutoffs: frequency-partitioned output layer instead of a dense vocab projection
+        self.adaptive = bool(adaptive_cutoffs)
+        if self.adaptive:
+            self.head = AdaptiveHead(d_model, vocab_size, adaptive_cutoffs, div_value=adaptive_div)
+        else:
+            self.head = nn.Linear(d_model, vocab_size, bias=False)
 
-    def forward(self, ids):
+    def forward(self, ids, targets=None, pad_id=0, last_only=False, cache=None, attention_mask=None):
         # ids: (batch, seq_len)
+        # returns (logits (batch, seq_len, vocab), aux); with the adaptive head the "logits" are log-probs.
+        # targets: return (summed token NLL ignoring pad_id, aux) instead, without full-vocab logits when adaptive.
+        # last_only: output for the last position only (generation)
+        # cache: KVCache; ids are the tokens following the cached ones
+        # attention_mask: (batch, seq_len), 0 = padding (left padding for batched prompts); each row's
+        #   positions count its real tokens only and padded keys are never attended to
+        if cache is not None and self.attn_window and ids.size(1) > self.attn_window and targets is None:
+            # long prompt against a windowed cache: feed it a window at a time so memory stays bounded
+            w = self.attn_window
+            chunks = [self(ids[:, s:s + w], last_only=last_only, cache=cache,
+                           attention_mask=None if attention_mask is None else attention_mask[:, s:s + w])
+                      for s in range(0, ids.size(1), w)]
+            aux = sum(a for _, a in chunks)
+            return (chunks[-1][0] if last_only else torch.cat([c for c, _ in chunks], dim=1)), aux
+        batch, seq_len = ids.shape
+        valid = None
+        if cache is None and attention_mask is None:
+            positions = torch.arange(seq_len, device=ids.device)
+        else:
+            mask = torch.ones_like(ids) if attention_mask is None else attention_mask.long()
+            seen = cache.seen if cache is not None and cache.seen is not None else mask.new_zeros(batch)
+            positions = (seen[:, None] + mask.cumsum(dim=1) - 1).clamp_min(0)  # (batch, seq_len)
+            if attention_mask is not None:
+                valid = attention_mask.bool()
+            if cache is not None:
+                cache.seen = seen + mask.sum(dim=1)
         ids = ids.t()  # (seq_len, batch)
-        seq_len, batch = ids.shape
-        # pos_emb is shaped (1, max_len, d); slice and reshape to (seq_len, 1, d) so it broadcasts over batch
-        x = self.tok_emb(ids) + self.pos_emb[0, :seq_len, :].unsqueeze(1)
+        with record_function('embedding'):
+            x = self.tok_emb(ids)
+            if self.pos_encoding == 'learned':
+                # pos_emb is shaped (1, max_len, d); index and reshape to (seq_len, batch or 1, d)
+                pos = self.pos_emb[0, positions]
+                x = x + (pos.transpose(0, 1) if positions.dim() == 2 else pos.unsqueeze(1))
+        # causal (and windowed) masking is done inside attention from the positions
         total_aux = x.new_tensor(0.0)
-        for l in self.layers:
-            x, aux = l(x)
+        for i, l in enumerate(self.layers):
+            x, aux = l(x, positions=positions, cache=cache, layer_idx=i, valid=valid)
             total_aux = total_aux + aux
-        x = self.ln(x)
-        logits = self.head(x)  # (seq_len, batch, vocab)
+        with record_function('head'):
+            x = self.ln(x)
+            if targets is not None:
+                x = x.transpose(0, 1)
+                if self.adaptive:
+                    return self.head.loss_sum(x, targets, pad_id), total_aux
+                logits = self.head(x)
+                return F.cross_entropy(logits.reshape(-1, logits.size(-1)), targets.reshape(-1),
+                                       ignore_index=pad_id, reduction='sum'), total_aux
+            if last_only:
+                x = x[-1:]
+            if self.adaptive:
+                logits = self.head.log_prob(x.reshape(-1, x.size(-1))).view(x.size(0), x.size(1), -1)
+            else:
+                logits = self.head(x)  # (seq_len, batch, vocab)
         logits = logits.permute(1, 0, 2)  # (batch, seq_len, vocab)
         return logits, total_aux
 
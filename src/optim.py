@@ -0,0 +1,266 @@
+import math
+import torch
+import torch.nn.functional as F
+from torch.optim import Optimizer
+
+
+OPTIMIZERS = ('adamw', 'adamw8bit', 'adafactor')
+
+
+def build_optimizer(name, params, lr=1e-4, weight_decay=0.01, lazy_experts=False):
+    """Create the optimizer selected by `--optimizer`.
+
+    With `lazy_experts`, `params` should come from `moe_param_groups` so that
+    only expert parameters are updated lazily.
+    """
+    if name == 'adamw':
+        if lazy_experts:
+            return LazyAdamW(params, lr=lr, weight_decay=weight_decay)
+        return torch.optim.AdamW(params, lr=lr, weight_decay=weight_decay)
+    if name == 'adamw8bit':
+        return AdamW8bit(params, lr=lr, weight_decay=weight_decay)
+    if name == 'adafactor':
+        if lazy_experts:
+            raise ValueError('lazy expert updates are supported for adamw and adamw8bit only')
+        return Adafactor(params, lr=lr, weight_decay=weight_decay)
+    raise ValueError(f'unknown optimizer {name!r} (choose from {", ".join(OPTIMIZERS)})')
+
+
+def moe_param_groups(model):
+    """Split parameters into dense and expert groups; the expert group is lazy.
+
+    Expert weights are the `...moe.experts.<i>...` parameters of `SimpleMoE`.
+    """
+    dense, experts = [], []
+    for name, p in model.named_parameters():
+        if not p.requires_grad:
+            continue
+        (experts if '.moe.experts.' in name else dense).append(p)
+    return [{'params': dense, 'lazy': False}, {'params': experts, 'lazy': True}]
+
+
+def quantize_blockwise(x, signed, block_size=256):
+    """Quantize `x` to 8 bits with one absmax scale per block of `block_size` values.
+
+    Values are companded before rounding (sqrt for signed first moments, 4th
+    root for non-negative second moments) so small entries in a block keep
+    useful precision. Returns (codes, absmax).
+    """
+    flat = x.reshape(-1)
+    pad = (-flat.numel()) % block_size
+    if pad:
+        flat = F.pad(flat, (0, pad))
+    blocks = flat.view(-1, block_size)
+    absmax = blocks.abs().amax(dim=1)
+    scaled = blocks / absmax.clamp_min(1e-30).unsqueeze(1)
+    if signed:
+        codes = (scaled.sign() * scaled.abs().sqrt() * 127).round().to(torch.int8)
+    else:
+        codes = (scaled.clamp_min(0).sqrt().sqrt() * 255).round().to(torch.uint8)
+    return codes, absmax
+
+
+def dequantize_blockwise(codes, absmax, shape, signed):
+    q = codes.float()
+    if signed:
+        q = q / 127
+        vals = q * q.abs()
+    else:
+        vals = (q / 255) ** 4
+    vals = vals * absmax.unsqueeze(1)
+    numel = math.prod(shape)
+    return vals.reshape(-1)[:numel].view(shape)
+
+
+class AdamW8bit(Optimizer):
+    """AdamW with block-wise 8-bit quantized moment estimates.
+
+    - `exp_avg` is stored as int8 and `exp_avg_sq` as uint8, each with one fp32
+      absmax per `block_size` values: ~2 bytes of state per parameter instead
+      of 8.
+    - tensors smaller than `min_8bit_size` keep fp32 moments (the scales would
+      cost more than they save).
+    - each step dequantizes, updates in fp32 and requantizes. The denominator
+      is floored at |m_hat|, so quantization error in a tiny second moment
+      cannot blow up the update. This deliberately departs from Adam: it
+      caps every element's step at `lr`, which exact Adam can exceed when
+      beta1 != beta2 (e.g. a gradient spike after many zero steps).
+    - param groups with `lazy=True` (see `moe_param_groups`) skip parameters
+      whose gradient is missing or all zero, i.e. experts that received no
+      tokens. Their moment decay (beta^k) and weight decay ((1 - lr*wd)^k) for
+      the k skipped steps are applied on the next active step, from the
+      group step stored at their last update.
+    """
+
+    def __init__(self, params, lr=1e-3, betas=(0.9, 0.999), eps=1e-8, weight_decay=0.01,
+                 block_size=256, min_8bit_size=4096, lazy=False):
+        defaults = dict(lr=lr, betas=betas, eps=eps, weight_decay=weight_decay,
+                        block_size=block_size, min_8bit_size=min_8bit_size, lazy=lazy)
+        super().__init__(params, defaults)
+
+    def load_state_dict(self, state_dict):
+        """`Optimizer.load_state_dict`, keeping the int8/uint8 moment codes as they are.
+
+        The base class casts state tensors to the parameter's float dtype,
+        which would restore the codes as fp32 (4x the memory); they are held
+        back from it and put into the state unchanged.
+        """
+        codes, state = {}, {}
+        for i, s in state_dict['state'].items():
+            codes[i] = {k: v for k, v in s.items() if torch.is_tensor(v) and v.dtype in (torch.int8, torch.uint8)}
+            state[i] = {k: v for k, v in s.items() if k not in codes[i]}
+        super().load_state_dict(dict(state_dict, state=state))
+        saved = [i for g in state_dict['param_groups'] for i in g['params']]
+        params = [p for g in self.param_groups for p in g['params']]
+        for i, p in zip(saved, params):
+            for k, v in codes.get(i, {}).items():
+                self.state[p][k] = v.to(p.device)
+
+    @torch.no_grad()
+    def step(self, closure=None):
+        loss = None
+        if closure is not None:
+            with torch.enable_grad():
+                loss = closure()
+        for group in self.param_groups:
+            if group['lazy']:
+                group['step'] = group.get('step', 0) + 1
+            for p in group['params']:
+                if p.grad is None:
+                    continue
+                if group['lazy'] and not p.grad.any():
+                    continue  # idle expert: caught up on its next active step
+                self._update(p, p.grad.float(), self.state[p], group)
+        return loss
+
+    def _update(self, p, grad, state, group):
+        beta1, beta2 = group['betas']
+        quantized = p.numel() >= group['min_8bit_size']
+        if not state:
+            state['step'] = 0
+            if quantized:
+                zeros = torch.zeros_like(grad)
+                state['exp_avg'], state['exp_avg_absmax'] = quantize_blockwise(zeros, True, group['block_size'])
+                state['exp_avg_sq'], state['exp_avg_sq_absmax'] = quantize_blockwise(zeros, False, group['block_size'])
+            else:
+                state['exp_avg'] = torch.zeros_like(grad)
+                state['exp_avg_sq'] = torch.zeros_like(grad)
+        if group['lazy']:
+            # state['step'] is the group step of the last update; catch up the skipped ones
+            step = group['step']
+            idle = step - state['step'] - 1
+            state['step'] = step
+            if idle > 0:
+                if quantized:
+                    state['exp_avg_absmax'].mul_(beta1 ** idle)
+                    state['exp_avg_sq_absmax'].mul_(beta2 ** idle)
+                else:
+                    state['exp_avg'].mul_(beta1 ** idle)
+                    state['exp_avg_sq'].mul_(beta2 ** idle)
+                if group['weight_decay']:
+                    p.mul_((1 - group['lr'] * group['weight_decay']) ** idle)
+        else:
+            state['step'] += 1
+            step = state['step']
+
+        if quantized:
+            exp_avg = dequantize_blockwise(state['exp_avg'], state['exp_avg_absmax'], p.shape, True)
+            exp_avg_sq = dequantize_blockwise(state['exp_avg_sq'], state['exp_avg_sq_absmax'], p.shape, False)
+        else:
+            exp_avg, exp_avg_sq = state['exp_avg'], state['exp_avg_sq']
+        exp_avg.mul_(beta1).add_(grad, alpha=1 - beta1)
+        exp_avg_sq.mul_(beta2).addcmul_(grad, grad, value=1 - beta2)
+
+        if group['weight_decay']:
+            p.mul_(1 - group['lr'] * group['weight_decay'])
+        m_hat = exp_avg / (1 - beta1 ** step)
+        denom = (exp_avg_sq / (1 - beta2 ** step)).sqrt_()
+        if quantized:
+            denom = denom.maximum(m_hat.abs())
+        denom.add_(group['eps'])
+        p.add_((m_hat / denom).to(p.dtype), alpha=-group['lr'])
+
+        if quantized:
+            state['exp_avg'], state['exp_avg_absmax'] = quantize_blockwise(exp_avg, True, group['block_size'])
+            state['exp_avg_sq'], state['exp_avg_sq_absmax'] = quantize_blockwise(exp_avg_sq, False, group['block_size'])
+
+
+class LazyAdamW(AdamW8bit):
+    """Full-precision AdamW with lazy updates for idle experts.
+
+    Same update as `torch.optim.AdamW` for parameters that receive gradient;
+    groups marked `lazy` skip experts that got no tokens and catch up their
+    moment and weight decay later (see `AdamW8bit`).
+    """
+
+    def __init__(self, params, lr=1e-3, betas=(0.9, 0.999), eps=1e-8, weight_decay=0.01, lazy=False):
+        super().__init__(params, lr=lr, betas=betas, eps=eps, weight_decay=weight_decay,
+                         min_8bit_size=float('inf'), lazy=lazy)
+
+
+class Adafactor(Optimizer):
+    """Adafactor-style optimizer with factored second moments.
+
+    - for parameters with >= 2 dims (expert, attention, embedding and head
+      matrices) the second moment is kept as row and column running means
+      over the last two dims: O(rows + cols) state instead of O(rows * cols).
+    - 1-D parameters (biases, LayerNorm) keep a full second moment.
+    - no first moment by default (`beta1=None`); updates are RMS-clipped to
+      `clip_threshold`, with the `1 - t^decay_rate` second-moment schedule.
+    - `lr` is an absolute learning rate, as with AdamW.
+    """
+
+    def __init__(self, params, lr=1e-3, beta1=None, decay_rate=-0.8, eps=1e-30,
+                 clip_threshold=1.0, weight_decay=0.0):
+        defaults = dict(lr=lr, beta1=beta1, decay_rate=decay_rate, eps=eps,
+                        clip_threshold=clip_threshold, weight_decay=weight_decay)
+        super().__init__(params, defaults)
+
+    @torch.no_grad()
+    def step(self, closure=None):
+        loss = None
+        if closure is not None:
+            with torch.enable_grad():
+                loss = closure()
+        for group in self.param_groups:
+            for p in group['params']:
+                if p.grad is None:
+                    continue
+                self._update(p, p.grad.float(), self.state[p], group)
+        return loss
+
+    def _update(self, p, grad, state, group):
+        factored = grad.dim() >= 2
+        if not state:
+            state['step'] = 0
+            if factored:
+                state['exp_avg_sq_row'] = grad.new_zeros(grad.shape[:-1])
+                state['exp_avg_sq_col'] = grad.new_zeros(grad.shape[:-2] + grad.shape[-1:])
+            else:
+                state['exp_avg_sq'] = torch.zeros_like(grad)
+            if group['beta1'] is not None:
+                state['exp_avg'] = torch.zeros_like(grad)
+        state['step'] += 1
+        beta2t = 1.0 - state['step'] ** group['decay_rate']
+
+        sq = grad * grad + group['eps']
+        if factored:
+            row, col = state['exp_avg_sq_row'], state['exp_avg_sq_col']
+            row.mul_(beta2t).add_(sq.mean(dim=-1), alpha=1 - beta2t)
+            col.mul_(beta2t).add_(sq.mean(dim=-2), alpha=1 - beta2t)
+            row_factor = (row / row.mean(dim=-1, keepdim=True)).rsqrt().unsqueeze(-1)
+            col_factor = col.unsqueeze(-2).rsqrt()
+            update = grad * row_factor * col_factor
+        else:
+            v = state['exp_avg_sq']
+            v.mul_(beta2t).add_(sq, alpha=1 - beta2t)
+            update = grad * v.rsqrt()
+
+        rms = update.pow(2).mean().sqrt()
+        update.div_((rms / group['clip_threshold']).clamp_min(1.0))
+        if group['beta1'] is not None:
+            update = state['exp_avg'].mul_(group['beta1']).add_(update, alpha=1 - group['beta1'])
+
+        if group['weight_decay']:
+            p.mul_(1 - group['lr'] * group['weight_decay'])
+        p.add_(update.to(p.dtype), alpha=-group['lr'])
@@ -0,0 +1,129 @@
+import itertools
+import torch
+from src.attention import KVCache
+
+
+class _Node:
+    __slots__ = ('tokens', 'keys', 'values', 'children', 'parent', 'last_used', 'nbytes')
+
+    def __init__(self, tokens, keys, values, parent):
+        self.tokens = tokens
+        self.keys = keys
+        self.values = values
+        self.children = {}
+        self.parent = parent
+        self.last_used = 0
+        self.nbytes = sum(2 * k.numel() * k.element_size() for k in keys) if keys else 0
+
+
+class PrefixCache:
+    """Radix tree of prompt KV blocks, shared across requests.
+
+    - each edge holds a run of token ids and, per layer, the keys/values
+      those tokens produced (positions are implied by the depth, so a block
+      is valid for any prompt that starts with the same ids).
+    - `lookup(ids)` returns a `KVCache` holding the longest cached prefix of
+      `ids` (always leaving the last token to compute, which is needed for
+      its logits); `insert(ids, cache)` stores a prefilled prompt.
+    - least recently used leaves are evicted once the stored blocks pass
+      `max_bytes`.
+    - `stats` counts lookups, hits, prompt tokens and tokens whose prefill
+      was skipped.
+    Only for models without an attention window (a ring-buffer cache does
+    not keep the whole prefix).
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.root = _Node((), None, None, None)
+        self.nbytes = 0
+        self._clock = itertools.count(1)
+        self.stats = {'lookups': 0, 'hits': 0, 'prompt_tokens': 0, 'tokens_saved': 0, 'evictions': 0}
+
+    def _walk(self, ids):
+        """Yield (node, number of its tokens matched) along the longest match of `ids`."""
+        node, pos = self.root, 0
+        while pos < len(ids):
+            child = node.children.get(ids[pos])
+            if child is None:
+                return
+            m = 0
+            while m < len(child.tokens) and pos + m < len(ids) and child.tokens[m] == ids[pos + m]:
+                m += 1
+            yield child, m
+            if m < len(child.tokens):
+                return
+            node, pos = child, pos + m
+
+    def lookup(self, ids):
+        """(KVCache of the longest cached prefix of ids[:-1], its length), or (None, 0)."""
+        ids = list(ids)
+        self.stats['lookups'] += 1
+        self.stats['prompt_tokens'] += len(ids)
+        now = next(self._clock)
+        keys, values, n = [], [], 0
+        for node, m in self._walk(ids[:-1]):
+            node.last_used = now
+            keys.append([k[:, :, :m] for k in node.keys])
+            values.append([v[:, :, :m] for v in node.values])
+            n += m
+        if not n:
+            return None, 0
+        self.stats['hits'] += 1
+        self.stats['tokens_saved'] += n
+        return KVCache.from_prefix([torch.cat(ks, dim=2) for ks in zip(*keys)],
+                                   [torch.cat(vs, dim=2) for vs in zip(*values)]), n
+
+    def insert(self, ids, cache):
+        """Store the keys/values of `ids` from row 0 of `cache` (prefilled with exactly those tokens first)."""
+        ids = list(ids)
+        now = next(self._clock)
+        node, pos = self.root, 0
+        for child, m in list(self._walk(ids)):
+            if m < len(child.tokens):
+                child = self._split(child, m)
+            child.last_used = now
+            node, pos = child, pos + m
+        if pos < len(ids):
+            leaf = _Node(tuple(ids[pos:]), [k[:1, :, pos:len(ids)].clone() for k in cache.keys],
+                         [v[:1, :, pos:len(ids)].clone() for v in cache.values], node)
+            leaf.last_used = now
+            node.children[ids[pos]] = leaf
+            self.nbytes += leaf.nbytes
+        self._evict()
+
+    def _split(self, node, m):
+        """Cut `node`'s edge after `m` tokens; returns the new upper node."""
+        upper = _Node(node.tokens[:m], [k[:, :, :m].clone() for k in node.keys],
+                      [v[:, :, :m].clone() for v in node.values], node.parent)
+        upper.last_used = node.last_used
+        node.parent.children[node.tokens[0]] = upper
+        old = node.nbytes
+        node.tokens, node.parent = node.tokens[m:], upper
+        node.keys = [k[:, :, m:].clone() for k in node.keys]
+        node.values = [v[:, :, m:].clone() for v in node.values]
+        node.nbytes = old - upper.nbytes
+        upper.children[node.tokens[0]] = node
+        return upper
+
+    def _evict(self):
+        while self.nbytes > self.max_bytes:
+            leaves, stack = [], [self.root]
+            while stack:
+                n = stack.pop()
+                stack.extend(n.children.values())
+                if not n.children and n is not self.root:
+                    leaves.append(n)
+            if not leaves:
+                return
+            victim = min(leaves, key=lambda n: n.last_used)
+            del victim.parent.children[victim.tokens[0]]
+            self.nbytes -= victim.nbytes
+            self.stats['evictions'] += 1
+
+    def summary(self):
+        s = self.stats
+        hit_rate = s['hits'] / s['lookups'] if s['lookups'] else 0.0
+        saved = s['tokens_saved'] / s['prompt_tokens'] if s['prompt_tokens'] else 0.0
+        return (f"prefix cache: hit rate {hit_rate:.0%}, {s['tokens_saved']} of {s['prompt_tokens']} prompt tokens "
+                f"reused ({saved:.0%}), {self.nbytes / 2 ** 20:.1f}MB held, {s['evictions']} evictions")
@@ -0,0 +1,70 @@
+import os
+import torch
+
+
+def parse_profile_steps(spec):
+    """Parse a `start:count` string (e.g. '10:5') into (start, count); None passes through."""
+    if not spec:
+        return None
+    try:
+        start, count = (int(v) for v in spec.split(':'))
+    except ValueError:
+        raise ValueError(f"--profile-steps expects 'start:count', got {spec!r}")
+    if start < 0 or count <= 0:
+        raise ValueError(f'--profile-steps needs start >= 0 and count > 0, got {spec!r}')
+    return start, count
+
+
+class StepProfiler:
+    """`torch.profiler` run over a window of steps, driven by `step()`.
+
+    - profiles steps [start, start + count) with shapes and memory recorded;
+      the step before the window (if any) is used as profiler warmup.
+    - when the window closes, writes `<out_dir>/<name>_trace.json`
+      (Chrome / Perfetto) and `<out_dir>/<name>_top_ops.txt`, and prints the
+      top-ops table.
+    - with `spec=None` it is a no-op, so callers can always call `step()`.
+    """
+
+    def __init__(self, spec, out_dir='profiles', name='train', row_limit=25):
+        self.window = parse_profile_steps(spec) if isinstance(spec, str) or spec is None else tuple(spec)
+        self.out_dir = out_dir
+        self.name = name
+        self.row_limit = row_limit
+        self._prof = None
+        self.trace_path = None
+        if self.window is None:
+            return
+        start, count = self.window
+        warmup = 1 if start > 0 else 0
+        activities = [torch.profiler.ProfilerActivity.CPU]
+        if torch.cuda.is_available():
+            activities.append(torch.profiler.ProfilerActivity.CUDA)
+        self._prof = torch.profiler.profile(
+            activities=activities,
+            schedule=torch.profiler.schedule(wait=start - warmup, warmup=warmup, active=count, repeat=1),
+            on_trace_ready=self._export,
+            record_shapes=True,
+            profile_memory=True,
+        )
+        self._prof.start()
+
+    def step(self):
+        if self._prof is not None:
+            self._prof.step()
+
+    def stop(self):
+        if self._prof is not None:
+            self._prof.stop()
+            self._prof = None
+
+    def _export(self, prof):
+        os.makedirs(self.out_dir, exist_ok=True)
+        self.trace_path = os.path.join(self.out_dir, f'{self.name}_trace.json')
+        prof.export_chrome_trace(self.trace_path)
+        sort_by = 'self_cuda_time_total' if torch.cuda.is_available() else 'self_cpu_time_total'
+        table = prof.key_averages().table(sort_by=sort_by, row_limit=self.row_limit)
+        with open(os.path.join(self.out_dir, f'{self.name}_top_ops.txt'), 'w', encoding='utf-8') as f:
+            f.write(table)
+        print(f'[profile] trace -> {self.trace_path}')
+        print(table)
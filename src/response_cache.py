@@ -0,0 +1,104 @@
+import collections
+import hashlib
+import json
+import os
+
+
+def checkpoint_id(path, sample_bytes=2 ** 20):
+    """Identity of a checkpoint file: a hash of its size and its first and last `sample_bytes`.
+
+    Cheap even for multi-GB checkpoints; a retrained model saved over the
+    same path gets a new id.
+    """
+    size = os.path.getsize(path)
+    h = hashlib.sha256(str(size).encode())
+    with open(path, 'rb') as f:
+        h.update(f.read(sample_bytes))
+        if size > sample_bytes:
+            f.seek(max(sample_bytes, size - sample_bytes))
+            h.update(f.read())
+    return h.hexdigest()[:16]
+
+
+def tokenizer_hash(tokenizer):
+    return hashlib.sha256(json.dumps(tokenizer.vocab, sort_keys=True).encode('utf-8')).hexdigest()[:16]
+
+
+def is_deterministic(params):
+    """Whether these sampling settings always give the same output: greedy (temperature <= 0 or top_k 0) or seeded."""
+    temperature = params.get('temperature')
+    seed = params.get('seed', params.get('seeds'))
+    return (temperature is not None and temperature <= 0) or params.get('top_k') == 0 or seed is not None
+
+
+class ResponseCache:
+    """Exact-match cache of generated responses, for prompts that are sent over and over.
+
+    - `key(prompt_ids, params)` hashes the checkpoint id, the tokenizer hash,
+      the prompt ids and the generation settings (sampling parameters,
+      max_new_tokens, stop strings...), so a hit is only possible for the
+      same model and the same request. Callers only cache requests whose
+      settings pass `is_deterministic`.
+    - `get` / `put` go through an in-memory LRU of `max_entries` responses
+      and, with `directory`, a JSON file per response that survives restarts
+      (a disk hit is promoted to memory).
+    - `stats` counts lookups, memory and disk hits, misses, stores and
+      evictions; `summary()` formats them.
+    Values are anything JSON can store (e.g. the generated ids).
+    """
+
+    def __init__(self, checkpoint_id, tokenizer_hash, max_entries=4096, directory=None):
+        self.checkpoint_id = checkpoint_id
+        self.tokenizer_hash = tokenizer_hash
+        self.max_entries = max_entries
+        self.directory = directory
+        self.entries = collections.OrderedDict()
+        self.stats = {'lookups': 0, 'hits': 0, 'disk_hits': 0, 'misses': 0, 'stores': 0, 'evictions': 0}
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def key(self, prompt_ids, params):
+        blob = json.dumps([self.checkpoint_id, self.tokenizer_hash, list(prompt_ids), sorted(params.items())])
+        return hashlib.sha256(blob.encode('utf-8')).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.directory, f'{key}.json')
+
+    def get(self, key):
+        """The cached value for `key`, or None."""
+        self.stats['lookups'] += 1
+        if key in self.entries:
+            self.entries.move_to_end(key)
+            self.stats['hits'] += 1
+            return self.entries[key]
+        if self.directory and os.path.exists(self._path(key)):
+            with open(self._path(key), 'r', encoding='utf-8') as f:
+                value = json.load(f)
+            self.stats['hits'] += 1
+            self.stats['disk_hits'] += 1
+            self._remember(key, value)
+            return value
+        self.stats['misses'] += 1
+        return None
+
+    def put(self, key, value):
+        self.stats['stores'] += 1
+        self._remember(key, value)
+        if self.directory:
+            tmp = self._path(key) + '.tmp'
+            with open(tmp, 'w', encoding='utf-8') as f:
+                json.dump(value, f)
+            os.replace(tmp, self._path(key))  # readers never see a partial file
+
+    def _remember(self, key, value):
+        self.entries[key] = value
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+            self.stats['evictions'] += 1
+
+    def summary(self):
+        s = self.stats
+        hit_rate = s['hits'] / s['lookups'] if s['lookups'] else 0.0
+        return (f"response cache: hit rate {hit_rate:.0%} ({s['hits']} of {s['lookups']}, {s['disk_hits']} from disk), "
+                f"{len(self.entries)} in memory, {s['evictions']} evictions")
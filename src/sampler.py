@@ -0,0 +1,52 @@
+import math
+import torch
+from torch.utils.data import Sampler
+
+
+class ResumableSampler(Sampler):
+    """Epoch-seeded shuffling sampler that can restart mid-epoch.
+
+    - the order for an epoch depends only on (seed, epoch), not on the global
+      torch RNG, so a resumed run sees exactly the same batches.
+    - `set_epoch(epoch, start)` skips the first `start` samples of that epoch
+      (the part already consumed before the checkpoint).
+    - with `num_replicas > 1` each rank gets a disjoint, equally sized shard
+      of the epoch order (padded by wrapping around, like DistributedSampler).
+    """
+
+    def __init__(self, data_source, shuffle=True, seed=0, num_replicas=1, rank=0):
+        self.data_source = data_source
+        self.shuffle = shuffle
+        self.seed = seed
+        self.num_replicas = num_replicas
+        self.rank = rank
+        self.epoch = 0
+        self.start = 0
+
+    def set_epoch(self, epoch, start=0):
+        self.epoch = epoch
+        self.start = start
+
+    def indices(self):
+        n = len(self.data_source)
+        if not self.shuffle:
+            order = list(range(n))
+        else:
+            g = torch.Generator()
+            g.manual_seed(self.seed + self.epoch)
+            order = torch.randperm(n, generator=g).tolist()
+        if self.num_replicas > 1 and n > 0:
+            total = self.num_samples() * self.num_replicas
+            order = (order * math.ceil(total / n))[:total]
+            order = order[self.rank::self.num_replicas]
+        return order
+
+    def num_samples(self):
+        """Samples per epoch for this rank."""
+        return math.ceil(len(self.data_source) / self.num_replicas)
+
+    def __iter__(self):
+        return iter(self.indices()[self.start:])
+
+    def __len__(self):
+        return max(0, self.num_samples() - self.start)
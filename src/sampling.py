@@ -0,0 +1,121 @@
+import torch
+
+_MASK32 = 0xFFFFFFFF
+
+
+def _hash32(x):
+    """Integer hash of an int64 tensor, elementwise, on its low 32 bits (products stay below 2**63)."""
+    x = x & _MASK32
+    x = x ^ (x >> 16)
+    x = (x * 0x7feb352d) & _MASK32
+    x = x ^ (x >> 15)
+    x = (x * 0x5bd1e995) & _MASK32
+    return x ^ (x >> 16)
+
+
+def _per_row(value, batch, dtype, device, default=None):
+    if isinstance(value, (list, tuple)):
+        value = [default if v is None else v for v in value]
+    elif value is None:
+        value = default
+    t = torch.as_tensor(value, dtype=dtype, device=device)
+    return t.expand(batch).clone() if t.dim() == 0 else t
+
+
+class Sampler:
+    """Logits processors and sampling over (batch, vocab) logits with per-row settings.
+
+    Each call is a few whole-tensor ops, with no Python loop over rows or
+    the vocabulary:
+    1. repetition penalty (logits of tokens already in the sequence are
+       divided by it if positive, multiplied if negative), frequency penalty
+       (minus penalty x count) and presence penalty, from per-row token
+       counts updated incrementally as tokens are sampled (and seeded with
+       the prompts);
+    2. temperature;
+    3. top-k, nucleus top-p and min-p (relative to the most likely token)
+       filtering, sharing one sort;
+    4. Gumbel-max sampling with counter-based noise from each row's seed and
+       step, so a row's samples do not depend on the rest of the batch.
+    Settings are a scalar or one value per row. Rows with temperature 0 or
+    top_k 0 (the repo's argmax convention) are greedy; top_k None means no
+    limit, and a None seed draws one from `generator`. `select` / `extend`
+    follow a decode batch that drops or gains sequences.
+    """
+
+    def __init__(self, batch, vocab_size, temperature=1.0, top_k=None, top_p=1.0, min_p=0.0, repetition_penalty=1.0,
+                 frequency_penalty=0.0, presence_penalty=0.0, seeds=None, prompts=None, device=None, generator=None):
+        def f(v, default):
+            return _per_row(v, batch, torch.float32, device, default)
+        self.temperature = f(temperature, 1.0)
+        self.top_p = f(top_p, 1.0)
+        self.min_p = f(min_p, 0.0)
+        self.repetition_penalty = f(repetition_penalty, 1.0)
+        self.frequency_penalty = f(frequency_penalty, 0.0)
+        self.presence_penalty = f(presence_penalty, 0.0)
+        self.top_k = _per_row(top_k, batch, torch.long, device, vocab_size)
+        drawn = torch.randint(2 ** 31, (batch,), generator=generator).tolist()
+        if seeds is None or isinstance(seeds, int):
+            seeds = [seeds] * batch
+        self.seeds = torch.tensor([d if s is None else s for s, d in zip(seeds, drawn)], dtype=torch.long, device=device)
+        self.steps = torch.zeros(batch, dtype=torch.long, device=device)
+        self.counts = torch.zeros(batch, vocab_size, dtype=torch.float32, device=device)
+        if prompts:
+            rows = torch.tensor([i for i, p in enumerate(prompts) for _ in p], dtype=torch.long, device=device)
+            ids = torch.tensor([t for p in prompts for t in p], dtype=torch.long, device=device)
+            self.counts.index_put_((rows, ids), torch.ones_like(ids, dtype=torch.float32), accumulate=True)
+
+    _ROW_STATE = ('temperature', 'top_p', 'min_p', 'repetition_penalty', 'frequency_penalty', 'presence_penalty',
+                  'top_k', 'seeds', 'steps', 'counts')
+
+    def select(self, rows):
+        for name in self._ROW_STATE:
+            setattr(self, name, getattr(self, name).index_select(0, rows))
+
+    def extend(self, other):
+        for name in self._ROW_STATE:
+            setattr(self, name, torch.cat([getattr(self, name), getattr(other, name)]))
+
+    @property
+    def greedy(self):
+        return (self.temperature <= 0) | (self.top_k <= 0)
+
+    def process(self, logits):
+        """Penalized, tempered and filtered logits (removed tokens are -inf)."""
+        logits = logits.float()
+        if (self.repetition_penalty != 1).any() or (self.frequency_penalty != 0).any() or (self.presence_penalty != 0).any():
+            seen = self.counts > 0
+            rep = self.repetition_penalty[:, None]
+            logits = torch.where(seen, torch.where(logits > 0, logits / rep, logits * rep), logits)
+            logits = logits - self.frequency_penalty[:, None] * self.counts - self.presence_penalty[:, None] * seen
+        logits = logits / torch.where(self.greedy, torch.ones_like(self.temperature), self.temperature)[:, None]
+        vocab = logits.size(-1)
+        if not ((self.top_k < vocab).any() or (self.top_p < 1).any() or (self.min_p > 0).any()):
+            return logits
+        sorted_logits, order = logits.sort(dim=-1, descending=True)
+        ranks = torch.arange(vocab, device=logits.device)[None]
+        remove = ranks >= self.top_k.clamp_min(1)[:, None]
+        probs = sorted_logits.masked_fill(remove, float('-inf')).softmax(dim=-1)
+        remove |= (probs.cumsum(dim=-1) - probs) > self.top_p[:, None]  # keeps the token that crosses top_p
+        remove |= probs < self.min_p[:, None] * probs[:, :1]
+        remove[:, 0] = False
+        return logits.masked_fill(torch.zeros_like(remove).scatter(-1, order, remove), float('-inf'))
+
+    def _gumbel(self, vocab):
+        base = _hash32(self.seeds ^ _hash32(self.steps))
+        h = _hash32(base[:, None] ^ torch.arange(vocab, device=base.device)[None])
+        u = ((h >> 8).float() + 0.5) / 2 ** 24  # 24 random bits: exact in float32, strictly inside (0, 1)
+        return -torch.log(-torch.log(u))
+
+    def sample(self, logits):
+        """One token per row of `logits` (batch, vocab); the tokens are counted for the penalties."""
+        x = self.process(logits)
+        ids = torch.where(self.greedy, x.argmax(dim=-1), (x + self._gumbel(x.size(-1))).argmax(dim=-1))
+        self.observe(ids)
+        return ids
+
+    def observe(self, ids):
+        """Record tokens appended to each row (sampled here or forced by the caller)."""
+        rows = torch.arange(ids.size(0), device=ids.device)
+        self.counts.index_put_((rows, ids), torch.ones_like(ids, dtype=torch.float32), accumulate=True)
+        self.steps += 1
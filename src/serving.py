@@ -0,0 +1,368 @@
+import asyncio
+import collections
+import itertools
+import json
+import time
+import torch
+from src.attention import KVCache
+from src.generation import prefill
+from src.response_cache import is_deterministic
+from src.sampling import Sampler
+
+
+def kv_bytes_per_token(model):
+    """Bytes of cached keys + values one token occupies across all layers."""
+    p = next(model.parameters())
+    return sum(2 * l.attn.n_kv_heads * l.attn.head_dim for l in model.layers) * p.element_size()
+
+
+class Request:
+    """One generation request and its per-request sampling parameters.
+
+    `tokens` collects the generated ids; `finish_reason` is 'eos', 'length'
+    or 'cancelled' (set `cancelled`, e.g. when the client went away) once
+    done. A server attaches an asyncio queue (`events`) to stream tokens to
+    its client.
+    """
+
+    _ids = itertools.count()
+
+    SAMPLING = ('temperature', 'top_k', 'top_p', 'min_p', 'repetition_penalty', 'frequency_penalty',
+                'presence_penalty', 'seed')
+
+    def __init__(self, prompt_ids, max_new_tokens=50, temperature=0.8, top_k=10, eos_id=None, seed=None,
+                 top_p=1.0, min_p=0.0, repetition_penalty=1.0, frequency_penalty=0.0, presence_penalty=0.0):
+        self.id = next(self._ids)
+        self.prompt_ids = list(prompt_ids)
+        self.max_new_tokens = max_new_tokens
+        self.temperature = temperature
+        self.top_k = top_k
+        self.top_p = top_p
+        self.min_p = min_p
+        self.repetition_penalty = repetition_penalty
+        self.frequency_penalty = frequency_penalty
+        self.presence_penalty = presence_penalty
+        self.eos_id = eos_id
+        self.seed = seed
+        self.tokens = []
+        self.finish_reason = None
+        self.cancelled = False
+        self.events = None
+        self.cache_key = None
+        self.submitted = time.perf_counter()
+        self.first_token_at = None
+        self.finished_at = None
+
+
+class BatchEngine:
+    """Iteration-level (continuous) batching over one model.
+
+    - `step(new)` runs one scheduler iteration: the admitted requests `new`
+      are prefilled together and join the running batch, then every running
+      request gets one token. A request leaves the batch (and the KV cache)
+      as soon as it finishes, so a long generation never holds short ones
+      back and freed slots are refilled at the next token boundary.
+    - `admit(waiting)` pops the requests that fit `max_batch` and the KV
+      memory budget `max_kv_bytes`. The check is against the worst case of
+      the left-padded batch (every row as long as the longest prompt plus
+      the largest remaining budget), so admitted requests can always run to
+      completion. A request is always admitted into an empty batch.
+    - with a `PrefixCache`, prompts resume from their longest cached prefix
+      (e.g. a shared system prompt) instead of being prefilled from scratch.
+    """
+
+    def __init__(self, model, max_batch=16, max_kv_bytes=None, prefix_cache=None):
+        self.model = model.eval()
+        self.prefix_cache = prefix_cache
+        self.device = next(model.parameters()).device
+        self.max_batch = max_batch
+        self.max_kv_bytes = max_kv_bytes
+        self.token_bytes = kv_bytes_per_token(model)
+        self.reset()
+
+    def reset(self):
+        """Drop every running request and the cache."""
+        self.running = []
+        self.cache = KVCache.for_model(self.model)
+        self.sampler = None
+        self.next_ids = None
+
+    def kv_bytes_needed(self, requests):
+        """Worst-case KV cache bytes for the running batch plus `requests`."""
+        rows = self.running + list(requests)
+        if not rows:
+            return 0
+        prompt = max([self.cache.length] + [len(r.prompt_ids) for r in requests])
+        remaining = max(r.max_new_tokens - len(r.tokens) for r in rows)
+        columns = prompt + remaining
+        if self.model.attn_window:
+            columns = min(columns, self.model.attn_window)
+        return len(rows) * columns * self.token_bytes
+
+    def admit(self, waiting):
+        """Pop requests off the front of `waiting` (a deque) while they fit; FIFO, no overtaking."""
+        admitted = []
+        while waiting and len(self.running) + len(admitted) < self.max_batch:
+            if self.max_kv_bytes and (self.running or admitted) and \
+                    self.kv_bytes_needed(admitted + [waiting[0]]) > self.max_kv_bytes:
+                break
+            admitted.append(waiting.popleft())
+        return admitted
+
+    @torch.inference_mode()
+    def step(self, new=()):
+        """One iteration; returns [(request, token id or None, finished)] for every token produced."""
+        logits = []
+        if self.running:
+            out, _ = self.model(self.next_ids[:, None], cache=self.cache, last_only=True)
+            logits.append(out[:, -1])
+        events = []
+        for r in new:
+            if r.max_new_tokens <= 0:
+                r.finish_reason, r.finished_at = 'length', time.perf_counter()
+                events.append((r, None, True))
+        new = [r for r in new if r.max_new_tokens > 0]
+        if new:
+            cache, out = prefill(self.model, [r.prompt_ids for r in new], prefix_cache=self.prefix_cache)
+            logits.append(out)
+            self.cache.extend(cache)
+            settings = {name: [getattr(r, name) for r in new] for name in Request.SAMPLING}
+            settings['seeds'] = settings.pop('seed')
+            sampler = Sampler(len(new), out.size(-1), prompts=[r.prompt_ids for r in new], device=self.device,
+                              **settings)
+            if self.sampler is None:
+                self.sampler = sampler
+            else:
+                self.sampler.extend(sampler)
+            self.running += new
+        if not self.running:
+            return events
+        tokens = self.sampler.sample(torch.cat(logits)).tolist()
+        now = time.perf_counter()
+        keep = []
+        for j, (r, tok) in enumerate(zip(self.running, tokens)):
+            if r.first_token_at is None:
+                r.first_token_at = now
+            if r.cancelled or tok == r.eos_id:
+                r.finish_reason = 'cancelled' if r.cancelled else 'eos'
+                events.append((r, None, True))
+                continue
+            r.tokens.append(tok)
+            if len(r.tokens) >= r.max_new_tokens:
+                r.finish_reason = 'length'
+            else:
+                keep.append(j)
+            events.append((r, tok, r.finish_reason is not None))
+        for r, _, finished in events:
+            if finished:
+                r.finished_at = now
+        if len(keep) < len(self.running):
+            rows = torch.tensor(keep, device=self.device, dtype=torch.long)
+            self.running = [self.running[j] for j in keep]
+            if self.running:
+                self.cache.select(rows)
+                self.sampler.select(rows)
+            else:
+                self.reset()
+        self.next_ids = torch.tensor([tokens[j] for j in keep], device=self.device, dtype=torch.long)
+        return events
+
+
+class InferenceServer:
+    """Minimal asyncio HTTP/1.1 server in front of a `BatchEngine`.
+
+    - POST /generate with a JSON body {"prompt", "max_new_tokens", "stream"}
+      and any of the sampling settings in `Request.SAMPLING`. Without "stream" the reply
+      is one JSON object; with it, newline-delimited JSON events (one per
+      token, then a final summary) sent with chunked transfer encoding.
+    - GET /stats reports queue depth, batch size, KV bytes and throughput;
+      GET /health answers "ok".
+    - with a `response_cache` (`ResponseCache`), requests with deterministic
+      settings (greedy or seeded) that were answered before are replied to
+      from the cache without entering the queue; completed ones are stored.
+    - Model steps run in a worker thread, so the event loop keeps accepting
+      connections and queuing requests while a batch decodes; queued
+      requests join the batch at the next token boundary.
+    """
+
+    def __init__(self, engine, tokenizer, max_queue=256, response_cache=None):
+        self.engine = engine
+        self.response_cache = response_cache
+        self.tokenizer = tokenizer
+        self.eos_id = tokenizer.vocab.get('<eos>')
+        self.max_queue = max_queue
+        self.waiting = collections.deque()
+        self.wakeup = None
+        self.started = time.perf_counter()
+        self.stats = {'requests': 0, 'completed': 0, 'rejected': 0, 'tokens': 0, 'steps': 0}
+
+    async def start(self, host='127.0.0.1', port=8000):
+        """Listen and start the scheduler; returns the asyncio server (port 0 picks a free port)."""
+        self.wakeup = asyncio.Event()
+        self._loop_task = asyncio.create_task(self._loop())
+        return await asyncio.start_server(self._handle, host, port)
+
+    async def serve(self, host='127.0.0.1', port=8000):
+        server = await self.start(host, port)
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            self._loop_task.cancel()
+
+    async def _loop(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            if not self.engine.running and not self.waiting:
+                self.wakeup.clear()
+                await self.wakeup.wait()
+            new = self.engine.admit(self.waiting)
+            try:
+                events = await loop.run_in_executor(None, self.engine.step, new)
+            except Exception as e:
+                # fail what was in flight instead of wedging every client
+                print(f'[!] decode step failed: {e!r}')
+                events = [(r, None, True) for r in self.engine.running + [r for r in new if r not in self.engine.running]]
+                for r, _, _ in events:
+                    r.finish_reason, r.finished_at = 'error', time.perf_counter()
+                self.engine.reset()
+            self.stats['steps'] += 1
+            for r, tok, finished in events:
+                if tok is not None:
+                    self.stats['tokens'] += 1
+                r.events.put_nowait((tok, finished))
+                if finished:
+                    self.stats['completed'] += 1
+                    if r.cache_key is not None and r.finish_reason in ('eos', 'length'):
+                        self.response_cache.put(r.cache_key, {'tokens': r.tokens, 'finish_reason': r.finish_reason})
+
+    def submit(self, request):
+        if self._replay(request):
+            return True
+        if len(self.waiting) >= self.max_queue:
+            self.stats['rejected'] += 1
+            return False
+        request.events = asyncio.Queue()
+        self.waiting.append(request)
+        self.stats['requests'] += 1
+        self.wakeup.set()
+        return True
+
+    def _replay(self, request):
+        """Answer `request` from the response cache if it is there (its events are queued at once)."""
+        if self.response_cache is None:
+            return False
+        params = {name: getattr(request, name) for name in Request.SAMPLING}
+        if not is_deterministic(params):
+            return False
+        params.update(max_new_tokens=request.max_new_tokens, eos_id=request.eos_id)
+        request.cache_key = self.response_cache.key(request.prompt_ids, params)
+        cached = self.response_cache.get(request.cache_key)
+        if cached is None:
+            return False
+        request.tokens, request.finish_reason = list(cached['tokens']), cached['finish_reason']
+        request.first_token_at = request.finished_at = time.perf_counter()
+        request.events = asyncio.Queue()
+        for tok in request.tokens:
+            request.events.put_nowait((tok, False))
+        request.events.put_nowait((None, True))
+        self.stats['requests'] += 1
+        self.stats['completed'] += 1
+        return True
+
+    def snapshot(self):
+        elapsed = time.perf_counter() - self.started
+        out = dict(self.stats, waiting=len(self.waiting), running=len(self.engine.running),
+                   kv_bytes=self.engine.cache.nbytes(), max_kv_bytes=self.engine.max_kv_bytes,
+                   tokens_per_s=self.stats['tokens'] / elapsed if elapsed else 0.0)
+        pc = self.engine.prefix_cache
+        if pc is not None:
+            out['prefix_cache'] = dict(pc.stats, bytes=pc.nbytes, max_bytes=pc.max_bytes,
+                                       hit_rate=pc.stats['hits'] / max(1, pc.stats['lookups']))
+        rc = self.response_cache
+        if rc is not None:
+            out['response_cache'] = dict(rc.stats, entries=len(rc.entries),
+                                         hit_rate=rc.stats['hits'] / max(1, rc.stats['lookups']))
+        return out
+
+    def _summary(self, r):
+        return {'id': r.id, 'text': self.tokenizer.decode(r.tokens), 'tokens': len(r.tokens),
+                'finish_reason': r.finish_reason, 'ttft_s': (r.first_token_at or r.finished_at) - r.submitted,
+                'latency_s': r.finished_at - r.submitted}
+
+    async def _handle(self, reader, writer):
+        try:
+            method, path, body = await _read_request(reader)
+            if method == 'GET' and path == '/health':
+                await _respond(writer, 200, 'ok', 'text/plain')
+            elif method == 'GET' and path == '/stats':
+                await _respond(writer, 200, json.dumps(self.snapshot()))
+            elif method == 'POST' and path == '/generate':
+                await self._generate(writer, json.loads(body or b'{}'))
+            else:
+                await _respond(writer, 404, json.dumps({'error': 'not found'}))
+        except (ValueError, KeyError, TypeError) as e:
+            await _respond(writer, 400, json.dumps({'error': str(e)}))
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def _generate(self, writer, params):
+        types = {'top_k': int, 'seed': int}
+        sampling = {k: types.get(k, float)(params[k]) for k in Request.SAMPLING if params.get(k) is not None}
+        r = Request(self.tokenizer.encode(params['prompt']), max_new_tokens=int(params.get('max_new_tokens', 50)),
+                    eos_id=self.eos_id, **sampling)
+        if not self.submit(r):
+            await _respond(writer, 503, json.dumps({'error': 'queue full'}))
+            return
+        if not params.get('stream'):
+            while not (await r.events.get())[1]:
+                pass
+            await _respond(writer, 200, json.dumps(self._summary(r)))
+            return
+        writer.write(b'HTTP/1.1 200 OK\r\nContent-Type: application/x-ndjson\r\n'
+                     b'Transfer-Encoding: chunked\r\nConnection: close\r\n\r\n')
+        try:
+            while True:
+                tok, finished = await r.events.get()
+                if tok is not None:
+                    await _write_chunk(writer, {'id': r.id, 'token': tok, 'text': self.tokenizer.decode([tok])})
+                if finished:
+                    await _write_chunk(writer, dict(self._summary(r), done=True))
+                    break
+        except ConnectionError:
+            r.cancelled = True
+            raise
+        writer.write(b'0\r\n\r\n')
+        await writer.drain()
+
+
+async def _read_request(reader):
+    line = (await reader.readline()).decode('latin-1').split()
+    if len(line) < 2:
+        raise ValueError('malformed request line')
+    headers = {}
+    while True:
+        h = (await reader.readline()).decode('latin-1').strip()
+        if not h:
+            break
+        k, _, v = h.partition(':')
+        headers[k.strip().lower()] = v.strip()
+    length = int(headers.get('content-length', 0))
+    body = await reader.readexactly(length) if length else b''
+    return line[0].upper(), line[1].split('?')[0], body
+
+
+async def _respond(writer, status, body, content_type='application/json'):
+    reason = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 503: 'Service Unavailable'}[status]
+    data = body.encode('utf-8')
+    writer.write(f'HTTP/1.1 {status} {reason}\r\nContent-Type: {content_type}\r\n'
+                 f'Content-Length: {len(data)}\r\nConnection: close\r\n\r\n'.encode('latin-1') + data)
+    await writer.drain()
+
+
+async def _write_chunk(writer, obj):
+    data = (json.dumps(obj) + '\n').encode('utf-8')
+    writer.write(f'{len(data):x}\r\n'.encode('latin-1') + data + b'\r\n')
+    await writer.drain()
@@ -0,0 +1,208 @@
+import os
+import time
+import torch
+from src.attention import KVCache
+from src.generation import decode_steps
+from src.response_cache import is_deterministic
+from src.tokenizer import IncrementalDecoder
+
+
+# keyword arguments `reply` passes on to `decode_steps` / `SpeculativeDecoder.steps`
+_DECODE_SAMPLING = frozenset(('temperature', 'top_k', 'top_p', 'min_p', 'repetition_penalty', 'frequency_penalty',
+                              'presence_penalty', 'seeds', 'eos_id', 'pad_id', 'generator', 'profiler'))
+_SPECULATIVE_SAMPLING = frozenset(('temperature', 'top_k', 'eos_id', 'generator', 'profiler'))
+
+
+class ChatSession:
+    """A multi-turn conversation that keeps its token ids and KV cache between turns.
+
+    - `reply(message)` prefills only the new turn ("User: ... DeepErNova:")
+      on top of the cached conversation and streams the answer as text
+      deltas, so a turn costs the same however long the chat already is.
+    - window policy: when the context plus the new turn and its reply would
+      pass `max_context` tokens, the oldest whole turns are dropped (the
+      system prompt is always kept) and the kept transcript is prefilled
+      once more (from the `prefix_cache` where possible). `max_context`
+      defaults to the learned position table size; rotary models are
+      unbounded unless given one.
+    - with `speculative` (a `SpeculativeDecoder`) replies are drafted by its
+      small model, which keeps its own cache of the conversation.
+    - with a `response_cache` (`ResponseCache`), a reply with deterministic
+      settings (greedy or seeded) to a conversation seen before is replayed
+      from the cache without decoding; its tokens are prefilled with the
+      next turn.
+    - a reply that ends at one of the `stop` strings loses the tokens that
+      made up the stop string, in `ids` and in the caches, so the next turn
+      continues from the text the user actually saw.
+    - `save(path)` / `ChatSession.load(path, ...)` checkpoint the ids and the
+      cache, so an idle session can be dropped from memory (see
+      `SessionStore`; a draft cache is rebuilt on the next turn).
+    """
+
+    def __init__(self, model, tokenizer, system_prompt=None, max_context=None, prefix_cache=None,
+                 user_tag='User:', bot_tag='DeepErNova:', speculative=None, response_cache=None):
+        self.model = model
+        self.response_cache = response_cache
+        self.speculative = speculative
+        self.tokenizer = tokenizer
+        self.prefix_cache = prefix_cache
+        self.user_tag, self.bot_tag = user_tag, bot_tag
+        if max_context is None and model.pos_encoding == 'learned':
+            max_context = model.pos_emb.size(1)
+        self.max_context = max_context
+        bos = tokenizer.vocab.get('<bos>')
+        self.ids = [bos] + (self._encode(system_prompt) if system_prompt else [])
+        self.system_len = len(self.ids)
+        self.turn_starts = []
+        self.cache = KVCache.for_model(model)  # holds ids[:cache.length]; the rest is fed with the next turn
+        self.draft_cache = KVCache.for_model(speculative.draft) if speculative else None
+        self.trims = 0
+        self.last_used = time.monotonic()
+
+    def _encode(self, text):
+        return self.tokenizer.encode(text)[1:-1]  # without <bos>/<eos>
+
+    def _fit(self, needed):
+        """Drop the oldest turns until `needed` more tokens fit in `max_context`."""
+        if not self.max_context or len(self.ids) + needed <= self.max_context:
+            return
+        if self.system_len + needed > self.max_context:
+            raise ValueError(f'system prompt ({self.system_len}) + turn and reply ({needed}) exceed '
+                             f'max_context={self.max_context}')
+        start = next((t for t in self.turn_starts if self.system_len + len(self.ids) - t + needed <= self.max_context),
+                     len(self.ids))
+        self.ids = self.ids[:self.system_len] + self.ids[start:]
+        self.turn_starts = [t - start + self.system_len for t in self.turn_starts if t >= start]
+        self.cache = KVCache.for_model(self.model)
+        if self.speculative:
+            self.draft_cache = KVCache.for_model(self.speculative.draft)
+        self.trims += 1
+
+    def _rewind(self, n):
+        """Drop `ids[n:]` from the conversation and the caches."""
+        self.ids = self.ids[:n]
+        if self.cache.window and self.cache.length > n:
+            # a ring buffer cannot be rolled back: prefill the kept transcript again
+            self.cache = KVCache.for_model(self.model)
+        else:
+            self.cache.crop(n)
+        if self.draft_cache is not None:
+            self.draft_cache.crop(n)
+
+    def reply(self, message, max_new_tokens=50, stop=(), unk_text='<unk>', **sampling):
+        """Stream the answer to `message` (text deltas); the turn is added to the conversation."""
+        allowed = _SPECULATIVE_SAMPLING if self.speculative else _DECODE_SAMPLING
+        unknown = sorted(set(sampling) - allowed)
+        if unknown:  # before the turn is added, so a bad call leaves the conversation as it was
+            raise TypeError(f"unsupported sampling argument(s) {', '.join(unknown)}"
+                            + (' with speculative decoding' if self.speculative else ''))
+        self.last_used = time.monotonic()
+        turn = self._encode(f'{self.user_tag} {message} {self.bot_tag}')
+        self._fit(len(turn) + max_new_tokens)
+        self.turn_starts.append(len(self.ids))
+        self.ids += turn
+        sampling.setdefault('eos_id', self.tokenizer.vocab.get('<eos>'))
+        decoder = IncrementalDecoder(self.tokenizer, stop=stop, unk_text=unk_text)
+        reply_start, starts = len(self.ids), []  # starts: stream offset where each reply token begins
+        key, cached = None, None
+        params = {k: v for k, v in sampling.items() if k not in ('profiler', 'generator')}
+        params.update(max_new_tokens=max_new_tokens, stop=list(stop), unk_text=unk_text)
+        if self.response_cache is not None and is_deterministic(params):
+            key = self.response_cache.key(self.ids, params)
+            cached = self.response_cache.get(key)
+        if cached is not None:
+            steps = ([(0, tok)] for tok in cached)
+        elif self.speculative:
+            sampling.pop('profiler', None)
+            steps = self.speculative.steps(self.ids, max_new_tokens=max_new_tokens, target_cache=self.cache,
+                                           draft_cache=self.draft_cache, **sampling)
+        else:
+            sampling.setdefault('pad_id', self.tokenizer.vocab.get('<pad>', 0))
+            steps = decode_steps(self.model, [self.ids[self.cache.length:]], max_new_tokens=max_new_tokens,
+                                 cache=self.cache, prefix_cache=self.prefix_cache, **sampling)
+        try:
+            for produced in steps:
+                for _, tok in produced:
+                    self.ids.append(tok)
+                    starts.append(len(decoder.text) + len(decoder.pending))
+                    delta = decoder.push(tok)
+                    if delta:
+                        yield delta
+                if decoder.stopped:
+                    if self.tokenizer.inv_vocab.get(tok) != '<eos>':
+                        # a stop string: keep only the tokens that end before it
+                        self._rewind(reply_start + sum(s <= len(decoder.text) for s in starts[1:]))
+                    break
+            if key is not None and cached is None:
+                self.response_cache.put(key, self.ids[reply_start:])
+            tail = '' if decoder.stopped else decoder.flush()
+            if tail:
+                yield tail
+        finally:
+            steps.close()
+            self.last_used = time.monotonic()
+
+    def save(self, path):
+        torch.save({'ids': self.ids, 'system_len': self.system_len, 'turn_starts': self.turn_starts,
+                    'max_context': self.max_context, 'trims': self.trims,
+                    'tags': (self.user_tag, self.bot_tag), 'cache': self.cache.state()}, path)
+
+    @classmethod
+    def load(cls, path, model, tokenizer, prefix_cache=None, speculative=None, response_cache=None):
+        state = torch.load(path, map_location=next(model.parameters()).device, weights_only=True)
+        session = cls(model, tokenizer, max_context=state['max_context'], prefix_cache=prefix_cache,
+                      user_tag=state['tags'][0], bot_tag=state['tags'][1], speculative=speculative,
+                      response_cache=response_cache)
+        session.ids, session.system_len = state['ids'], state['system_len']
+        session.turn_starts, session.trims = state['turn_starts'], state['trims']
+        session.cache = KVCache.from_state(state['cache'])
+        return session
+
+
+class SessionStore:
+    """Chat sessions by key, with idle ones checkpointed to `directory`.
+
+    At most `max_live` sessions stay in memory; `reap()` (also run by `get`)
+    saves and drops the least recently used beyond that and any idle for
+    more than `idle_seconds`. `get` reloads a saved session transparently.
+    """
+
+    def __init__(self, directory, model, tokenizer, max_live=8, idle_seconds=None, **session_kwargs):
+        self.directory = directory
+        self.model = model
+        self.tokenizer = tokenizer
+        self.max_live = max_live
+        self.idle_seconds = idle_seconds
+        self.session_kwargs = session_kwargs
+        self.live = {}
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.directory, f'{key}.pt')
+
+    def get(self, key):
+        session = self.live.get(key)
+        if session is None:
+            path = self._path(key)
+            if os.path.exists(path):
+                session = ChatSession.load(path, self.model, self.tokenizer,
+                                           prefix_cache=self.session_kwargs.get('prefix_cache'),
+                                           speculative=self.session_kwargs.get('speculative'),
+                                           response_cache=self.session_kwargs.get('response_cache'))
+                os.remove(path)
+            else:
+                session = ChatSession(self.model, self.tokenizer, **self.session_kwargs)
+            self.live[key] = session
+        session.last_used = time.monotonic()
+        self.reap(keep=key)
+        return session
+
+    def offload(self, key):
+        self.live.pop(key).save(self._path(key))
+
+    def reap(self, keep=None):
+        now = time.monotonic()
+        for key in sorted(self.live, key=lambda k: self.live[k].last_used):
+            idle = self.idle_seconds is not None and now - self.live[key].last_used > self.idle_seconds
+            if key != keep and (len(self.live) > self.max_live or idle):
+                self.offload(key)
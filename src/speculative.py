@@ -0,0 +1,118 @@
+import time
+import torch
+import torch.nn.functional as F
+from src.attention import KVCache
+
+
+def sampling_probs(logits, temperature=1.0, top_k=0):
+    """The distribution `sample_next` draws from, over the full vocab: top-k softmax, or one-hot argmax for top_k <= 0."""
+    if top_k <= 0:
+        return F.one_hot(logits.argmax(dim=-1), logits.size(-1)).to(logits.dtype)
+    top_logits, top_ids = logits.topk(min(top_k, logits.size(-1)), dim=-1)
+    return torch.zeros_like(logits).scatter_(-1, top_ids, F.softmax(top_logits / temperature, dim=-1))
+
+
+class SpeculativeDecoder:
+    """Speculative decoding: a small draft model proposes, the target model verifies.
+
+    - each round the draft samples `k` tokens one at a time (cheap), then the
+      target scores all of them in one forward pass. Draft token x is kept
+      with probability min(1, p(x) / q(x)); the first rejected one is
+      replaced by a sample from max(0, p - q) (renormalized), and if all are
+      kept one more token comes from the target's last distribution. The
+      output therefore has exactly the target's sampling distribution (same
+      temperature / top-k), while a round costs one target pass for up to
+      k + 1 tokens.
+    - both models must share the tokenizer (e.g. the `tiny` and `3b`
+      configs); attention windows are not supported because rejected tokens
+      are rolled back with `KVCache.crop`.
+    - `stats` accumulates over calls: target passes, drafted and accepted
+      tokens, generated tokens and time; `summary()` formats them.
+    """
+
+    def __init__(self, target, draft, k=4):
+        if target.tok_emb.num_embeddings != draft.tok_emb.num_embeddings:
+            raise ValueError('draft and target models must share a vocabulary')
+        if target.attn_window or draft.attn_window:
+            raise ValueError('speculative decoding needs caches without an attention window')
+        self.target = target.eval()
+        self.draft = draft.eval()
+        self.k = k
+        self.stats = {'passes': 0, 'drafted': 0, 'accepted': 0, 'tokens': 0, 'seconds': 0.0}
+
+    def _last_logits(self, model, cache, ids):
+        """Feed `ids` after the ones `cache` holds; logits of the last position."""
+        new = torch.tensor([ids[cache.length:]], device=next(model.parameters()).device)
+        return model(new, cache=cache, last_only=True)[0][0, -1]
+
+    def _target_logits(self, cache, ids, n):
+        """Feed `ids` after the cached ones; logits of the last `n` positions (n, vocab)."""
+        device = next(self.target.parameters()).device
+        if len(ids) - cache.length > n:
+            self.target(torch.tensor([ids[cache.length:len(ids) - n]], device=device), cache=cache, last_only=True)
+        return self.target(torch.tensor([ids[cache.length:]], device=device), cache=cache)[0][0]
+
+    @torch.inference_mode()
+    def steps(self, prompt_ids, max_new_tokens=50, temperature=0.8, top_k=10, eos_id=None, generator=None,
+              target_cache=None, draft_cache=None):
+        """Decode one prompt; yields [(0, token id)] lists, one per target pass (like `decode_steps`).
+
+        Caches passed in are continued: they must hold a shorter prefix of `prompt_ids`.
+        """
+        ids = list(prompt_ids)
+        tc = target_cache if target_cache is not None else KVCache.for_model(self.target)
+        dc = draft_cache if draft_cache is not None else KVCache.for_model(self.draft)
+        produced = 0
+        while produced < max_new_tokens:
+            t0 = time.perf_counter()
+            k = min(self.k, max_new_tokens - produced - 1)
+            drafts, qs = [], []
+            for _ in range(k):
+                q = sampling_probs(self._last_logits(self.draft, dc, ids + drafts), temperature, top_k)
+                drafts.append(torch.multinomial(q, 1, generator=generator).item())
+                qs.append(q)
+            ps = sampling_probs(self._target_logits(tc, ids + drafts, k + 1), temperature, top_k)
+            new = []
+            for i, d in enumerate(drafts):
+                if torch.rand(1, generator=generator).item() < min(1.0, (ps[i, d] / qs[i][d]).item()):
+                    new.append(d)
+                    continue
+                residual = (ps[i] - qs[i]).clamp_min(0)
+                new.append(torch.multinomial(residual if residual.sum() > 0 else ps[i], 1, generator=generator).item())
+                break
+            else:
+                new.append(torch.multinomial(ps[k], 1, generator=generator).item())
+            accepted = len(new) - 1
+            keep = len(ids) + accepted
+            done = eos_id in new
+            if done:
+                new = new[:new.index(eos_id)]
+            new = new[:max_new_tokens - produced]
+            ids += new
+            # keep the KV of the context and the accepted drafts; the last new token is fed next round
+            tc.crop(min(keep, len(ids)))
+            dc.crop(min(keep, len(ids)))
+            produced += len(new)
+            s = self.stats
+            s['passes'] += 1
+            s['drafted'] += k
+            s['accepted'] += accepted
+            s['tokens'] += len(new)
+            s['seconds'] += time.perf_counter() - t0
+            yield [(0, t) for t in new]
+            if done:
+                return
+
+    def generate(self, prompt_ids, **kwargs):
+        out = []
+        for produced in self.steps(prompt_ids, **kwargs):
+            out += [t for _, t in produced]
+        return out
+
+    def summary(self):
+        s = self.stats
+        rate = s['accepted'] / s['drafted'] if s['drafted'] else 0.0
+        per_pass = s['tokens'] / s['passes'] if s['passes'] else 0.0
+        tok_s = s['tokens'] / s['seconds'] if s['seconds'] else 0.0
+        return (f"speculative: acceptance {rate:.0%} (k={self.k}), {per_pass:.2f} tokens per target pass, "
+                f"{tok_s:.1f} tok/s")
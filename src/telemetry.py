@@ -0,0 +1,177 @@
+import contextlib
+import json
+import sys
+import time
+import torch
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+_NULL = contextlib.nullcontext()
+
+
+def estimate_flops_per_token(cfg, seq_len, training=True):
+    """Approximate model FLOPs per token for `MoETransformer(**cfg)`.
+
+    Counts 2 FLOPs per multiply-accumulate of every *active* weight (attention
+    projections, router, `moe_top_k` experts or the dense FFN, output head) plus
+    the attention score/value matmuls over `seq_len` (or the attention
+    window, if smaller). Training is 3x forward.
+    With an adaptive softmax head only the head cluster and the tail
+    projections are counted (tail outputs are paid by rare tokens only).
+    """
+    d, d_ff, n_layers = cfg['d_model'], cfg['d_ff'], cfg['n_layers']
+    kv_frac = cfg['n_kv_heads'] / cfg['n_heads'] if cfg.get('n_kv_heads') else 1.0
+    moe_layers = cfg.get('moe_layers')
+    n_moe = n_layers if moe_layers is None else len(moe_layers)
+    top_k, n_exp = cfg.get('moe_top_k', 1), cfg.get('num_experts', 16)
+    active = n_layers * (2 + 2 * kv_frac) * d * d
+    active += n_moe * (top_k * 2 * d * d_ff + d * n_exp) + (n_layers - n_moe) * 2 * d * d_ff
+    cutoffs = cfg.get('adaptive_cutoffs')
+    if cutoffs:
+        div = cfg.get('adaptive_div', 4.0)
+        active += d * (cutoffs[0] + len(cutoffs)) + sum(d * int(d // div ** (i + 1)) for i in range(len(cutoffs)))
+    else:
+        active += d * cfg['vocab_size']
+    attended = min(seq_len, cfg.get('attn_window') or seq_len)
+    forward = 2 * active + 4 * n_layers * attended * d
+    return 3 * forward if training else forward
+
+
+def peak_rss_bytes():
+    """Peak resident set size of this process, or None where unavailable."""
+    if resource is not None:
+        rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return rss if sys.platform == 'darwin' else rss * 1024
+    try:
+        import psutil
+        return getattr(psutil.Process().memory_info(), 'peak_wset', None)
+    except ImportError:
+        return None
+
+
+class Telemetry:
+    """Per-step training telemetry.
+
+    - `phase(name)` times a block (data, forward, backward, optimizer,
+      checkpoint); `end_step` closes the step and, if `path` is set, appends
+      one JSON line with wall time, per-phase seconds, non-pad tokens/s, peak
+      RSS and model TFLOP/s (plus MFU when `peak_flops` is given).
+    - when `enabled` is False every call is a no-op returning a shared null
+      context, so instrumented loops cost nothing extra.
+    - timing uses perf_counter only; with `sync_cuda` the device is
+      synchronized at phase boundaries so GPU time lands in the right phase.
+    """
+
+    def __init__(self, path=None, flops_per_token=None, peak_flops=None, enabled=True, sync_cuda=False):
+        self.enabled = enabled
+        self.flops_per_token = flops_per_token
+        self.peak_flops = peak_flops
+        self.sync_cuda = sync_cuda and torch.cuda.is_available()
+        self._file = open(path, 'a', encoding='utf-8') if (enabled and path) else None
+        self._phases = {}
+        self._step_start = time.perf_counter()
+        self.reset_summary()
+
+    def reset_summary(self):
+        self._summary = {'steps': 0, 'tokens': 0, 'time': 0.0, 'phases': {}}
+
+    @contextlib.contextmanager
+    def _timed(self, name):
+        if self.sync_cuda:
+            torch.cuda.synchronize()
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            if self.sync_cuda:
+                torch.cuda.synchronize()
+            self._phases[name] = self._phases.get(name, 0.0) + time.perf_counter() - t0
+
+    def phase(self, name):
+        return self._timed(name) if self.enabled else _NULL
+
+    def timed(self, iterable, name='data'):
+        """Iterate `iterable`, recording the time spent fetching each item as `name`."""
+        if not self.enabled:
+            yield from iterable
+            return
+        it = iter(iterable)
+        while True:
+            with self._timed(name):
+                try:
+                    item = next(it)
+                except StopIteration:
+                    return
+            yield item
+
+    def start(self):
+        """Restart the step clock (e.g. at epoch start) and drop pending phases."""
+        self._step_start = time.perf_counter()
+        self._phases = {}
+
+    def end_step(self, step, tokens, **extra):
+        """Close the current step (started at the previous `end_step`)."""
+        if not self.enabled:
+            return None
+        now = time.perf_counter()
+        wall = now - self._step_start
+        self._step_start = now
+        record = {'step': step, 'time': round(wall, 6), 'tokens': tokens,
+                  'tokens_per_s': tokens / wall if wall > 0 else 0.0,
+                  'phases': {k: round(v, 6) for k, v in self._phases.items()},
+                  'peak_rss_mb': None}
+        rss = peak_rss_bytes()
+        if rss is not None:
+            record['peak_rss_mb'] = round(rss / 2 ** 20, 1)
+        if self.flops_per_token:
+            achieved = self.flops_per_token * record['tokens_per_s']
+            record['tflops'] = achieved / 1e12
+            if self.peak_flops:
+                record['mfu'] = achieved / self.peak_flops
+        record.update(extra)
+        if self._file is not None:
+            self._file.write(json.dumps(record) + '\n')
+            self._file.flush()
+
+        s = self._summary
+        s['steps'] += 1
+        s['tokens'] += tokens
+        s['time'] += wall
+        for k, v in self._phases.items():
+            s['phases'][k] = s['phases'].get(k, 0.0) + v
+        self._phases = {}
+        return record
+
+    def summary(self):
+        """Aggregate since the last `reset_summary` (e.g. for one epoch)."""
+        s = self._summary
+        out = {'steps': s['steps'], 'tokens': s['tokens'], 'time': s['time'],
+               'tokens_per_s': s['tokens'] / s['time'] if s['time'] > 0 else 0.0,
+               'phase_frac': {k: v / s['time'] for k, v in s['phases'].items()} if s['time'] > 0 else {}}
+        rss = peak_rss_bytes()
+        out['peak_rss_mb'] = round(rss / 2 ** 20, 1) if rss is not None else None
+        if self.flops_per_token:
+            out['tflops'] = self.flops_per_token * out['tokens_per_s'] / 1e12
+            if self.peak_flops:
+                out['mfu'] = out['tflops'] * 1e12 / self.peak_flops
+        return out
+
+    def format_summary(self):
+        s = self.summary()
+        phases = ', '.join(f'{k} {v * 100:.1f}%' for k, v in sorted(s['phase_frac'].items(), key=lambda kv: -kv[1]))
+        line = f"{s['steps']} steps, {s['tokens_per_s']:.0f} tok/s [{phases}]"
+        if s['peak_rss_mb'] is not None:
+            line += f", peak RSS {s['peak_rss_mb']:.0f}MB"
+        if 'tflops' in s:
+            line += f", {s['tflops']:.3f} TFLOP/s"
+        if 'mfu' in s:
+            line += f", MFU {s['mfu'] * 100:.1f}%"
+        return line
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
@@ -50,3 +50,63 @@ class SimpleTokenizer:
             data = json.load(f)
         self.vocab = data["vocab"]
         self.inv_vocab = {int(v): k for k, v in self.vocab.items()}
+
+
+class IncrementalDecoder:
+    """Turns generated ids into text deltas, one token at a time.
+
+    - words are joined with single spaces, as in `SimpleTokenizer.decode`;
+      <bos>/<pad> are dropped, <unk> is shown as `unk_text` and <eos> ends
+      the stream.
+    - the stream also ends at the first of the `stop` strings, which is not
+      emitted: text that could still turn into a stop string is held back
+      until it is ruled out, so each `push` only looks at a few characters
+      instead of re-decoding the whole sequence.
+    - `text` is everything emitted so far; `flush` releases held-back text
+      at the end of generation.
+    """
+
+    def __init__(self, tokenizer, stop=(), unk_text="<unk>"):
+        self.inv_vocab = tokenizer.inv_vocab
+        self.stop = [s for s in stop if s]
+        self.unk_text = unk_text
+        self.text = ""
+        self.pending = ""
+        self.stopped = False
+
+    def push(self, token_id: int) -> str:
+        if self.stopped:
+            return ""
+        tok = self.inv_vocab.get(token_id, "<unk>")
+        if tok == "<eos>":
+            delta = self.flush()
+            self.stopped = True
+            return delta
+        if tok in ("<bos>", "<pad>"):
+            return ""
+        if tok == "<unk>":
+            tok = self.unk_text
+        self.pending += (" " if self.text or self.pending else "") + tok
+        return self._release()
+
+    def flush(self) -> str:
+        delta, self.pending = ("" if self.stopped else self.pending), ""
+        self.text += delta
+        return delta
+
+    def _release(self):
+        hits = [i for i in (self.pending.find(s) for s in self.stop) if i >= 0]
+        if hits:
+            delta, self.pending = self.pending[:min(hits)], ""
+            self.stopped = True
+        else:
+            hold = 0
+            for s in self.stop:
+                for k in range(min(len(s) - 1, len(self.pending)), hold, -1):
+                    if self.pending.endswith(s[:k]):
+                        hold = k
+                        break
+            delta = self.pending[:len(self.pending) - hold]
+            self.pending = self.pending[len(self.pending) - hold:]
+        self.text += delta
+        return delta
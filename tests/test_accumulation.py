@@ -0,0 +1,33 @@
+import torch
+import torch.nn.functional as F
+from src.model import MoETransformer
+from src.accumulation import macro_batches, accumulate_gradients, count_target_tokens
+
+
+def test_macro_batches_by_count_and_tokens():
+    batches = [torch.ones(1, 4, dtype=torch.long) for _ in range(5)]  # 3 targets each
+    assert [len(g) for g in macro_batches(batches, accum_steps=2)] == [2, 2, 1]
+    assert [len(g) for g in macro_batches(batches, target_tokens=7)] == [3, 2]
+
+
+def test_accumulated_gradient_matches_full_batch_token_mean():
+    torch.manual_seed(0)
+    model = MoETransformer(vocab_size=20, d_model=16, n_layers=1, n_heads=2, d_ff=32, num_experts=2)
+    a = torch.tensor([[1, 5, 6, 7, 8, 9]])
+    b = torch.tensor([[1, 3, 4, 0, 0, 0], [1, 2, 0, 0, 0, 0]])  # padded, fewer real tokens
+
+    loss, n_tokens = accumulate_gradients(model, [a, b], aux_weight=0.0)
+    assert n_tokens == count_target_tokens(a) + count_target_tokens(b) == 8
+    accumulated = [p.grad.clone() for p in model.parameters() if p.grad is not None]
+
+    model.zero_grad()
+    total, n = 0.0, 0
+    for batch in (a, b):
+        logits, _ = model(batch[:, :-1])
+        total = total + F.cross_entropy(logits.reshape(-1, 20), batch[:, 1:].reshape(-1), ignore_index=0, reduction='sum')
+    (total / 8).backward()
+    reference = [p.grad for p in model.parameters() if p.grad is not None]
+
+    assert abs(loss - float(total) / 8) < 1e-5
+    for g, r in zip(accumulated, reference):
+        assert torch.allclose(g, r, atol=1e-6)
@@ -0,0 +1,57 @@
+import pytest
+import torch
+import torch.nn.functional as F
+from src.model import MoETransformer
+from src.adaptive_head import AdaptiveHead, parse_cutoffs
+from src.checkpoint import load_model
+
+
+def _model(**kw):
+    torch.manual_seed(0)
+    return MoETransformer(vocab_size=40, d_model=16, n_layers=1, n_heads=2, d_ff=32, num_experts=2, **kw)
+
+
+def test_parse_cutoffs():
+    assert parse_cutoffs('auto', 5000) == [625, 2500]
+    assert parse_cutoffs('3000,1000,9000', 5000) == [1000, 3000]
+    with pytest.raises(ValueError):
+        parse_cutoffs('0', 5000)
+
+
+def test_loss_sum_matches_full_log_prob():
+    head = AdaptiveHead(16, 40, [8, 20])
+    h = torch.randn(3, 5, 16)
+    targets = torch.randint(1, 40, (3, 5))
+    targets[0, -2:] = 0
+    logp = head.log_prob(h.reshape(-1, 16))
+    ref = -logp.gather(1, targets.reshape(-1, 1)).squeeze(1)[targets.reshape(-1) != 0].sum()
+    assert torch.allclose(head.loss_sum(h, targets), ref, atol=1e-5)
+    assert torch.allclose(logp.exp().sum(-1), torch.ones(15), atol=1e-5)
+
+
+def test_model_targets_path_and_logits():
+    model = _model(adaptive_cutoffs=[8, 20])
+    ids = torch.randint(1, 40, (2, 6))
+    nll, _ = model(ids[:, :-1], targets=ids[:, 1:])
+    logp, _ = model(ids[:, :-1])
+    assert logp.shape == (2, 5, 40)
+    ref = F.cross_entropy(logp.reshape(-1, 40), ids[:, 1:].reshape(-1), reduction='sum')
+    assert torch.allclose(nll, ref, atol=1e-4)
+    last, _ = model(ids[:, :-1], last_only=True)
+    assert torch.allclose(last[:, 0], logp[:, -1], atol=1e-5)
+
+    dense = _model()
+    nll, _ = dense(ids[:, :-1], targets=ids[:, 1:])
+    logits, _ = dense(ids[:, :-1])
+    assert torch.allclose(nll, F.cross_entropy(logits.reshape(-1, 40), ids[:, 1:].reshape(-1), reduction='sum'), atol=1e-4)
+
+
+def test_checkpoint_load_infers_head_config(tmp_path):
+    model = _model(adaptive_cutoffs=[8, 20], adaptive_div=2.0)
+    path = tmp_path / 'adaptive.pt'
+    torch.save(model.state_dict(), path)
+    cfg = dict(vocab_size=40, d_model=16, n_layers=1, n_heads=2, d_ff=32, num_experts=2)
+    loaded = load_model(str(path), cfg)
+    assert loaded.adaptive and loaded.head.cutoffs[:-1] == [8, 20]
+    ids = torch.randint(1, 40, (1, 5))
+    assert torch.allclose(loaded.eval()(ids)[0], model.eval()(ids)[0])
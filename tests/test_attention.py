@@ -0,0 +1,103 @@
+import torch
+import torch.nn as nn
+from src.attention import GroupedQueryAttention, KVCache, convert_state_dict, pool_kv_heads
+from src.model import MoETransformer
+
+CFG = dict(vocab_size=40, d_model=16, n_layers=2, n_heads=4, d_ff=32, num_experts=2)
+
+
+def test_loads_multihead_attention_checkpoint():
+    torch.manual_seed(0)
+    mha = nn.MultiheadAttention(16, 4)
+    attn = GroupedQueryAttention(16, 4)
+    attn.load_state_dict(mha.state_dict())
+    x = torch.randn(5, 2, 16)
+    future = torch.ones(5, 5, dtype=torch.bool).triu(1)  # MHA: True = masked
+    assert torch.allclose(attn(x), mha(x, x, x, attn_mask=future)[0], atol=1e-5)
+
+    gqa = GroupedQueryAttention(16, 4, n_kv_heads=2)
+    gqa.load_state_dict(mha.state_dict())
+    k_full = mha.in_proj_weight[16:32]
+    assert gqa.k_proj.weight.shape == (8, 16)
+    assert torch.allclose(gqa.k_proj.weight, k_full.view(2, 2, 4, 16).mean(1).reshape(8, 16))
+
+
+def test_offline_conversion_matches_load_time_conversion():
+    torch.manual_seed(0)
+    legacy = {k: v for k, v in MoETransformer(**CFG).state_dict().items() if '.attn.' not in k}
+    for i in range(2):
+        legacy.update({f'layers.{i}.attn.{k}': v for k, v in nn.MultiheadAttention(16, 4).state_dict().items()})
+    converted = convert_state_dict(legacy, n_heads=4, n_kv_heads=1)
+    model = MoETransformer(**CFG, n_kv_heads=1)
+    model.load_state_dict(legacy)
+    for k, v in model.state_dict().items():
+        assert torch.allclose(v, converted[k]), k
+    assert converted['layers.0.attn.v_proj.bias'].shape == (4,)
+
+
+def test_attention_is_causal():
+    torch.manual_seed(0)
+    model = MoETransformer(**CFG, n_kv_heads=2).eval()
+    ids = torch.randint(4, 40, (1, 8))
+    changed = ids.clone()
+    changed[0, 5:] = 3
+    a, _ = model(ids)
+    b, _ = model(changed)
+    assert torch.allclose(a[:, :5], b[:, :5], atol=1e-5)
+
+
+def test_cached_decode_matches_full_forward():
+    for n_kv in (4, 2, 1):
+        torch.manual_seed(0)
+        model = MoETransformer(**CFG, n_kv_heads=n_kv).eval()
+        ids = torch.randint(4, 40, (2, 9))
+        cache = KVCache(len(model.layers))
+        with torch.no_grad():
+            model(ids[:, :4], cache=cache)
+            for t in range(4, 9):
+                step, _ = model(ids[:, t:t + 1], cache=cache, last_only=True)
+                full, _ = model(ids[:, :t + 1], last_only=True)
+                assert torch.allclose(step, full, atol=1e-5)
+        assert cache.length == 9
+        assert cache.nbytes() == 2 * 2 * 2 * n_kv * 4 * 9 * 4  # layers x (k, v) x batch x kv_heads x head_dim x len x fp32
+
+
+def test_pool_kv_heads_groups_consecutive_heads():
+    w = torch.arange(8.).view(8, 1)  # 4 heads of dim 2
+    assert pool_kv_heads(w, 4, 2).flatten().tolist() == [1, 2, 5, 6]
+
+
+def test_rotary_has_no_length_limit_and_window_is_local():
+    torch.manual_seed(0)
+    model = MoETransformer(**dict(CFG, n_layers=1), pos_encoding='rope', attn_window=4).eval()
+    assert not hasattr(model, 'pos_emb')
+    ids = torch.randint(4, 40, (1, 1100))
+    with torch.no_grad():
+        full, _ = model(ids)
+        # one layer with rotary positions: position t only depends on tokens t-3..t
+        local, _ = model(ids[:, 1000:1004])
+    assert full.shape == (1, 1100, 40)
+    assert torch.allclose(full[:, 1003], local[:, -1], atol=1e-4)
+
+
+def test_ring_buffer_decode_matches_blocked_full_forward():
+    torch.manual_seed(0)
+    model = MoETransformer(**CFG, n_kv_heads=2, pos_encoding='rope', attn_window=4).eval()
+    ids = torch.randint(4, 40, (2, 24))
+    cache = KVCache.for_model(model)
+    with torch.no_grad():
+        full, _ = model(ids)  # 24 > 2 * window: blocked local attention
+        prefill, _ = model(ids[:, :11], cache=cache)  # longer than the window: fed in chunks
+        steps = [model(ids[:, t:t + 1], cache=cache)[0] for t in range(11, 24)]
+    assert torch.allclose(prefill, full[:, :11], atol=1e-4)
+    assert torch.allclose(torch.cat(steps, dim=1), full[:, 11:], atol=1e-4)
+    assert cache.length == 24
+    assert cache.nbytes() == 2 * 2 * 2 * 2 * 4 * 4 * 4  # layers x (k, v) x batch x kv_heads x head_dim x window x fp32
+
+
+def test_window_and_rope_restored_from_checkpoint(tmp_path):
+    from src.checkpoint import load_model
+    model = MoETransformer(**CFG, pos_encoding='rope', attn_window=8)
+    torch.save(model.state_dict(), tmp_path / 'm.pt')
+    loaded = load_model(str(tmp_path / 'm.pt'), CFG)
+    assert loaded.pos_encoding == 'rope' and loaded.attn_window == 8
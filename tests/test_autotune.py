@@ -0,0 +1,42 @@
+import argparse
+from src.autotune import autotune, run_trial, save_profile, apply_profile, thread_candidates
+
+CFG = {'vocab_size': 50, 'd_model': 16, 'n_layers': 1, 'n_heads': 2, 'd_ff': 32, 'num_experts': 2, 'moe_top_k': 1}
+
+
+def _fake_trial(setting):
+    # throughput grows with batch, threads (up to 4) and seq_len; memory with batch * seq_len
+    mem = setting['batch'] * setting['seq_len'] * 1000
+    if mem > 300_000:
+        return dict(setting, status='oom')
+    rate = setting['batch'] * setting['seq_len'] * min(setting['threads'], 4) + setting['seq_len'] + setting['data_workers']
+    return dict(setting, status='ok', tokens_per_s=float(rate), peak_mem_bytes=mem)
+
+
+def test_search_respects_memory_ceiling_and_stops_doubling():
+    profile = autotune(CFG, seq_lens=(64, 128), max_batch=64, threads=[1, 2, 4, 8], data_workers=(0, 2),
+                       target_tokens=1000, trial_fn=_fake_trial, log=lambda *a: None)
+    assert (profile['batch'], profile['seq_len'], profile['threads'], profile['data_workers']) == (2, 128, 4, 2)
+    assert profile['accum_steps'] == 4  # ceil(1000 / (2 * 127))
+    # nothing larger than the first failing batch size was tried for a sequence length
+    assert not [t for t in profile['trials'] if t['seq_len'] == 128 and t['batch'] > 4]
+
+
+def test_profile_supplies_parser_defaults(tmp_path):
+    path = tmp_path / 'tune.json'
+    save_profile({'batch': 16, 'seq_len': 256, 'accum_steps': 3, 'threads': 6, 'data_workers': 1}, str(path))
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--batch', type=int, default=8)
+    parser.add_argument('--seq-len', type=int, default=64)
+    parser.add_argument('--accum-steps', type=int, default=1)
+    apply_profile(parser, str(path))
+    args = parser.parse_args(['--batch', '4'])
+    assert (args.batch, args.seq_len, args.accum_steps) == (4, 256, 3)
+
+
+def test_real_trial_reports_throughput_and_memory():
+    r = run_trial(CFG, {'batch': 2, 'seq_len': 8, 'threads': 1, 'data_workers': 0}, steps=2)
+    assert r['status'] == 'ok' and r['tokens_per_s'] > 0 and r['peak_mem_bytes'] > 0
+    r = run_trial(CFG, {'batch': 2, 'seq_len': 8, 'threads': 1, 'data_workers': 0}, steps=2, max_memory=1)
+    assert r['status'] == 'oom'
+    assert thread_candidates(6) == [1, 2, 4, 6]
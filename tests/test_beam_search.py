@@ -0,0 +1,51 @@
+import torch
+from src.model import MoETransformer
+from src.generation import generate_ids
+from src.beam_search import beam_search
+
+CFG = dict(vocab_size=40, d_model=16, n_layers=2, n_heads=4, d_ff=32, num_experts=2)
+PROMPTS = [[1, 5, 6, 7, 8, 9, 10], [1, 11], [1, 12, 13, 14]]
+
+
+def _model():
+    torch.manual_seed(0)
+    return MoETransformer(**CFG).eval()
+
+
+def _logprob(model, prompt, ids):
+    with torch.no_grad():
+        logits, _ = model(torch.tensor([prompt + ids]))
+    logprobs = torch.log_softmax(logits[0].float(), dim=-1)
+    return sum(logprobs[len(prompt) - 1 + i, t].item() for i, t in enumerate(ids))
+
+
+def test_single_beam_is_greedy():
+    model = _model()
+    out = beam_search(model, PROMPTS, num_beams=1, max_new_tokens=6)
+    assert [o[0][0] for o in out] == generate_ids(model, PROMPTS, max_new_tokens=6, top_k=0)
+
+
+def test_beam_scores_are_sequence_log_probs():
+    model = _model()
+    out = beam_search(model, PROMPTS, num_beams=4, max_new_tokens=5, length_penalty=0.0, num_return=4)
+    for p, hyps in zip(PROMPTS, out):
+        assert len(hyps) == 4 and len({tuple(ids) for ids, _ in hyps}) == 4
+        assert [s for _, s in hyps] == sorted((s for _, s in hyps), reverse=True)
+        for ids, score in hyps:
+            assert len(ids) == 5 and abs(score - _logprob(model, p, ids)) < 1e-3
+
+
+def test_batched_matches_per_prompt_with_eos():
+    model = _model()
+    eos = generate_ids(model, [PROMPTS[1]], max_new_tokens=2, top_k=0)[0][1]
+    kwargs = dict(num_beams=3, max_new_tokens=8, eos_id=eos, num_return=3)
+    batched = beam_search(model, PROMPTS, **kwargs)
+    for p, hyps in zip(PROMPTS, batched):
+        single = beam_search(model, [p], **kwargs)[0]
+        assert [ids for ids, _ in hyps] == [ids for ids, _ in single]
+        assert all(abs(a - b) < 1e-4 for (_, a), (_, b) in zip(hyps, single))
+        assert all(eos not in ids for ids, _ in hyps)
+
+
+def test_no_new_tokens():
+    assert beam_search(_model(), PROMPTS, num_beams=3, max_new_tokens=0) == [[([], 0.0)]] * len(PROMPTS)
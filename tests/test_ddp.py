@@ -0,0 +1,44 @@
+import pytest
+import torch
+import torch.distributed as dist
+import torch.multiprocessing as mp
+from src.model import MoETransformer
+from src.sampler import ResumableSampler
+from src.distributed import wrap_ddp
+
+
+def _worker(rank, world_size, init_file, out_file):
+    dist.init_process_group('gloo', init_method=f'file://{init_file}', rank=rank, world_size=world_size)
+    torch.manual_seed(rank)  # different init per rank: DDP must broadcast rank 0's weights
+    model = wrap_ddp(MoETransformer(vocab_size=30, d_model=16, n_layers=1, n_heads=2, d_ff=32, num_experts=4))
+    opt = torch.optim.AdamW(model.parameters(), lr=1e-2)
+    data = torch.randint(1, 30, (16, 6), generator=torch.Generator().manual_seed(0))
+    sampler = ResumableSampler(data, seed=0, num_replicas=world_size, rank=rank)
+    idx = list(sampler)
+    accum = 2
+    for i in range(0, len(idx), 2):
+        batch = data[idx[i:i + 2]]
+        last = (i // 2 + 1) % accum == 0
+        ctx = model.no_sync() if not last else torch.enable_grad()
+        with ctx:
+            logits, aux = model(batch[:, :-1])
+            loss = torch.nn.functional.cross_entropy(logits.reshape(-1, 30), batch[:, 1:].reshape(-1)) + 1e-2 * aux
+            (loss / accum).backward()
+        if last:
+            opt.step()
+            opt.zero_grad()
+    flat = torch.cat([p.detach().reshape(-1) for p in model.module.parameters()])
+    gathered = [torch.zeros_like(flat) for _ in range(world_size)]
+    dist.all_gather(gathered, flat)
+    if rank == 0:
+        torch.save({'same': all(torch.equal(gathered[0], g) for g in gathered[1:]), 'shard': idx}, out_file)
+    dist.destroy_process_group()
+
+
+@pytest.mark.skipif(not dist.is_available(), reason='torch.distributed not available')
+def test_two_rank_gloo_training_stays_in_sync(tmp_path):
+    out = tmp_path / 'out.pt'
+    mp.spawn(_worker, args=(2, str(tmp_path / 'store'), str(out)), nprocs=2, join=True)
+    result = torch.load(out)
+    assert result['same']
+    assert len(result['shard']) == 8
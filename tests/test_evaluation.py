@@ -0,0 +1,58 @@
+import math
+import torch
+import torch.nn.functional as F
+from src.model import MoETransformer
+from src.tokenizer import SimpleTokenizer
+from src.evaluation import load_eval_batches, evaluate, evaluate_parallel, combine_metrics
+
+
+def _setup(tmp_path):
+    texts = ['the cat sat on the mat', 'a dog ran far away from the cat', 'birds fly']
+    tok = SimpleTokenizer()
+    tok.build_vocab(texts, vocab_size=30)
+    path = tmp_path / 'val.txt'
+    path.write_text('\n'.join(texts) + '\n\n', encoding='utf-8')
+    torch.manual_seed(0)
+    model = MoETransformer(vocab_size=len(tok.vocab), d_model=16, n_layers=1, n_heads=2, d_ff=32, num_experts=2)
+    return texts, tok, str(path), model
+
+
+def test_windows_predict_every_token_once(tmp_path):
+    texts, tok, path, _ = _setup(tmp_path)
+    batches = load_eval_batches(path, tok, seq_len=4, batch_size=3)
+    targets = sum(int((b[:, 1:] != 0).sum()) for b in batches)
+    assert targets == sum(len(tok.encode(t)) - 1 for t in texts)
+    assert all(b.size(1) <= 5 for b in batches)
+
+
+def test_evaluate_matches_token_mean_cross_entropy(tmp_path):
+    texts, tok, path, model = _setup(tmp_path)
+    batches = load_eval_batches([path, path], tok, seq_len=64, batch_size=1)
+    model.train()
+    m = evaluate(model, batches)
+    assert model.training
+
+    model.eval()
+    total, n = 0.0, 0
+    with torch.no_grad():
+        for t in texts:
+            ids = torch.tensor([tok.encode(t)])
+            logits, _ = model(ids[:, :-1])
+            total += float(F.cross_entropy(logits[0], ids[0, 1:], reduction='sum'))
+            n += ids.size(1) - 1
+    assert m['tokens'] == 2 * n
+    assert abs(m['loss'] - total / n) < 1e-4
+    assert abs(m['ppl'] - math.exp(m['loss'])) < 1e-3 * m['ppl']
+    assert m['tokens_per_s'] > 0
+
+    combined = combine_metrics([m, evaluate(model, batches[:1])])
+    assert combined['tokens'] == m['tokens'] + int((batches[0][:, 1:] != 0).sum())
+
+
+def test_parallel_workers_match_single_process(tmp_path):
+    _, tok, path, model = _setup(tmp_path)
+    batches = load_eval_batches(path, tok, seq_len=4, batch_size=2)
+    single = evaluate(model, batches)
+    parallel = evaluate_parallel(model, batches, workers=2)
+    assert parallel['tokens'] == single['tokens']
+    assert abs(parallel['loss'] - single['loss']) < 1e-5
@@ -0,0 +1,50 @@
+import torch
+from src.model import MoETransformer
+from src.tokenizer import SimpleTokenizer
+from src.generation import generate_ids
+from src.session import ChatSession
+from src.export import ExportedModel, InferenceGraph, artifact_format, export_model, graph_meta, load_exported
+
+CFG = dict(vocab_size=40, d_model=16, n_layers=2, n_heads=4, d_ff=32, num_experts=2)
+PROMPTS = [[1, 5, 6, 7, 8, 9, 10], [1], [1, 12, 13, 14]]
+
+
+def _models():
+    torch.manual_seed(0)
+    yield MoETransformer(**CFG).eval()
+    yield MoETransformer(**CFG, n_kv_heads=2, pos_encoding='rope', attn_window=3, moe_top_k=2).eval()
+
+
+def test_graph_matches_eager_generation():
+    for model in _models():
+        wrapped = ExportedModel(InferenceGraph(model), graph_meta(model))
+        expected = generate_ids(model, PROMPTS, max_new_tokens=6, top_k=0)
+        assert generate_ids(wrapped, PROMPTS, max_new_tokens=6, top_k=0) == expected
+        for p, out in zip(PROMPTS, expected):
+            assert generate_ids(wrapped, [p], max_new_tokens=6, top_k=0)[0] == out
+
+
+def test_artifact_round_trip(tmp_path):
+    for fmt in ('torchscript', 'export'):
+        for i, model in enumerate(_models()):
+            path = str(tmp_path / f'model_{fmt}_{i}.pt2')
+            used = export_model(model, path, fmt=fmt)
+            assert used == fmt and artifact_format(path) == fmt  # no silent fallback to TorchScript
+            loaded = load_exported(path)
+            assert loaded.format == used and len(loaded.layers) == CFG['n_layers']
+            assert generate_ids(loaded, PROMPTS, max_new_tokens=5, top_k=0) == \
+                generate_ids(model, PROMPTS, max_new_tokens=5, top_k=0)
+
+
+def test_chat_session_runs_on_artifact(tmp_path):
+    tok = SimpleTokenizer()
+    tok.build_vocab(['user: hello there deepernova: hi how can i help', 'tell me about the sea'], vocab_size=40)
+    torch.manual_seed(0)
+    model = MoETransformer(len(tok.vocab), d_model=16, n_layers=2, n_heads=4, d_ff=32, num_experts=2).eval()
+    path = str(tmp_path / 'chat.pt2')
+    export_model(model, path, fmt='torchscript')
+    eager, exported = ChatSession(model, tok), ChatSession(load_exported(path), tok)
+    assert exported.max_context == eager.max_context == 1024
+    for msg in ('tell me about the sea', 'hi'):
+        assert ''.join(exported.reply(msg, max_new_tokens=6, top_k=0)) == ''.join(eager.reply(msg, max_new_tokens=6, top_k=0))
+    assert exported.ids == eager.ids
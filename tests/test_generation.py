@@ -0,0 +1,61 @@
+import torch
+from src.model import MoETransformer
+from src.tokenizer import SimpleTokenizer
+from src.generation import left_pad, generate_ids, stream_text
+
+CFG = dict(vocab_size=40, d_model=16, n_layers=2, n_heads=4, d_ff=32, num_experts=2)
+PROMPTS = [[1, 5, 6, 7, 8, 9, 10], [1, 11], [1, 12, 13, 14]]
+
+
+def _models():
+    torch.manual_seed(0)
+    yield MoETransformer(**CFG)
+    yield MoETransformer(**CFG, n_kv_heads=2, pos_encoding='rope', attn_window=3)
+
+
+def test_left_pad():
+    ids, mask = left_pad([[3, 4, 5], [6]], pad_id=0)
+    assert ids.tolist() == [[3, 4, 5], [0, 0, 6]]
+    assert mask.tolist() == [[1, 1, 1], [0, 0, 1]]
+
+
+def test_padded_batch_matches_single_prompts():
+    for model in _models():
+        model.eval()
+        ids, mask = left_pad(PROMPTS)
+        with torch.no_grad():
+            batched, _ = model(ids, attention_mask=mask, last_only=True)
+            for i, p in enumerate(PROMPTS):
+                single, _ = model(torch.tensor([p]), last_only=True)
+                assert torch.allclose(batched[i], single[0], atol=1e-4)
+
+        batched = generate_ids(model, PROMPTS, max_new_tokens=6, top_k=0)
+        for p, out in zip(PROMPTS, batched):
+            assert out == generate_ids(model, [p], max_new_tokens=6, top_k=0)[0]
+            assert len(out) == 6
+
+
+def test_per_sequence_stop_conditions_and_compaction():
+    model = next(_models())
+    greedy = generate_ids(model, PROMPTS, max_new_tokens=5, top_k=0)
+    out = generate_ids(model, PROMPTS, max_new_tokens=[1, 3, 5], top_k=0)
+    assert out == [greedy[0][:1], greedy[1][:3], greedy[2]]
+    # a row that hits eos stops (eos not returned) while the others carry on
+    eos = greedy[1][0]
+    out = generate_ids(model, PROMPTS, max_new_tokens=5, top_k=0, eos_id=eos)
+    assert out[1] == []
+    for g, o in zip(greedy, out):
+        assert o == g[:g.index(eos)] if eos in g else o == g
+
+
+def test_stream_text_yields_deltas_of_generate_text():
+    tok = SimpleTokenizer()
+    tok.build_vocab(['the cat sat on the mat', 'a dog ran in the park'], vocab_size=30)
+    torch.manual_seed(0)
+    model = MoETransformer(**dict(CFG, vocab_size=len(tok.vocab)))
+    pieces = list(stream_text(model, tok, 'the cat', max_new_tokens=8, top_k=0))
+    ids = generate_ids(model, [tok.encode('the cat')], max_new_tokens=8, top_k=0, eos_id=tok.vocab['<eos>'])[0]
+    assert ''.join(pieces) == ' '.join(tok.inv_vocab[i] for i in ids if i not in (tok.vocab['<pad>'], tok.vocab['<bos>']))
+    # a stop string cuts the reply short and is not yielded
+    first = pieces[0].strip()
+    assert ''.join(stream_text(model, tok, 'the cat', stop=[first], max_new_tokens=8, top_k=0)) == ''
@@ -0,0 +1,29 @@
+import torch
+from src.model import MoETransformer
+from src.instrument import LayerInstrumenter
+
+
+def _model():
+    return MoETransformer(vocab_size=30, d_model=16, n_layers=2, n_heads=2, d_ff=32, num_experts=2, moe_layers=[1])
+
+
+def test_collects_forward_backward_and_memory_per_layer():
+    model = _model()
+    with LayerInstrumenter(model) as inst:
+        logits, aux = model(torch.randint(0, 30, (2, 5)))
+        (logits.sum() + aux).backward()
+    stats = inst.stats()
+    assert set(stats) == {'layers.0', 'layers.0.attn', 'layers.0.ff', 'layers.1', 'layers.1.attn', 'layers.1.moe'}
+    assert stats['layers.1.moe']['forward']['count'] == 1
+    assert stats['layers.1']['backward']['count'] == 1
+    assert stats['layers.0.ff']['activation_bytes']['mean'] == 5 * 2 * 16 * 4
+    assert 'layers.1.moe' in inst.table()
+
+
+def test_detached_model_has_no_hooks():
+    model = _model()
+    inst = LayerInstrumenter(model).attach()
+    inst.detach()
+    model(torch.randint(0, 30, (2, 5)))
+    assert all(h['count'] == 0 for s in inst.stats().values() for h in s.values())
+    assert not any(m._forward_hooks or m._forward_pre_hooks for m in model.modules())
@@ -0,0 +1,85 @@
+import torch
+from src.optim import AdamW8bit, Adafactor, LazyAdamW, build_optimizer, quantize_blockwise, dequantize_blockwise
+
+
+def test_blockwise_roundtrip():
+    x = torch.randn(1000) * torch.logspace(-3, 0, 1000)
+    codes, absmax = quantize_blockwise(x, signed=True)
+    assert codes.dtype == torch.int8 and absmax.numel() == 4
+    back = dequantize_blockwise(codes, absmax, x.shape, signed=True)
+    assert (back - x).abs().max() < 0.02 * x.abs().max()
+
+
+def _run(opt_cls, steps=20, **kw):
+    torch.manual_seed(0)
+    w = torch.nn.Parameter(torch.randn(64, 128))
+    target = torch.randn(64, 128)
+    opt = opt_cls([w], **kw)
+    for _ in range(steps):
+        loss = ((w - target) ** 2).mean()
+        opt.zero_grad()
+        loss.backward()
+        opt.step()
+    return w, target, opt
+
+
+def test_adamw8bit_tracks_adamw():
+    w8, _, opt = _run(AdamW8bit, lr=1e-2)
+    w32, _, _ = _run(torch.optim.AdamW, lr=1e-2)
+    assert opt.state[w8]['exp_avg'].dtype == torch.int8
+    assert torch.allclose(w8, w32, atol=2e-2)
+
+
+def test_adafactor_uses_factored_state_and_descends():
+    w0, target, _ = _run(Adafactor, steps=0)
+    start = ((w0 - target) ** 2).mean()
+    w, _, opt = _run(Adafactor, lr=1e-2)
+    state = opt.state[w]
+    assert state['exp_avg_sq_row'].shape == (64,) and state['exp_avg_sq_col'].shape == (128,)
+    assert ((w - target) ** 2).mean() < start
+
+
+def test_state_dict_roundtrip():
+    w, _, opt = _run(AdamW8bit, steps=3, lr=1e-2)
+    clone = torch.nn.Parameter(w.detach().clone())
+    restored = build_optimizer('adamw8bit', [clone], lr=1e-2)
+    restored.load_state_dict(opt.state_dict())
+    assert restored.state[clone]['step'] == 3
+    state = restored.state[clone]
+    assert state['exp_avg'].dtype == torch.int8 and state['exp_avg_sq'].dtype == torch.uint8
+    assert torch.equal(state['exp_avg'], opt.state[w]['exp_avg'])
+    assert torch.equal(state['exp_avg_sq'], opt.state[w]['exp_avg_sq'])
+
+
+def test_lazy_adamw_matches_adamw_when_all_active():
+    w_lazy, _, _ = _run(lambda p, **kw: LazyAdamW([{'params': p, 'lazy': True}], **kw), lr=1e-2)
+    w_ref, _, _ = _run(torch.optim.AdamW, lr=1e-2)
+    assert torch.allclose(w_lazy, w_ref, atol=1e-6)
+
+
+def test_lazy_adamw_catches_up_idle_steps():
+    lr, wd, b1, b2, eps = 0.1, 0.1, 0.9, 0.999, 1e-8
+    w = torch.nn.Parameter(torch.tensor([1.0, -2.0]))
+    opt = LazyAdamW([{'params': [w], 'lazy': True}], lr=lr, weight_decay=wd)
+    g1, g4 = torch.tensor([0.5, 1.0]), torch.tensor([-1.0, 0.25])
+    for g in (g1, torch.zeros(2), None, g4):  # two idle steps (zero grad / no grad)
+        w.grad = g
+        opt.step()
+
+    p = torch.tensor([1.0, -2.0])
+    m, v = (1 - b1) * g1, (1 - b2) * g1 * g1
+    p = p * (1 - lr * wd) - lr * (m / (1 - b1)) / ((v / (1 - b2)).sqrt() + eps)
+    p = p * (1 - lr * wd) ** 2
+    m, v = b1 ** 3 * m + (1 - b1) * g4, b2 ** 3 * v + (1 - b2) * g4 * g4
+    p = p * (1 - lr * wd) - lr * (m / (1 - b1 ** 4)) / ((v / (1 - b2 ** 4)).sqrt() + eps)
+    assert torch.allclose(w.detach(), p, atol=1e-6)
+    assert opt.state[w]['step'] == 4
+
+
+def test_moe_param_groups_split_experts():
+    from src.model import MoETransformer
+    from src.optim import moe_param_groups
+    model = MoETransformer(vocab_size=20, d_model=16, n_layers=1, n_heads=2, d_ff=32, num_experts=2)
+    dense, experts = moe_param_groups(model)
+    assert experts['lazy'] and not dense['lazy']
+    assert len(experts['params']) == 2 * 4  # two experts x (2 weights + 2 biases)
@@ -0,0 +1,68 @@
+import torch
+from src.attention import KVCache
+from src.model import MoETransformer
+from src.generation import generate_ids, prefill
+from src.prefix_cache import PrefixCache
+
+CFG = dict(vocab_size=40, d_model=16, n_layers=2, n_heads=4, d_ff=32, num_experts=2)
+SYSTEM = [1, 5, 6, 7, 8, 9, 10, 11]
+
+
+def _model(**kw):
+    torch.manual_seed(0)
+    return MoETransformer(**CFG, **kw).eval()
+
+
+def _prefilled(model, ids):
+    cache = KVCache.for_model(model)
+    with torch.no_grad():
+        model(torch.tensor([ids]), cache=cache)
+    return cache
+
+
+def test_cached_prefix_matches_full_prefill():
+    for model in (_model(), _model(n_kv_heads=2, pos_encoding='rope')):
+        pc = PrefixCache(max_bytes=10 ** 9)
+        prompts = [SYSTEM + [12, 13], SYSTEM + [14], SYSTEM + [12, 15, 16]]
+        expected = generate_ids(model, prompts, max_new_tokens=5, top_k=0)
+        for _ in range(2):
+            assert generate_ids(model, prompts, max_new_tokens=5, top_k=0, prefix_cache=pc) == expected
+        cache, logits = prefill(model, [SYSTEM + [12, 13]], prefix_cache=pc)
+        full, _ = model(torch.tensor([SYSTEM + [12, 13]]), last_only=True)
+        assert torch.allclose(logits, full[:, -1], atol=1e-5)
+        # first pass: prompts 2 and 3 reuse the system prompt (+ token 12 for the third);
+        # afterwards every prompt is cached up to its last token
+        assert pc.stats['lookups'] == 7 and pc.stats['hits'] == 6
+        assert pc.stats['tokens_saved'] == (8 + 9) + (9 + 8 + 10) + 9
+
+
+def test_split_and_partial_edge_match():
+    model = _model()
+    pc = PrefixCache(max_bytes=10 ** 9)
+    a, b = [1, 2, 3, 4, 5], [1, 2, 3, 9, 9]
+    pc.insert(a, _prefilled(model, a))
+    pc.insert(b, _prefilled(model, b))
+    assert len(pc.root.children) == 1 and len(pc.root.children[1].children) == 2
+    ref = _prefilled(model, a + [6])
+    for ids, n in ((a + [6], 5), ([1, 2, 3, 4, 7], 4), ([1, 2, 7], 2), ([8, 1], 0)):
+        cache, got = pc.lookup(ids)
+        assert got == n
+        if n:
+            assert cache.length == n and cache.seen.tolist() == [n]
+            ref_k = _prefilled(model, ids[:n]).keys[1][:, :, :n]
+            assert torch.allclose(cache.keys[1], ref_k, atol=1e-6)
+    assert torch.allclose(pc.lookup(a + [6])[0].keys[0], ref.keys[0][:, :, :5], atol=1e-6)
+
+
+def test_lru_eviction_under_budget():
+    model = _model()
+    one = _prefilled(model, [1, 2, 3, 4])
+    block = sum(2 * k[:, :, :4].numel() * k.element_size() for k in one.keys)
+    pc = PrefixCache(max_bytes=2 * block)
+    for first in (20, 21, 22):
+        ids = [first, 2, 3, 4]
+        pc.insert(ids, _prefilled(model, ids))
+        if first == 21:
+            pc.lookup([20, 2, 3, 4, 5])  # touch 20: 21 is now least recently used
+    assert pc.nbytes <= pc.max_bytes and pc.stats['evictions'] == 1
+    assert set(pc.root.children) == {20, 22}
@@ -0,0 +1,31 @@
+import pytest
+import torch
+from src.model import MoETransformer
+from src.profiling import StepProfiler, parse_profile_steps
+
+
+def test_parse_profile_steps():
+    assert parse_profile_steps('3:2') == (3, 2)
+    assert parse_profile_steps(None) is None
+    with pytest.raises(ValueError):
+        parse_profile_steps('3')
+
+
+def test_profiles_window_and_exports_named_ranges(tmp_path):
+    model = MoETransformer(vocab_size=30, d_model=16, n_layers=1, n_heads=2, d_ff=32, num_experts=2)
+    prof = StepProfiler('1:2', out_dir=str(tmp_path), name='unit')
+    for _ in range(4):
+        model(torch.randint(0, 30, (2, 5)))
+        prof.step()
+    prof.stop()
+    trace = (tmp_path / 'unit_trace.json').read_text()
+    for name in ('embedding', 'attention', 'moe.router', 'moe.dispatch', 'head'):
+        assert name in trace
+    assert (tmp_path / 'unit_top_ops.txt').exists()
+
+
+def test_disabled_profiler_is_noop():
+    prof = StepProfiler(None)
+    prof.step()
+    prof.stop()
+    assert prof.trace_path is None
@@ -0,0 +1,47 @@
+from src.response_cache import ResponseCache, is_deterministic, tokenizer_hash
+from src.tokenizer import SimpleTokenizer
+
+
+def test_key_depends_on_model_tokenizer_prompt_and_params():
+    rc = ResponseCache('ckpt-a', 'tok-a')
+    k = rc.key([1, 5, 6], {'top_k': 0, 'max_new_tokens': 20})
+    assert k == rc.key([1, 5, 6], {'max_new_tokens': 20, 'top_k': 0})
+    assert k != rc.key([1, 5, 7], {'top_k': 0, 'max_new_tokens': 20})
+    assert k != rc.key([1, 5, 6], {'top_k': 0, 'max_new_tokens': 21})
+    assert k != ResponseCache('ckpt-b', 'tok-a').key([1, 5, 6], {'top_k': 0, 'max_new_tokens': 20})
+    assert k != ResponseCache('ckpt-a', 'tok-b').key([1, 5, 6], {'top_k': 0, 'max_new_tokens': 20})
+
+
+def test_only_deterministic_settings_are_eligible():
+    assert is_deterministic({'temperature': 0.8, 'top_k': 0})
+    assert is_deterministic({'temperature': 0.0, 'top_k': 10})
+    assert is_deterministic({'temperature': 0.8, 'top_k': 10, 'seed': 3})
+    assert not is_deterministic({'temperature': 0.8, 'top_k': 10, 'seed': None})
+    assert not is_deterministic({'temperature': 0.8, 'top_k': None})
+
+
+def test_lru_tier_and_metrics():
+    rc = ResponseCache('c', 't', max_entries=2)
+    rc.put('a', [1])
+    rc.put('b', [2])
+    assert rc.get('a') == [1]
+    rc.put('c', [3])  # evicts b, the least recently used
+    assert rc.get('b') is None and rc.get('c') == [3]
+    assert rc.stats == {'lookups': 3, 'hits': 2, 'disk_hits': 0, 'misses': 1, 'stores': 3, 'evictions': 1}
+    assert 'hit rate 67%' in rc.summary()
+
+
+def test_disk_tier_survives_restart(tmp_path):
+    tok = SimpleTokenizer()
+    tok.build_vocab(['hello there'], vocab_size=10)
+    rc = ResponseCache('c', tokenizer_hash(tok), max_entries=1, directory=str(tmp_path))
+    key = rc.key([1, 4], {'top_k': 0})
+    rc.put(key, {'tokens': [5, 6], 'finish_reason': 'eos'})
+    rc.put(rc.key([1, 5], {'top_k': 0}), {'tokens': [], 'finish_reason': 'eos'})  # pushes key out of memory
+    assert rc.get(key) == {'tokens': [5, 6], 'finish_reason': 'eos'} and rc.stats['disk_hits'] == 1
+
+    restarted = ResponseCache('c', tokenizer_hash(tok), directory=str(tmp_path))
+    assert restarted.key([1, 4], {'top_k': 0}) == key
+    assert restarted.get(key)['tokens'] == [5, 6]
+    assert restarted.get(key)['tokens'] == [5, 6]
+    assert restarted.stats['disk_hits'] == 1 and restarted.stats['hits'] == 2
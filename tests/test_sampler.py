@@ -0,0 +1,21 @@
+from src.sampler import ResumableSampler
+
+
+def test_order_depends_only_on_seed_and_epoch():
+    data = list(range(20))
+    a, b = ResumableSampler(data, seed=3), ResumableSampler(data, seed=3)
+    a.set_epoch(1)
+    b.set_epoch(1)
+    assert list(a) == list(b)
+    b.set_epoch(2)
+    assert list(a) != list(b)
+
+
+def test_resume_skips_consumed_samples():
+    data = list(range(20))
+    s = ResumableSampler(data, seed=0)
+    s.set_epoch(4)
+    full = list(s)
+    s.set_epoch(4, start=6)
+    assert list(s) == full[6:]
+    assert len(s) == 14
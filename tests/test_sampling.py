@@ -0,0 +1,58 @@
+import torch
+from src.sampling import Sampler
+
+
+def _reference_keep(logits, top_k, top_p, min_p):
+    """Per-row loop version of the top-k -> top-p -> min-p filter."""
+    keep = torch.zeros_like(logits, dtype=torch.bool)
+    for i, row in enumerate(logits):
+        order = row.argsort(descending=True)[:top_k[i]]
+        probs = row[order].softmax(dim=-1)
+        cut = int((probs.cumsum(0) - probs <= top_p[i]).sum())
+        order, probs = order[:cut], probs[:cut]
+        keep[i, order[probs >= min_p[i] * probs[0]]] = True
+    return keep
+
+
+def test_filters_match_reference():
+    torch.manual_seed(0)
+    logits = torch.randn(5, 50) * 3
+    top_k, top_p, min_p = [50, 10, 3, 50, 1], [1.0, 0.9, 1.0, 0.5, 1.0], [0.0, 0.0, 0.0, 0.1, 0.0]
+    s = Sampler(5, 50, temperature=[1.0, 0.7, 1.0, 1.3, 1.0], top_k=top_k, top_p=top_p, min_p=min_p)
+    out = s.process(logits)
+    expected = _reference_keep(logits / s.temperature[:, None], top_k, top_p, min_p)
+    assert torch.equal(torch.isfinite(out), expected)
+
+
+def test_greedy_rows_and_penalties():
+    logits = torch.tensor([[2.0, 1.9, -1.0, 0.0], [2.0, 1.9, -1.0, 0.0], [2.0, 1.9, -1.0, 0.0]])
+    s = Sampler(3, 4, temperature=[0.0, 1.0, 0.0], top_k=[10, 0, 10], repetition_penalty=[1.0, 1.0, 2.0],
+                prompts=[[0], [0], [0, 2]])
+    assert s.sample(logits).tolist() == [0, 0, 1]  # row 2: token 0 penalized 2.0 -> 1.0
+    assert s.counts[2].tolist() == [1.0, 1.0, 1.0, 0.0] and s.steps.tolist() == [1, 1, 1]
+    p = s.process(logits)[2]
+    assert p[1] == 1.9 / 2 and p[2] == -2.0 and p[3] == 0.0
+    f = Sampler(1, 4, top_k=0, frequency_penalty=0.06, presence_penalty=0.0, prompts=[[0, 0]])
+    assert f.sample(logits[:1]).tolist() == [1]  # 2.0 - 2 * 0.06 < 1.9
+
+
+def test_per_row_seeds_are_batch_independent():
+    torch.manual_seed(0)
+    logits = torch.randn(3, 30)
+    batch = Sampler(3, 30, seeds=[11, 12, 13])
+    alone = Sampler(1, 30, seeds=[12])
+    for _ in range(10):
+        assert batch.sample(logits)[1] == alone.sample(logits[1:2])[0]
+    # rows follow select / extend
+    batch.select(torch.tensor([2, 1]))
+    assert batch.seeds.tolist() == [13, 12] and batch.counts.shape == (2, 30)
+    batch.extend(Sampler(1, 30, seeds=[5]))
+    assert batch.seeds.tolist() == [13, 12, 5] and batch.steps.tolist() == [10, 10, 0]
+
+
+def test_gumbel_sampling_matches_softmax():
+    logits = torch.tensor([1.0, 0.5, 0.0, -1.0, 2.0])
+    n = 40000
+    s = Sampler(n, 5, temperature=0.8, seeds=list(range(n)))
+    counts = torch.bincount(s.sample(logits.expand(n, 5)), minlength=5).float()
+    assert (counts / n - (logits / 0.8).softmax(0)).abs().max() < 0.01
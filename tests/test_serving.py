@@ -0,0 +1,84 @@
+import asyncio
+import collections
+import json
+import torch
+from src.model import MoETransformer
+from src.tokenizer import SimpleTokenizer
+from src.generation import generate_ids
+from src.serving import BatchEngine, InferenceServer, Request, kv_bytes_per_token
+
+CFG = dict(vocab_size=40, d_model=16, n_layers=2, n_heads=4, d_ff=32, num_experts=2)
+PROMPTS = [[1, 5, 6, 7, 8, 9, 10], [1, 11], [1, 12, 13, 14], [1, 15, 16, 17, 18, 19, 20, 21, 22, 23]]
+
+
+def _models():
+    torch.manual_seed(0)
+    yield MoETransformer(**CFG)
+    yield MoETransformer(**CFG, n_kv_heads=2, pos_encoding='rope', attn_window=3)
+
+
+def test_requests_joining_mid_decode_match_solo_generation():
+    for model in _models():
+        engine = BatchEngine(model, max_batch=8)
+        lengths = [6, 2, 5, 4]
+        reqs = [Request(p, max_new_tokens=n, top_k=0) for p, n in zip(PROMPTS, lengths)]
+        arrivals = {0: reqs[:1], 2: reqs[1:3], 3: reqs[3:]}
+        for t in range(20):
+            engine.step(arrivals.get(t, ()))
+        for r, p, n in zip(reqs, PROMPTS, lengths):
+            assert r.finish_reason == 'length'
+            assert r.tokens == generate_ids(model, [p], max_new_tokens=n, top_k=0)[0]
+        assert not engine.running
+
+
+def test_admission_by_kv_budget():
+    model = next(_models())
+    per_token = kv_bytes_per_token(model)
+    assert per_token == 2 * CFG['n_layers'] * CFG['d_model'] * 4
+    engine = BatchEngine(model, max_batch=8, max_kv_bytes=per_token * 20)
+    waiting = collections.deque(Request(p, max_new_tokens=5, top_k=0) for p in PROMPTS[:3])
+    admitted = engine.admit(waiting)
+    assert len(admitted) == 1  # two rows of (7 + 5) columns would need 24 tokens
+    engine.step(admitted)
+    while engine.running or waiting:
+        engine.step(engine.admit(waiting))
+    assert not waiting
+
+
+async def _http(port, method, path, body=None):
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    data = json.dumps(body).encode() if body is not None else b''
+    writer.write(f'{method} {path} HTTP/1.1\r\nContent-Length: {len(data)}\r\n\r\n'.encode() + data)
+    await writer.drain()
+    raw = await reader.read()
+    writer.close()
+    head, _, payload = raw.partition(b'\r\n\r\n')
+    return head.split()[1], payload
+
+
+def test_http_generate_and_stream():
+    tok = SimpleTokenizer()
+    tok.build_vocab(['the cat sat on the mat', 'a dog ran in the park'], vocab_size=30)
+    torch.manual_seed(0)
+    model = MoETransformer(**dict(CFG, vocab_size=len(tok.vocab)))
+
+    async def scenario():
+        server = InferenceServer(BatchEngine(model, max_batch=4), tok)
+        srv = await server.start('127.0.0.1', 0)
+        port = srv.sockets[0].getsockname()[1]
+        body = {'prompt': 'the cat', 'max_new_tokens': 5, 'top_k': 0}
+        plain, streamed = await asyncio.gather(_http(port, 'POST', '/generate', body),
+                                               _http(port, 'POST', '/generate', dict(body, stream=True)))
+        stats = await _http(port, 'GET', '/stats')
+        srv.close()
+        server._loop_task.cancel()
+        return plain, streamed, stats
+
+    plain, streamed, stats = asyncio.run(scenario())
+    assert plain[0] == b'200' and streamed[0] == b'200'
+    result = json.loads(plain[1])
+    # chunked ndjson: size lines alternate with events
+    events = [json.loads(line) for line in streamed[1].split(b'\r\n') if line.startswith(b'{')]
+    assert events[-1]['done'] and events[-1]['text'] == result['text']
+    assert len(events) - 1 == result['tokens'] == events[-1]['tokens']
+    assert json.loads(stats[1])['completed'] == 2
@@ -0,0 +1,119 @@
+import pytest
+import torch
+from src.model import MoETransformer
+from src.tokenizer import SimpleTokenizer
+from src.generation import generate_ids
+from src.session import ChatSession, SessionStore
+from src.response_cache import ResponseCache
+from src.speculative import SpeculativeDecoder
+
+TEXTS = ['user: hello there deepernova: hi how can i help', 'tell me about the sea and the sky']
+
+
+def _setup(**kw):
+    tok = SimpleTokenizer()
+    tok.build_vocab(TEXTS, vocab_size=40)
+    torch.manual_seed(0)
+    model = MoETransformer(len(tok.vocab), d_model=16, n_layers=2, n_heads=4, d_ff=32, num_experts=2, **kw).eval()
+    return model, tok
+
+
+def _turn(session, message, n=6):
+    """Run one greedy turn; returns (context ids the reply was conditioned on, reply ids)."""
+    before = len(session.ids) + len(session._encode(f'{session.user_tag} {message} {session.bot_tag}'))
+    list(session.reply(message, max_new_tokens=n, top_k=0))
+    return session.ids[:before] if session.trims == 0 else None, session.ids[before:]
+
+
+def test_turns_reuse_cache_and_match_full_recompute():
+    for kw in ({}, {'pos_encoding': 'rope', 'n_kv_heads': 2}):
+        model, tok = _setup(**kw)
+        session = ChatSession(model, tok, system_prompt='hello there')
+        eos = tok.vocab['<eos>']
+        for msg in ('tell me about the sea', 'and the sky', 'hi'):
+            context, reply = _turn(session, msg)
+            assert reply == generate_ids(model, [context], max_new_tokens=6, top_k=0, eos_id=eos)[0]
+            # everything but the newest token is cached; only the next turn gets prefilled
+            assert len(session.ids) - session.cache.length in (0, 1)
+
+
+def test_window_policy_drops_oldest_turns():
+    model, tok = _setup()
+    session = ChatSession(model, tok, system_prompt='hello there', max_context=40)
+    for msg in ['tell me about the sea'] * 6:
+        list(session.reply(msg, max_new_tokens=6, top_k=0))
+        assert len(session.ids) <= 40
+    assert session.trims > 0
+    assert session.ids[:session.system_len] == [tok.vocab['<bos>']] + tok.encode('hello there')[1:-1]
+    assert all(session.ids[t] == tok.vocab['user:'] for t in session.turn_starts)
+
+
+def test_stop_string_is_dropped_from_ids_and_cache():
+    model, tok = _setup()
+    probe = ChatSession(model, tok, system_prompt='hello there')
+    context, reply = _turn(probe, 'tell me about the sea')
+    i = next(i for i in range(1, len(reply)) if tok.inv_vocab[reply[i]] not in ('<eos>', '<unk>', '<pad>', '<bos>'))
+    session = ChatSession(model, tok, system_prompt='hello there')
+    list(session.reply('tell me about the sea', max_new_tokens=6, stop=[tok.inv_vocab[reply[i]]], top_k=0))
+    kept = session.ids[len(context):]
+    assert kept == reply[:len(kept)] and len(kept) <= i
+    assert len(session.ids) - session.cache.length in (0, 1)
+    # the next turn sees the truncated reply, exactly as a full recompute would
+    context, reply = _turn(session, 'and the sky')
+    assert reply == generate_ids(model, [context], max_new_tokens=6, top_k=0, eos_id=tok.vocab['<eos>'])[0]
+
+
+def test_checkpoint_and_store_roundtrip(tmp_path):
+    model, tok = _setup()
+    session = ChatSession(model, tok, system_prompt='hello there')
+    list(session.reply('tell me about the sea', max_new_tokens=4, top_k=0))
+    session.save(tmp_path / 's.pt')
+    restored = ChatSession.load(tmp_path / 's.pt', model, tok)
+    assert list(restored.reply('and the sky', top_k=0)) == list(session.reply('and the sky', top_k=0))
+    assert restored.ids == session.ids
+
+    store = SessionStore(tmp_path / 'store', model, tok, max_live=1, system_prompt='hello there')
+    list(store.get('a').reply('hi', max_new_tokens=3, top_k=0))
+    ids_a = list(store.get('a').ids)
+    store.get('b')  # 'a' is least recently used beyond max_live: checkpointed to disk
+    assert list(store.live) == ['b'] and (tmp_path / 'store' / 'a.pt').exists()
+    assert store.get('a').ids == ids_a and list(store.live) == ['a']
+
+
+def test_unsupported_sampling_leaves_conversation_unchanged():
+    model, tok = _setup()
+    session = ChatSession(model, tok, system_prompt='hello there', speculative=SpeculativeDecoder(model, model, k=2))
+    before = (list(session.ids), list(session.turn_starts))
+    with pytest.raises(TypeError, match='top_p'):
+        list(session.reply('tell me about the sea', max_new_tokens=4, top_k=0, top_p=0.9))
+    assert (session.ids, session.turn_starts) == before
+    list(session.reply('tell me about the sea', max_new_tokens=4, top_k=0))
+    assert session.turn_starts == [len(before[0])]
+
+
+def test_response_cache_replays_greedy_replies():
+    model, tok = _setup()
+    rc = ResponseCache('ckpt', 'tok')
+    first = ChatSession(model, tok, system_prompt='hello there', response_cache=rc)
+    text = ''.join(first.reply('tell me about the sea', max_new_tokens=6, top_k=0))
+    again = ChatSession(model, tok, system_prompt='hello there', response_cache=rc)
+    assert ''.join(again.reply('tell me about the sea', max_new_tokens=6, top_k=0)) == text
+    assert again.ids == first.ids and rc.stats['hits'] == 1
+    # the replayed reply is prefilled with the next turn
+    assert _turn(again, 'and the sky') == _turn(first, 'and the sky')
+    list(again.reply('hi', max_new_tokens=6, top_k=10))  # sampled: not cached
+    assert rc.stats['lookups'] == 4 and len(rc.entries) == 2
+
+
+def test_response_cache_stores_reply_cut_at_stop_string():
+    model, tok = _setup()
+    context, reply = _turn(ChatSession(model, tok, system_prompt='hello there'), 'tell me about the sea')
+    stop = [tok.inv_vocab[t] for t in reply[1:] if tok.inv_vocab[t] not in ('<eos>', '<unk>', '<pad>', '<bos>')][:1]
+    rc = ResponseCache('ckpt', 'tok')
+    first = ChatSession(model, tok, system_prompt='hello there', response_cache=rc)
+    list(first.reply('tell me about the sea', max_new_tokens=6, stop=stop, top_k=0))
+    assert len(first.ids) < len(context) + len(reply)
+    assert list(rc.entries.values()) == [first.ids[len(context):]]
+    again = ChatSession(model, tok, system_prompt='hello there', response_cache=rc)
+    list(again.reply('tell me about the sea', max_new_tokens=6, stop=stop, top_k=0))
+    assert again.ids == first.ids and rc.stats['hits'] == 1
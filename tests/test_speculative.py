@@ -0,0 +1,73 @@
+import torch
+from src.model import MoETransformer
+from src.tokenizer import SimpleTokenizer
+from src.generation import generate_ids
+from src.session import ChatSession, SessionStore
+from src.speculative import SpeculativeDecoder, sampling_probs
+
+VOCAB = 12
+
+
+def _models(vocab=VOCAB):
+    torch.manual_seed(0)
+    target = MoETransformer(vocab, d_model=32, n_layers=2, n_heads=4, d_ff=64, num_experts=2).eval()
+    draft = MoETransformer(vocab, d_model=16, n_layers=1, n_heads=2, d_ff=32, num_experts=2).eval()
+    return target, draft
+
+
+def test_greedy_output_matches_target():
+    target, draft = _models()
+    spec = SpeculativeDecoder(target, draft, k=3)
+    prompt = [1, 4, 5, 6]
+    assert spec.generate(prompt, max_new_tokens=12, top_k=0) == generate_ids(target, [prompt], max_new_tokens=12, top_k=0)[0]
+    s = spec.stats
+    assert s['tokens'] == 12 and s['passes'] + s['accepted'] == 12  # each pass: accepted drafts + one token
+    # the draft of the target itself is always accepted
+    self_spec = SpeculativeDecoder(target, target, k=3)
+    self_spec.generate(prompt, max_new_tokens=12, top_k=0)
+    assert self_spec.stats['accepted'] == self_spec.stats['drafted'] and self_spec.stats['passes'] == 3
+
+
+def test_sampled_tokens_follow_target_distribution():
+    target, draft = _models()
+    spec = SpeculativeDecoder(target, draft, k=2)
+    prompt = [1, 4, 5]
+    with torch.no_grad():
+        p = sampling_probs(target(torch.tensor([prompt]), last_only=True)[0][0, -1], temperature=1.0, top_k=VOCAB)
+    g = torch.Generator().manual_seed(0)
+    n = 3000
+    counts = torch.zeros(VOCAB)
+    for _ in range(n):
+        counts[spec.generate(prompt, max_new_tokens=3, temperature=1.0, top_k=VOCAB, generator=g)[0]] += 1
+    assert (counts / n - p).abs().max() < 0.03
+    assert 0 < spec.stats['accepted'] < spec.stats['drafted']
+
+
+def _chat_models():
+    tok = SimpleTokenizer()
+    tok.build_vocab(['user: hello there deepernova: hi how can i help', 'tell me about the sea'], vocab_size=40)
+    return (tok,) + _models(len(tok.vocab))
+
+
+def test_chat_session_with_draft_matches_plain_session():
+    tok, target, draft = _chat_models()
+    plain = ChatSession(target, tok, system_prompt='hello there')
+    fast = ChatSession(target, tok, system_prompt='hello there', speculative=SpeculativeDecoder(target, draft, k=4))
+    for msg in ('tell me about the sea', 'hi'):
+        assert list(fast.reply(msg, max_new_tokens=8, top_k=0)) == list(plain.reply(msg, max_new_tokens=8, top_k=0))
+        assert fast.ids == plain.ids
+
+
+def test_store_reloads_session_with_its_draft(tmp_path):
+    tok, target, draft = _chat_models()
+    spec = SpeculativeDecoder(target, draft, k=4)
+    store = SessionStore(tmp_path, target, tok, system_prompt='hello there', speculative=spec)
+    plain = ChatSession(target, tok, system_prompt='hello there')
+    list(store.get('a').reply('tell me about the sea', max_new_tokens=8, top_k=0))
+    list(plain.reply('tell me about the sea', max_new_tokens=8, top_k=0))
+    store.offload('a')
+    session = store.get('a')
+    assert session.speculative is spec
+    passes = spec.stats['passes']
+    assert list(session.reply('hi', max_new_tokens=8, top_k=0)) == list(plain.reply('hi', max_new_tokens=8, top_k=0))
+    assert spec.stats['passes'] > passes and session.ids == plain.ids
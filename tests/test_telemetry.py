@@ -0,0 +1,38 @@
+import json
+import time
+from src.telemetry import Telemetry, estimate_flops_per_token
+
+
+def test_step_records_phases_and_jsonl(tmp_path):
+    path = tmp_path / 'tel.jsonl'
+    tel = Telemetry(str(path), flops_per_token=1e6, peak_flops=1e12)
+    for step in range(2):
+        for _ in tel.timed([1, 2]):
+            with tel.phase('forward'):
+                time.sleep(0.001)
+        tel.end_step(step, tokens=100, loss=1.0)
+    tel.close()
+
+    lines = [json.loads(l) for l in path.read_text().splitlines()]
+    assert len(lines) == 2
+    assert set(lines[0]['phases']) == {'data', 'forward'}
+    assert lines[0]['tokens_per_s'] > 0 and 'mfu' in lines[0] and lines[0]['loss'] == 1.0
+    summary = tel.summary()
+    assert summary['steps'] == 2 and summary['tokens'] == 200
+    assert 0 < summary['phase_frac']['forward'] <= 1
+
+
+def test_disabled_is_noop(tmp_path):
+    tel = Telemetry(str(tmp_path / 'x.jsonl'), enabled=False)
+    with tel.phase('forward'):
+        pass
+    assert list(tel.timed([1, 2])) == [1, 2]
+    assert tel.end_step(0, 10) is None
+    assert not (tmp_path / 'x.jsonl').exists()
+
+
+def test_flops_estimate_counts_only_active_experts():
+    cfg = {'vocab_size': 100, 'd_model': 64, 'n_layers': 2, 'd_ff': 256, 'num_experts': 8, 'moe_top_k': 1}
+    top2 = dict(cfg, moe_top_k=2)
+    extra = estimate_flops_per_token(top2, 32) - estimate_flops_per_token(cfg, 32)
+    assert extra == 3 * 2 * 2 * (2 * 64 * 256)  # training x 2 FLOPs/MAC x layers x one expert
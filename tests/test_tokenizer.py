@@ -1,4 +1,4 @@
-from src.tokenizer import SimpleTokenizer
+from src.tokenizer import SimpleTokenizer, IncrementalDecoder
 
 
 def test_tokenizer_roundtrip():
@@ -9,3 +9,33 @@ def test_tokenizer_roundtrip():
     decoded = tok.decode(encoded)
     assert "hello" in decoded
     assert "world" in decoded
+
+
+def _tok():
+    tok = SimpleTokenizer()
+    tok.build_vocab(["the cat sat user: on the mat"], vocab_size=20)
+    return tok
+
+
+def test_incremental_decoder_matches_decode():
+    tok = _tok()
+    ids = [tok.vocab[w] for w in "the cat sat on the mat".split()]
+    dec = IncrementalDecoder(tok)
+    deltas = [dec.push(i) for i in ids]
+    assert "".join(deltas) + dec.flush() == tok.decode(ids) == dec.text
+    assert all(deltas)  # nothing held back without stop strings
+
+
+def test_incremental_decoder_specials_and_stop_strings():
+    tok = _tok()
+    v = tok.vocab
+    dec = IncrementalDecoder(tok, unk_text="?")
+    out = [dec.push(i) for i in [v["<bos>"], v["the"], 999, v["<eos>"], v["cat"]]]
+    assert out == ["", "the", " ?", "", ""] and dec.stopped
+
+    dec = IncrementalDecoder(tok, stop=["user: on"])
+    out = [dec.push(v[w]) for w in ["cat", "user:", "the"]]
+    assert out == ["cat", " ", "user: the"] and not dec.stopped  # "user:" held back until ruled out
+    out = [dec.push(v[w]) for w in ["user:", "on", "mat"]]
+    assert out == [" ", "", ""] and dec.stopped
+    assert dec.text == "cat user: the "
@@ -1,10 +1,22 @@
 import argparse
+import os
 import torch
 import torch.nn as nn
 from torch.utils.data import DataLoader, Dataset
 import json
 from src.model import MoETransformer, count_parameters
 from src.tokenizer import SimpleTokenizer
+from src.checkpoint import (load_model, AsyncCheckpointWriter, training_state, load_training_state,
+                            resume_model, restore_rng_state, latest_checkpoint)
+from src.sampler import ResumableSampler
+from src.optim import build_optimizer, moe_param_groups, OPTIMIZERS
+from src.accumulation import macro_batches, accumulate_gradients
+from src.telemetry import Telemetry, estimate_flops_per_token
+from src.profiling import StepProfiler
+from src.evaluation import load_eval_batches, evaluate, format_metrics
+from src.autotune import apply_profile
+from src.adaptive_head import parse_cutoffs
+from src.distributed import init_distributed, pin_cores, wrap_ddp, unwrap, is_main_process, cleanup
 from tqdm import tqdm
 
 class TokenDataset(Dataset):
@@ -45,11 +57,56 @@ if __name__ == '__main__':
     parser.add_argument('--config', choices=['tiny', 'default', '3b'], default='tiny')
     parser.add_argument('--deepspeed', action='store_true', help='Use DeepSpeed for distributed/sharded training')
     parser.add_argument('--deepspeed_config', default='deepspeed_config.json')
+    parser.add_argument('--adaptive-softmax', default=None, metavar='CUTOFFS', help="Adaptive softmax head: 'auto' or frequency cutoffs like '1000,3000'")
+    parser.add_argument('--pos-encoding', choices=['learned', 'rope'], default='learned', help="'rope' = rotary positions, no 1024-token limit")
+    parser.add_argument('--attn-window', type=int, default=None, help='Sliding attention window (tokens); memory grows linearly with --seq-len')
+    parser.add_argument('--n-kv-heads', type=int, default=None, help='Key/value heads (< n_heads = grouped-query attention, 1 = multi-query)')
     parser.add_argument('--moe-top-k', type=int, default=1, choices=[1,2], help='Top-k gating in MoE (1 or 2)')
     parser.add_argument('--accum-steps', type=int, default=1, help='Gradient accumulation steps')
+    parser.add_argument('--accum-tokens', type=int, default=0, help='Accumulate micro-batches until this many non-pad tokens (overrides --accum-steps)')
+    parser.add_argument('--clip-grad', type=float, default=1.0, help='Max gradient norm per optimizer step (0 = off)')
+    parser.add_argument('--optimizer', choices=OPTIMIZERS, default='adamw', help='Optimizer; adamw8bit/adafactor shrink optimizer state')
+    parser.add_argument('--lazy-experts', action='store_true', help='Skip optimizer updates for experts that got no tokens (adamw/adamw8bit)')
     parser.add_argument('--save-dir', default='checkpoints', help='Directory to save checkpoints')
     parser.add_argument('--save-every', type=int, default=1, help='Save every N epochs')
+    parser.add_argument('--save-steps', type=int, default=0, help='Also write a full training state every N optimizer steps (0 = off)')
+    parser.add_argument('--resume', default=None, help="Resume from a full training state file ('latest' = newest in --save-dir)")
+    parser.add_argument('--seed', type=int, default=0, help='Seed for init and data order')
+    parser.add_argument('--keep-last', type=int, default=0, help='Keep only the newest K checkpoints (0 = keep all)')
+    parser.add_argument('--bucket-mb', type=int, default=25, help='DDP gradient bucket size in MB (torchrun mode)')
+    parser.add_argument('--threads-per-rank', type=int, default=None, help='Intra-op threads per DDP rank (default: size of its core slice)')
+    parser.add_argument('--telemetry', default=None, help='Write per-step telemetry (tokens/s, phase times, RSS, MFU) to this JSONL file')
+    parser.add_argument('--peak-tflops', type=float, default=None, help='Host peak TFLOP/s, used to report MFU')
+    parser.add_argument('--profile-steps', default=None, help="Profile optimizer steps 'start:count' with torch.profiler")
+    parser.add_argument('--profile-dir', default='profiles', help='Where profiler traces and top-ops tables go')
+    parser.add_argument('--eval-files', nargs='+', default=None, help='Held-out text files for validation perplexity')
+    parser.add_argument('--eval-every', type=int, default=0, help='Evaluate every N optimizer steps on --eval-max-batches batches (0 = epoch end only)')
+    parser.add_argument('--eval-batch', type=int, default=64, help='Eval batch size (inference mode, so larger than --batch)')
+    parser.add_argument('--eval-max-batches', type=int, default=50, help='Batches per periodic evaluation (epoch-end evaluation uses all)')
+    parser.add_argument('--threads', type=int, default=None, help='Intra-op threads (single process; see --threads-per-rank for torchrun)')
+    parser.add_argument('--data-workers', type=int, default=0, help='DataLoader worker processes')
+    parser.add_argument('--tune-profile', default=None, help='Profile from autotune.py: supplies --batch/--seq-len/--accum-steps/--threads/--data-workers unless given explicitly')
+    parser.add_argument('--init-from', default=None, help='Initialize weights from a checkpoint (loaded via meta device, no double allocation)')
+    known = parser.parse_known_args()[0]
+    tune_profile = apply_profile(parser, known.tune_profile) if known.tune_profile else None
     args = parser.parse_args()
+    if args.pos_encoding == 'learned' and args.seq_len > 1024:
+        parser.error('--seq-len above 1024 needs --pos-encoding rope (learned positions stop at 1024)')
+    torch.manual_seed(args.seed)
+
+    # Data-parallel CPU mode: launched by `torchrun --nproc_per_node N train.py ...`
+    rank, world_size, local_rank = init_distributed('gloo')
+    ddp = world_size > 1
+    main = is_main_process()
+    if ddp and args.accum_tokens:
+        parser.error('--accum-tokens needs every rank to step together; use --accum-steps with torchrun')
+    if args.lazy_experts and args.optimizer == 'adafactor':
+        parser.error('--lazy-experts is supported for adamw and adamw8bit only')
+    if ddp:
+        cores = pin_cores(local_rank, int(os.environ.get('LOCAL_WORLD_SIZE', world_size)), args.threads_per_rank)
+        print(f'[rank {rank}/{world_size}] cores={cores} threads={torch.get_num_threads()}')
+    elif args.threads:
+        torch.set_num_threads(args.threads)
 
     with open(args.tokenizer, 'r', encoding='utf-8') as f:
         tok_data = json.load(f)
@@ -57,7 +114,14 @@ if __name__ == '__main__':
 
     texts = [l.strip() for l in open(args.input, 'r', encoding='utf-8') if l.strip()]
     ds = TokenDataset(texts, tok, seq_len=args.seq_len)
-    dl = DataLoader(ds, batch_size=args.batch, shuffle=True, collate_fn=collate_fn)
+    # seeded per-epoch order so a resumed run replays exactly the same batches
+    # (each DDP rank reads its own shard)
+    sampler = ResumableSampler(ds, shuffle=True, seed=args.seed, num_replicas=world_size, rank=rank)
+    dl = DataLoader(ds, batch_size=args.batch, sampler=sampler, collate_fn=collate_fn, num_workers=args.data_workers,
+                    generator=torch.Generator().manual_seed(args.seed))
+    # tokenized once; every rank holds the list and evaluates its own slice
+    eval_batches = (load_eval_batches(args.eval_files, tok, seq_len=args.seq_len, batch_size=args.eval_batch)
+                    if args.eval_files else None)
 
     if args.config == 'tiny':
         cfg = {'vocab_size': len(tok.vocab), 'd_model': 128, 'n_layers': 2, 'n_heads': 4, 'd_ff': 256, 'num_experts': 4, 'moe_top_k': args.moe_top_k}
@@ -67,28 +131,62 @@ if __name__ == '__main__':
         cfg = {'vocab_size': 5000, 'd_model': 512, 'n_layers': 16, 'n_heads': 8, 'd_ff': 2048, 'num_experts': 8, 'moe_top_k': args.moe_top_k}
     else:
         cfg = {'vocab_size': len(tok.vocab), 'd_model': 1024, 'n_layers': 22, 'n_heads': 16, 'd_ff': 4096, 'num_experts': 16, 'moe_top_k': args.moe_top_k}
+    if args.pos_encoding != 'learned':
+        cfg['pos_encoding'] = args.pos_encoding
+    if args.attn_window:
+        cfg['attn_window'] = args.attn_window
+    if args.n_kv_heads:
+        cfg['n_kv_heads'] = args.n_kv_heads
+    if args.adaptive_softmax:
+        cfg['adaptive_cutoffs'] = parse_cutoffs(args.adaptive_softmax, cfg['vocab_size'])
+
+    if tune_profile is not None and main:
+        print(f"Tune profile {args.tune_profile}: batch={args.batch} seq_len={args.seq_len} accum_steps={args.accum_steps} "
+              f"threads={torch.get_num_threads()} data_workers={args.data_workers}")
+        if tune_profile.get('cfg') not in (None, cfg):
+            print('Warning: the tune profile was measured for a different model config')
 
-    model = MoETransformer(**cfg)
+    state = None
+    if args.resume:
+        resume_path = latest_checkpoint(args.save_dir) if args.resume == 'latest' else args.resume
+        if resume_path is None:
+            raise FileNotFoundError(f'no training state found in {args.save_dir}')
+        state = load_training_state(resume_path)
+        model = resume_model(state, cfg)
+        if main:
+            print('Resuming from', resume_path, state['progress'])
+    elif args.init_from:
+        model = load_model(args.init_from, cfg)
+        print('Initialized weights from', args.init_from)
+    else:
+        model = MoETransformer(**cfg)
 
     # device / distributed / DeepSpeed initialization
     # Auto-detect GPU (CUDA) or fall back to CPU
-    if torch.cuda.is_available():
+    if torch.cuda.is_available() and not ddp:
         device = torch.device('cuda')
         print(f'🚀 Using GPU: {torch.cuda.get_device_name(0)}')
         print(f'   VRAM Available: {torch.cuda.get_device_properties(0).total_memory / 1e9:.1f} GB')
     else:
         device = torch.device('cpu')
-        print('⚠️  CUDA not available. Falling back to CPU.')
+        if main:
+            print('⚠️  CUDA not available. Falling back to CPU.' if not ddp else f'DDP on CPU (gloo), {world_size} ranks')
     
     model.to(device)
 
-    print('Params:', count_parameters(model))
+    if main:
+        print('Params:', count_parameters(model))
+    if ddp:
+        model = wrap_ddp(model, bucket_cap_mb=args.bucket_mb)
 
-    opt = torch.optim.AdamW(model.parameters(), lr=1e-4)
+    params = moe_param_groups(unwrap(model)) if args.lazy_experts else model.parameters()
+    opt = build_optimizer(args.optimizer, params, lr=1e-4, lazy_experts=args.lazy_experts)
+    if state is not None:
+        opt.load_state_dict(state['optimizer'])
     ce = nn.CrossEntropyLoss(ignore_index=0)
 
     # Optional: integrate DeepSpeed if requested
-    if args.deepspeed:
+    if args.deepspeed and not ddp:
         try:
             import deepspeed
             ds_engine, opt, _, _ = deepspeed.initialize(args=None, model=model, model_parameters=model.parameters(), config=args.deepspeed_config)
@@ -98,38 +196,92 @@ if __name__ == '__main__':
             print('DeepSpeed initialization failed:', e)
             print('Proceeding without DeepSpeed')
 
+    writer = AsyncCheckpointWriter(args.save_dir, keep_last=args.keep_last)
+    telemetry = Telemetry(args.telemetry, flops_per_token=estimate_flops_per_token(cfg, args.seq_len),
+                          peak_flops=args.peak_tflops * 1e12 if args.peak_tflops else None,
+                          enabled=bool(args.telemetry) and main, sync_cuda=device.type == 'cuda')
+    profiler = StepProfiler(args.profile_steps if main else None, out_dir=args.profile_dir, name='train')
+
+    progress = {'epoch': 0, 'batch': 0, 'global_step': 0, 'opt_step': 0, 'accum_phase': 0}
+    if state is not None:
+        progress.update(state['progress'])
+        restore_rng_state(state['rng'])
+        state = None
+
     model.train()
-    global_step = 0
-    for ep in range(args.epochs):
-        pbar = tqdm(dl, desc=f'Epoch {ep+1}')
-        for batch in pbar:
-            batch = batch.to(device)
-            # inputs and targets shifted by 1
-            inputs = batch[:, :-1]
-            targets = batch[:, 1:]
-            logits, aux = model(inputs)
-            logits = logits.reshape(-1, logits.size(-1))
-            targets = targets.reshape(-1)
-            loss = ce(logits, targets) + 1e-2 * aux
+    global_step = progress['global_step']
+    opt_step = progress['opt_step']
+    for ep in range(progress['epoch'], args.epochs):
+        # skip the batches of this epoch that were consumed before the checkpoint
+        skip = progress['batch'] if ep == progress['epoch'] else 0
+        sampler.set_epoch(ep, start=skip * args.batch)
+        pbar = tqdm(total=skip + len(dl), desc=f'Epoch {ep+1}', initial=skip, disable=not main)
+        batch_idx = skip
+        telemetry.reset_summary()
+        telemetry.start()
+        for micro_batches in telemetry.timed(macro_batches(dl, args.accum_steps, args.accum_tokens)):
+            with telemetry.phase('data'):
+                micro_batches = [b.to(device) for b in micro_batches]
+            batch_idx += len(micro_batches)
+            global_step += len(micro_batches)
+            pbar.update(len(micro_batches))
             if args.deepspeed and hasattr(model, 'backward'):
-                model.backward(loss)
-                model.step()
-            else:
-                loss = loss / args.accum_steps
-                opt.zero_grad()
-                loss.backward()
-                if (global_step + 1) % args.accum_steps == 0:
-                    opt.step()
-                global_step += 1
-            pbar.set_postfix({'loss': float(loss.detach().cpu())})
+                # DeepSpeed accumulates according to its own config
+                for batch in micro_batches:
+                    logits, aux = model(batch[:, :-1])
+                    loss = ce(logits.reshape(-1, logits.size(-1)), batch[:, 1:].reshape(-1)) + 1e-2 * aux
+                    model.backward(loss)
+                    model.step()
+                pbar.set_postfix({'loss': float(loss.detach().cpu())})
+                continue
+            # one macro-batch: token-weighted accumulation, then a single clip + optimizer step
+            # (under DDP only the last micro-batch all-reduces)
+            loss, n_tokens = accumulate_gradients(model, micro_batches, no_sync=model.no_sync if ddp else None,
+                                                  telemetry=telemetry)
+            with telemetry.phase('optimizer'):
+                if args.clip_grad > 0:
+                    torch.nn.utils.clip_grad_norm_(model.parameters(), args.clip_grad)
+                opt.step()
+                opt.zero_grad(set_to_none=True)
+            opt_step += 1
+            if args.save_steps and opt_step % args.save_steps == 0 and main:
+                progress = {'epoch': ep, 'batch': batch_idx, 'global_step': global_step,
+                            'opt_step': opt_step, 'accum_phase': 0}
+                with telemetry.phase('checkpoint'):
+                    writer.save(training_state(unwrap(model), opt, progress), f'state_step{opt_step}.pt', group='state')
+            eval_metrics = {}
+            if eval_batches and args.eval_every and opt_step % args.eval_every == 0:
+                with telemetry.phase('eval'):
+                    m = evaluate(unwrap(model), eval_batches, device=device, max_batches=args.eval_max_batches)
+                eval_metrics = {'eval_loss': m['loss'], 'eval_ppl': m['ppl']}
+                if main:
+                    pbar.write(f'step {opt_step} eval: {format_metrics(m)}')
+            telemetry.end_step(opt_step, n_tokens, loss=loss, **eval_metrics)
+            profiler.step()
+            pbar.set_postfix({'loss': loss, 'tokens': n_tokens})
+        pbar.close()
+        if telemetry.enabled:
+            print(f'Epoch {ep+1} telemetry: {telemetry.format_summary()}')
+        if eval_batches:
+            m = evaluate(unwrap(model), eval_batches, device=device)
+            if main:
+                print(f'Epoch {ep+1} eval: {format_metrics(m)}')
 
         # checkpointing
         if (ep + 1) % args.save_every == 0:
-            import os
             os.makedirs(args.save_dir, exist_ok=True)
             if args.deepspeed and hasattr(model, 'save_checkpoint'):
                 model.save_checkpoint(args.save_dir, tag=f'epoch{ep+1}')
-            else:
-                torch.save(model.state_dict(), os.path.join(args.save_dir, f'model_epoch{ep+1}.pt'))
+            elif main:
+                stall = writer.save(unwrap(model).state_dict(), f'model_epoch{ep+1}.pt')
+                print(f'Checkpoint queued: model_epoch{ep+1}.pt (stall {stall * 1000:.1f} ms)')
 
-    print('Training finished (CPU/demo or distributed if DeepSpeed).')
+    writer.close()
+    telemetry.close()
+    profiler.stop()
+    cleanup()
+    if writer.stats['saves']:
+        print(f"Checkpoints: {writer.stats['saves']} written, {writer.stats['bytes'] / 1e6:.1f} MB, "
+              f"stall {writer.stats['stall_s']:.2f}s, background write {writer.stats['write_s']:.2f}s")
+    if main:
+        print('Training finished (CPU/demo or distributed if DeepSpeed).')
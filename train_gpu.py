@@ -11,6 +11,16 @@ from torch.utils.data import DataLoader, Dataset
 import json
 from src.model import MoETransformer, count_parameters
 from src.tokenizer import SimpleTokenizer
+from src.checkpoint import (load_model, AsyncCheckpointWriter, training_state, load_training_state,
+                            resume_model, restore_rng_state, latest_checkpoint)
+from src.sampler import ResumableSampler
+from src.optim import build_optimizer, moe_param_groups, OPTIMIZERS
+from src.accumulation import macro_batches, accumulate_gradients
+from src.telemetry import Telemetry, estimate_flops_per_token
+from src.profiling import StepProfiler
+from src.instrument import LayerInstrumenter
+from src.evaluation import load_eval_batches, evaluate, format_metrics
+from src.adaptive_head import parse_cutoffs
 from tqdm import tqdm
 import os
 import time
@@ -51,9 +61,37 @@ if __name__ == '__main__':
     parser.add_argument('--batch', type=int, default=2)
     parser.add_argument('--seq-len', type=int, default=128)
     parser.add_argument('--config', choices=['tiny', 'default', '3b'], default='tiny')
+    parser.add_argument('--adaptive-softmax', default=None, metavar='CUTOFFS', help="Adaptive softmax head: 'auto' or frequency cutoffs like '1000,3000'")
+    parser.add_argument('--pos-encoding', choices=['learned', 'rope'], default='learned', help="'rope' = rotary positions, no 1024-token limit")
+    parser.add_argument('--attn-window', type=int, default=None, help='Sliding attention window (tokens); memory grows linearly with --seq-len')
+    parser.add_argument('--n-kv-heads', type=int, default=None, help='Key/value heads (< n_heads = grouped-query attention, 1 = multi-query)')
+    parser.add_argument('--accum-steps', type=int, default=1, help='Micro-batches per optimizer step')
+    parser.add_argument('--accum-tokens', type=int, default=0, help='Accumulate until this many non-pad tokens (overrides --accum-steps)')
+    parser.add_argument('--clip-grad', type=float, default=1.0)
+    parser.add_argument('--optimizer', choices=OPTIMIZERS, default='adamw', help='adamw8bit / adafactor use far less optimizer memory')
+    parser.add_argument('--lazy-experts', action='store_true', help='Skip optimizer updates for experts that got no tokens (adamw/adamw8bit)')
     parser.add_argument('--save-dir', default='checkpoints')
     parser.add_argument('--save-every', type=int, default=1)
+    parser.add_argument('--save-steps', type=int, default=0, help='Also write a full training state every N steps (0 = off)')
+    parser.add_argument('--resume', default=None, help="Resume from a full training state ('latest' = newest in --save-dir)")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--keep-last', type=int, default=0, help='Keep only the newest K checkpoints (0 = keep all)')
+    parser.add_argument('--telemetry', default=None, help='Per-step telemetry JSONL (tokens/s, phase breakdown, peak RSS, MFU)')
+    parser.add_argument('--peak-tflops', type=float, default=None, help='Device peak TFLOP/s for MFU')
+    parser.add_argument('--profile-steps', default=None, help="Profile steps 'start:count' with torch.profiler (Chrome trace + top ops)")
+    parser.add_argument('--profile-dir', default='profiles')
+    parser.add_argument('--instrument', action='store_true', help='Per-layer fwd/bwd time and activation size table each epoch')
+    parser.add_argument('--eval-files', nargs='+', default=None, help='Held-out text files for validation perplexity')
+    parser.add_argument('--eval-every', type=int, default=0, help='Evaluate every N steps on --eval-max-batches batches (0 = epoch end only)')
+    parser.add_argument('--eval-batch', type=int, default=64)
+    parser.add_argument('--eval-max-batches', type=int, default=50, help='Batches per periodic evaluation (epoch end uses all)')
+    parser.add_argument('--init-from', default=None, help='Initialize weights from a checkpoint (meta-device load)')
     args = parser.parse_args()
+    if args.lazy_experts and args.optimizer == 'adafactor':
+        parser.error('--lazy-experts is supported for adamw and adamw8bit only')
+    if args.pos_encoding == 'learned' and args.seq_len > 1024:
+        parser.error('--seq-len above 1024 needs --pos-encoding rope (learned positions stop at 1024)')
+    torch.manual_seed(args.seed)
 
     # Load tokenizer
     print('[*] Loading tokenizer...')
@@ -72,8 +110,14 @@ if __name__ == '__main__':
     # Create dataset
     print('[*] Preparing dataset...')
     ds = TokenDataset(texts[:min(len(texts), 1000000)], tok, seq_len=args.seq_len)  # Cap at 1M samples
-    dl = DataLoader(ds, batch_size=args.batch, shuffle=True, collate_fn=collate_fn, num_workers=0)
+    sampler = ResumableSampler(ds, shuffle=True, seed=args.seed)
+    dl = DataLoader(ds, batch_size=args.batch, sampler=sampler, collate_fn=collate_fn, num_workers=0,
+                    generator=torch.Generator().manual_seed(args.seed))
     print(f'[✓] {len(ds):,} training examples')
+    eval_batches = None
+    if args.eval_files:
+        eval_batches = load_eval_batches(args.eval_files, tok, seq_len=args.seq_len, batch_size=args.eval_batch)
+        print(f'[✓] {len(eval_batches):,} eval batches from {len(args.eval_files)} file(s)')
 
     # Model config
     if args.config == 'tiny':
@@ -82,10 +126,30 @@ if __name__ == '__main__':
         cfg = {'vocab_size': len(tok.vocab), 'd_model': 512, 'n_layers': 16, 'n_heads': 8, 'd_ff': 2048, 'num_experts': 8, 'moe_top_k': 1}
     else:
         cfg = {'vocab_size': len(tok.vocab), 'd_model': 256, 'n_layers': 8, 'n_heads': 8, 'd_ff': 1024, 'num_experts': 8, 'moe_top_k': 1}
+    if args.pos_encoding != 'learned':
+        cfg['pos_encoding'] = args.pos_encoding
+    if args.attn_window:
+        cfg['attn_window'] = args.attn_window
+    if args.n_kv_heads:
+        cfg['n_kv_heads'] = args.n_kv_heads
+    if args.adaptive_softmax:
+        cfg['adaptive_cutoffs'] = parse_cutoffs(args.adaptive_softmax, cfg['vocab_size'])
 
     # Create model
-    print('[*] Creating model...')
-    model = MoETransformer(**cfg)
+    state = None
+    if args.resume:
+        resume_path = latest_checkpoint(args.save_dir) if args.resume == 'latest' else args.resume
+        if resume_path is None:
+            raise FileNotFoundError(f'No training state found in {args.save_dir}')
+        print(f'[*] Resuming from {resume_path}...')
+        state = load_training_state(resume_path)
+        model = resume_model(state, cfg)
+    elif args.init_from:
+        print(f'[*] Loading weights from {args.init_from}...')
+        model = load_model(args.init_from, cfg)
+    else:
+        print('[*] Creating model...')
+        model = MoETransformer(**cfg)
     print(f'[✓] {count_parameters(model) / 1e6:.1f}M parameters')
 
     # Device
@@ -100,54 +164,102 @@ if __name__ == '__main__':
     model.to(device)
 
     # Training
-    opt = torch.optim.AdamW(model.parameters(), lr=1e-4)
-    ce = nn.CrossEntropyLoss(ignore_index=0)
+    params = moe_param_groups(model) if args.lazy_experts else model.parameters()
+    opt = build_optimizer(args.optimizer, params, lr=1e-4, lazy_experts=args.lazy_experts)
+    progress = {'epoch': 0, 'batch': 0, 'global_step': 0, 'epoch_loss': 0.0, 'epoch_steps': 0}
+    if state is not None:
+        opt.load_state_dict(state['optimizer'])
+        progress.update(state['progress'])
+        restore_rng_state(state['rng'])
+        print(f'[✓] Resumed at epoch {progress["epoch"] + 1}, batch {progress["batch"]}, step {progress["global_step"]}')
+        state = None
     
     model.train()
     
     print(f'\n{"="*60}')
-    print(f'Starting training: {args.epochs} epochs, batch={args.batch}')
+    print(f'Starting training: {args.epochs} epochs, batch={args.batch}, accum={args.accum_tokens or args.accum_steps}{" tokens" if args.accum_tokens else ""}')
     print(f'{"="*60}\n')
     
-    global_step = 0
-    for ep in range(args.epochs):
-        pbar = tqdm(dl, desc=f'Epoch {ep+1}/{args.epochs}', unit='batch')
-        epoch_loss = 0
+    writer = AsyncCheckpointWriter(args.save_dir, keep_last=args.keep_last)
+    telemetry = Telemetry(args.telemetry, flops_per_token=estimate_flops_per_token(cfg, args.seq_len),
+                          peak_flops=args.peak_tflops * 1e12 if args.peak_tflops else None,
+                          enabled=bool(args.telemetry), sync_cuda=device.type == 'cuda')
+    profiler = StepProfiler(args.profile_steps, out_dir=args.profile_dir, name='train')
+    instrument = LayerInstrumenter(model, sync_cuda=device.type == 'cuda').attach() if args.instrument else None
+
+    global_step = progress['global_step']
+    for ep in range(progress['epoch'], args.epochs):
+        # Skip batches already consumed before the checkpoint
+        skip = progress['batch'] if ep == progress['epoch'] else 0
+        sampler.set_epoch(ep, start=skip * args.batch)
+        pbar = tqdm(desc=f'Epoch {ep+1}/{args.epochs}', unit='batch', initial=skip, total=skip + len(dl))
+        epoch_loss = progress['epoch_loss'] if skip else 0
+        epoch_steps = progress['epoch_steps'] if skip else 0
+        batch_idx = skip
+        telemetry.reset_summary()
+        telemetry.start()
         
-        for batch_idx, batch in enumerate(pbar):
-            batch = batch.to(device)
-            
-            # Forward
-            inputs = batch[:, :-1]
-            targets = batch[:, 1:]
+        for micro_batches in telemetry.timed(macro_batches(dl, args.accum_steps, args.accum_tokens)):
+            with telemetry.phase('data'):
+                micro_batches = [b.to(device) for b in micro_batches]
+            batch_idx += len(micro_batches)
             
-            logits, load_loss = model(inputs)
+            # Forward + backward over the macro-batch (loss normalized by real tokens)
+            loss, n_tokens = accumulate_gradients(model, micro_batches, telemetry=telemetry)
             
-            # Loss
-            loss = ce(logits.reshape(-1, len(tok.vocab)), targets.reshape(-1))
-            loss = loss + 0.01 * load_loss
+            # One clip + optimizer step per macro-batch
+            with telemetry.phase('optimizer'):
+                if args.clip_grad > 0:
+                    torch.nn.utils.clip_grad_norm_(model.parameters(), args.clip_grad)
+                opt.step()
+                opt.zero_grad(set_to_none=True)
             
-            # Backward
-            opt.zero_grad()
-            loss.backward()
-            torch.nn.utils.clip_grad_norm_(model.parameters(), 1.0)
-            opt.step()
-            
-            epoch_loss += loss.item()
+            epoch_loss += loss
+            epoch_steps += 1
             global_step += 1
             
             # Progress
-            avg_loss = epoch_loss / (batch_idx + 1)
-            pbar.set_postfix({'loss': f'{avg_loss:.4f}'})
+            pbar.update(len(micro_batches))
+            avg_loss = epoch_loss / epoch_steps
+            pbar.set_postfix({'loss': f'{avg_loss:.4f}', 'tokens': n_tokens})
+            
+            # Full training state (weights, optimizer, RNG, data position)
+            if args.save_steps and global_step % args.save_steps == 0:
+                progress = {'epoch': ep, 'batch': batch_idx, 'global_step': global_step,
+                            'epoch_loss': epoch_loss, 'epoch_steps': epoch_steps, 'accum_phase': 0}
+                with telemetry.phase('checkpoint'):
+                    writer.save(training_state(model, opt, progress), f'state_step{global_step}.pt', group='state')
+            eval_metrics = {}
+            if eval_batches and args.eval_every and global_step % args.eval_every == 0:
+                with telemetry.phase('eval'):
+                    m = evaluate(model, eval_batches, device=device, max_batches=args.eval_max_batches)
+                eval_metrics = {'eval_loss': m['loss'], 'eval_ppl': m['ppl']}
+                pbar.write(f'[✓] Step {global_step} eval: {format_metrics(m)}')
+            telemetry.end_step(global_step, n_tokens, loss=loss, **eval_metrics)
+            profiler.step()
+        pbar.close()
+        if telemetry.enabled:
+            print(f'\n[✓] Epoch {ep+1} telemetry: {telemetry.format_summary()}')
+        if eval_batches:
+            print(f'[✓] Epoch {ep+1} eval: {format_metrics(evaluate(model, eval_batches, device=device))}')
+        if instrument is not None:
+            print(f'\n[✓] Epoch {ep+1} per-layer timing:\n{instrument.table()}')
+            instrument.reset()
         
         # Save
         if (ep + 1) % args.save_every == 0:
-            os.makedirs(args.save_dir, exist_ok=True)
             ckpt_path = f'{args.save_dir}/model_epoch{ep+1}.pt'
-            torch.save(model.state_dict(), ckpt_path)
-            size_mb = os.path.getsize(ckpt_path) / 1024 / 1024
-            print(f'\n[✓] Checkpoint: {ckpt_path} ({size_mb:.1f}MB)')
+            stall = writer.save(model.state_dict(), f'model_epoch{ep+1}.pt')
+            print(f'\n[✓] Checkpoint: {ckpt_path} (writing in background, stall {stall * 1000:.1f}ms)')
     
+    writer.close()
+    telemetry.close()
+    profiler.stop()
+    if instrument is not None:
+        instrument.detach()
+    if writer.stats['saves']:
+        print(f"[✓] Checkpoints: {writer.stats['saves']} written, {writer.stats['bytes'] / 1024 / 1024:.1f}MB, "
+              f"stall {writer.stats['stall_s']:.2f}s, background write {writer.stats['write_s']:.2f}s")
     print(f'\n{"="*60}')
     print(f'✅ Training complete!')
     print(f'{"="*60}')